@@ -0,0 +1,19 @@
+from hev.aio import close_async_dispatcher
+from hev.asgi import ASGIApp
+
+from functions.async_webhooks import async_entrypoint
+
+
+def create_asgi_app():
+    """Create the ASGI application, for deployments that don't run on
+    Google Cloud Functions. It can be served by any ASGI server, such as:
+
+        $ uvicorn asgi:app --workers 4
+
+    Returns:
+        An ASGI application that serves the asyncio webhook runtime
+    """
+    return ASGIApp({"/webhook": async_entrypoint}, on_shutdown=close_async_dispatcher)
+
+
+app = create_asgi_app()
@@ -0,0 +1,105 @@
+import sys
+import gzip
+import logging
+import argparse
+
+import hev
+
+from hev.api import DatadogAPI
+from hev.backfill import Backfill
+from hev.exceptions import ConfigException
+from hev.ingest import iter_csv, iter_json_array, iter_ndjson
+from hev.resilience import ResilientExporter, RetryPolicy
+
+PARSERS = {"csv": iter_csv, "ndjson": iter_ndjson, "json": iter_json_array}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Send historical HEV readings from a CSV or NDJSON file"
+    )
+    parser.add_argument(
+        "path", help="file with readings ('-' for stdin); '.gz' files are supported"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(PARSERS),
+        help="file format (default: detected from the file extension)",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-inflight", type=int, default=4)
+    parser.add_argument("--progress-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--dry-run",
+        action=argparse.BooleanOptionalAction,
+        help="validate readings without sending them (default: DRY_RUN)",
+    )
+    return parser.parse_args(argv)
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".json"):
+        return "json"
+    return "ndjson"
+
+
+def open_input(path):
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def main(argv=None):
+    """Backfill entrypoint. Readings must include a ``timestamp`` and the
+    same mandatory fields of DialogFlow requests.
+
+    Returns:
+        The process exit code
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args(argv)
+
+    try:
+        conf = hev.conf
+    except ConfigException as e:
+        logging.critical("Unable to load the configuration: %s", e)
+        return 2
+    if args.dry_run is None:
+        args.dry_run = conf.dry_run
+    if not args.dry_run and (conf.dd_api_key is None or conf.function_name is None):
+        logging.critical("DD_API_KEY and FUNCTION_NAME must be set")
+        return 2
+
+    api = DatadogAPI(
+        conf.dd_api_key,
+        conf.function_name,
+        args.dry_run,
+        api_host=conf.dd_api_host,
+        timeout=conf.export_timeout,
+    )
+    retry = RetryPolicy(
+        retries=conf.export_retries,
+        backoff=conf.retry_backoff,
+        deadline=conf.export_deadline,
+    )
+    pipeline = Backfill(
+        ResilientExporter(api, retry),
+        batch_size=args.batch_size,
+        max_inflight=args.max_inflight,
+        progress_interval=args.progress_interval,
+    )
+
+    parser = PARSERS[args.format or detect_format(args.path)]
+    with open_input(args.path) as stream:
+        stats = pipeline.run(parser(stream))
+
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Benchmark of the per-request cost of the webhook runtime adapters.
+
+The same webhook request is served in dry-run mode, in process, by:
+* ``handler``: the core handler called with a ``hev.handlers.Request``
+* ``wsgi``: the raw WSGI application of ``wsgi.py``
+* ``cloud_function``: the Cloud Function entrypoint called with a Flask
+  Request, as the Cloud Functions runtime does
+* ``flask``: the development Flask application of ``main.py``
+
+The difference with the ``handler`` time is the overhead of each adapter.
+Time per request is reported as JSON.
+
+Usage:
+    $ python -m benchmarks.bench_adapters [--number 5000]
+"""
+
+import io
+import json
+import timeit
+import argparse
+
+import flask
+
+from werkzeug.test import EnvironBuilder
+
+from main import create_app
+from wsgi import create_wsgi_app
+from functions import entrypoint
+from functions.webhooks import webhook
+from hev.adapters import from_wsgi
+from hev.testing import FakeDatadog
+
+from .bench_load import HEADERS, READING, configure
+
+ADAPTERS = ["handler", "wsgi", "cloud_function", "flask"]
+
+
+def make_environ():
+    """Return the WSGI environ and the body of a webhook request."""
+    body = json.dumps({"queryResult": {"parameters": READING}}).encode()
+    environ = EnvironBuilder(
+        path="/webhook",
+        method="POST",
+        headers=HEADERS,
+        data=body,
+        content_type="application/json",
+    ).get_environ()
+    return environ, body
+
+
+def make_call(adapter, environ, body):
+    """Return a function that serves the request with the given adapter.
+
+    Returns:
+        A function that returns the HTTP status of the reply
+    """
+    statuses = []
+
+    def start_response(status, headers):
+        statuses.append(int(status.split()[0]))
+
+    def request_environ():
+        return dict(environ, **{"wsgi.input": io.BytesIO(body)})
+
+    if adapter == "handler":
+        return lambda: webhook(from_wsgi(request_environ())).status
+    if adapter == "cloud_function":
+        return lambda: entrypoint(flask.Request(request_environ()))[1]
+
+    app = create_wsgi_app() if adapter == "wsgi" else create_app()
+
+    def call():
+        b"".join(app(request_environ(), start_response))
+        return statuses.pop()
+
+    return call
+
+
+def measure(adapter, number):
+    """Return the time per request of the given adapter.
+
+    Returns:
+        A dictionary with the time per request in microseconds and the
+        status of the reply
+    """
+    environ, body = make_environ()
+    call = make_call(adapter, environ, body)
+    status = call()
+    best = min(timeit.repeat(call, number=number, repeat=3))
+    return {
+        "adapter": adapter,
+        "us": round(best / number * 1e6, 2),
+        "status": status,
+    }
+
+
+def run(number=5000):
+    """Measure all adapters in dry-run mode.
+
+    Returns:
+        A list with one result for each adapter
+    """
+    with FakeDatadog() as server:
+        configure(server, dry_run=True)
+        return [measure(adapter, number) for adapter in ADAPTERS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.number), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Benchmark of the Flask and asyncio webhook runtimes at high concurrency.
+
+The same webhook request is served by the Flask application, from a pool of
+client threads, and by the ASGI application, from concurrent asyncio tasks
+that call the application directly. Series are submitted to a local
+``FakeDatadog`` server with a configurable latency, so that the cost of
+waiting for Datadog dominates as it does in production. Throughput and
+latency percentiles are reported as JSON.
+
+Usage:
+    $ python -m benchmarks.bench_async [--requests 1000] [--concurrency 16 64 256]
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from main import create_app
+from asgi import create_asgi_app
+from hev.aio import close_async_dispatcher
+from hev.testing import FakeDatadog
+
+from .bench_load import HEADERS, READING, _revision, configure, percentile, run_load
+
+RUNTIMES = ["flask", "asgi"]
+
+
+async def _call(app, path, body):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": [(b"content-type", b"application/json")]
+        + [(k.lower().encode(), v.encode()) for k, v in HEADERS.items()],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"]
+
+
+async def _run_asgi(app, path, payload, requests, concurrency):
+    body = json.dumps(payload).encode()
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def client():
+        async with slots:
+            start = time.perf_counter()
+            status = await _call(app, path, body)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    await close_async_dispatcher()
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": requests / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def run_asgi_load(app, path, payload, requests, concurrency):
+    """Send ``requests`` POST requests to the ASGI application, with at
+    most ``concurrency`` requests in flight.
+
+    Returns:
+        A dictionary with the same fields of ``bench_load.run_load()``
+    """
+    return asyncio.run(_run_asgi(app, path, payload, requests, concurrency))
+
+
+def run_runtime(name, requests, concurrency_levels, latency):
+    """Benchmark a runtime for each concurrency level.
+
+    Returns:
+        A list of results, one for each concurrency level
+    """
+    payload = {"queryResult": {"parameters": READING}}
+    if name == "flask":
+        app, run = create_app(), run_load
+    else:
+        app, run = create_asgi_app(), run_asgi_load
+
+    results = []
+    with FakeDatadog(latency=latency) as server:
+        for concurrency in concurrency_levels:
+            configure(server)
+            result = run(app, "/webhook", payload, requests, concurrency)
+            result.update(
+                runtime=name,
+                latency=latency,
+                submissions=server.requests,
+                points=sum(len(s["points"]) for s in server.series),
+            )
+            server.requests = 0
+            del server.series[:]
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runtime", nargs="+", choices=RUNTIMES, default=RUNTIMES)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="fake Datadog reply latency (s)"
+    )
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.runtime:
+        results.extend(run_runtime(name, args.requests, args.concurrency, args.latency))
+
+    report = {
+        "revision": _revision(),
+        "python": sys.version.split()[0],
+        "timestamp": int(time.time()),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Load benchmark of the webhook against a local fake Datadog API.
+
+Requests are sent to the Flask application returned by ``main.create_app``
+from a pool of client threads, while series are submitted to a local
+``FakeDatadog`` server with configurable latency and error rate. For each
+scenario and concurrency level, throughput and latency percentiles are
+reported as JSON so that results can be compared across commits.
+
+Scenarios:
+* ``sequential``: one webhook request at a time
+* ``concurrent``: webhook requests from concurrent clients
+* ``batched``: readings sent in batches to the ``/bulk`` endpoint
+* ``failures``: webhook requests while the fake Datadog returns errors
+* ``dry_run``: webhook requests without submissions
+
+Usage:
+    $ python -m benchmarks.bench_load [--requests 500] [--concurrency 1 4 16]
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+from datadog.api.api_client import APIClient
+
+import hev
+
+from main import create_app
+from hev.api import reset_clients
+from hev.config import Config
+from hev.exporters import reset_dispatcher
+from hev.testing import FakeDatadog
+
+SCENARIOS = ["sequential", "concurrent", "batched", "failures", "dry_run"]
+
+TOKEN = "benchmark"
+
+HEADERS = {"Authorization": "Bearer " + TOKEN}
+
+READING = {"bpm": 60, "min": 80, "max": 120}
+
+
+def percentile(values, percent):
+    """Return the given percentile of sorted values (nearest rank)."""
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_load(app, path, payload, requests, concurrency):
+    """Send ``requests`` POST requests to the application from
+    ``concurrency`` threads.
+
+    Args:
+        app: a Flask application
+        path: URL path of the endpoint
+        payload: JSON body sent with each request
+        requests: total number of requests
+        concurrency: number of client threads
+
+    Returns:
+        A dictionary with throughput, latency percentiles (in seconds) and
+        the number of responses for each status code
+    """
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        # Flask test clients are not meant to be shared between threads
+        test_client = app.test_client()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+
+            start = time.perf_counter()
+            response = test_client.post(path, json=payload, headers=HEADERS)
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": requests / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def configure(server, dry_run=False):
+    """Replace the global configuration with one that sends series to the
+    given fake Datadog server.
+    """
+    conf = Config()
+    conf.dd_api_key = "api_key"
+    conf.dd_api_host = server.url
+    conf.function_name = "benchmark"
+    conf.bearer_token = TOKEN
+    conf.dry_run = dry_run
+    conf.async_export = False
+    conf.exporters = ["datadog"]
+    conf.spool_path = None
+    hev.conf = conf
+
+    # Drop clients, breakers and backoff state of previous scenarios
+    reset_clients()
+    reset_dispatcher()
+    APIClient._timeout_counter = 0
+    APIClient._backoff_timestamp = None
+
+
+def run_scenario(name, requests, concurrency_levels, latency, error_rate, batch_size):
+    """Run a scenario for each concurrency level.
+
+    Returns:
+        A list of results, one for each concurrency level
+    """
+    if name == "sequential":
+        concurrency_levels = [1]
+    if name == "failures":
+        error_rate = error_rate or 0.2
+
+    path, payload = "/webhook", {"queryResult": {"parameters": READING}}
+    if name == "batched":
+        start = int(time.time()) - batch_size
+        path = "/bulk"
+        payload = [dict(READING, timestamp=start + i) for i in range(batch_size)]
+
+    app = create_app()
+    results = []
+    with FakeDatadog(latency=latency, error_rate=error_rate) as server:
+        for concurrency in concurrency_levels:
+            configure(server, dry_run=name == "dry_run")
+            result = run_load(app, path, payload, requests, concurrency)
+            result.update(
+                scenario=name,
+                latency=latency,
+                error_rate=error_rate,
+                submissions=server.requests,
+                points=sum(len(s["points"]) for s in server.series),
+            )
+            if name == "batched":
+                result["readings_per_second"] = result["throughput"] * batch_size
+            server.requests = 0
+            del server.series[:]
+            results.append(result)
+    return results
+
+
+def _revision():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout
+        return output.decode().strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="fake Datadog reply latency (s)"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fake Datadog error rate (default: 0.2 for the failures scenario)",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenario:
+        results.extend(
+            run_scenario(
+                name,
+                args.requests,
+                args.concurrency,
+                args.latency,
+                args.error_rate,
+                args.batch_size,
+            )
+        )
+
+    report = {
+        "revision": _revision(),
+        "python": sys.version.split()[0],
+        "timestamp": int(time.time()),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
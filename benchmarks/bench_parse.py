@@ -0,0 +1,214 @@
+"""Benchmark of DialogFlow request parsing.
+
+A realistic DialogFlow request, with the ``outputContexts`` and the
+``originalDetectIntentRequest`` sections sent by Google Assistant, and an
+oversized one are parsed by:
+* ``flask``: ``request.get_json(silent=True)``, the previous implementation
+  that buffers and parses any body
+* ``json``: ``hev.parsing.parse_request()`` with the stdlib parser
+* ``orjson``: ``hev.parsing.parse_request()`` with the optional fast parser
+
+Parse time and peak memory (``tracemalloc``) are reported as JSON; oversized
+requests are rejected by ``parse_request()`` before their body is read.
+
+Usage:
+    $ python -m benchmarks.bench_parse [--number 2000] [--oversized-mb 4]
+"""
+
+import io
+import json
+import timeit
+import argparse
+import tracemalloc
+
+import flask
+
+from werkzeug.test import EnvironBuilder
+
+from hev import parsing
+from hev.exceptions import RequestTooLarge
+
+PARSERS = ["flask", "json", "orjson"]
+
+
+def dialogflow_payload(contexts=5, padding=0):
+    """Return a DialogFlow v2 webhook request like the ones sent for a
+    Google Assistant conversation.
+
+    Args:
+        contexts: number of output contexts
+        padding: bytes of extra data in the original request payload
+    """
+    parameters = {"bpm": 60, "min": 80, "max": 120}
+    original = {
+        parameter + ".original": str(value) for parameter, value in parameters.items()
+    }
+    session = "projects/hev-agent/agent/sessions/ABwppHGf1uQXLR5yJ4eB3xLh0nlJ0rcDmmDiE"
+    return {
+        "responseId": "7811ac58-5bd5-4e44-8d06-6cd8c67f5406-b4ef8d5f",
+        "session": session,
+        "queryResult": {
+            "queryText": "my heart rate is 60 and my pressure is 80 over 120",
+            "parameters": parameters,
+            "allRequiredParamsPresent": True,
+            "fulfillmentText": "Thanks, I've recorded your parameters.",
+            "fulfillmentMessages": [
+                {"text": {"text": ["Thanks, I've recorded your parameters."]}}
+            ],
+            "outputContexts": [
+                {
+                    "name": "{}/contexts/context_{}".format(session, i),
+                    "lifespanCount": 5,
+                    "parameters": dict(parameters, **original),
+                }
+                for i in range(contexts)
+            ],
+            "intent": {
+                "name": "projects/hev-agent/agent/intents/29bcd7f8-f717-4261-a8fd-2d3e451b8af8",
+                "displayName": "record.parameters",
+            },
+            "intentDetectionConfidence": 0.92,
+            "languageCode": "en",
+        },
+        "originalDetectIntentRequest": {
+            "source": "google",
+            "version": "2",
+            "payload": {
+                "isInSandbox": False,
+                "surface": {
+                    "capabilities": [{"name": "actions.capability.SCREEN_OUTPUT"}] * 4
+                },
+                "inputs": [
+                    {
+                        "rawInputs": [
+                            {"query": "my heart rate is 60", "inputType": "VOICE"}
+                        ],
+                        "intent": "actions.intent.TEXT",
+                        "arguments": [
+                            {
+                                "rawText": "my heart rate is 60",
+                                "textValue": "60",
+                                "name": "text",
+                            }
+                        ],
+                    }
+                ],
+                "user": {
+                    "locale": "en-US",
+                    "userVerificationStatus": "VERIFIED",
+                    "padding": "x" * padding,
+                },
+                "conversation": {
+                    "conversationId": "ABwppHGf1uQXLR5yJ4eB3xLh0nlJ0rcDmmDiE",
+                    "type": "ACTIVE",
+                },
+                "availableSurfaces": [
+                    {"capabilities": [{"name": "actions.capability.AUDIO_OUTPUT"}] * 4}
+                ],
+            },
+        },
+    }
+
+
+def make_environ(body):
+    """Return a WSGI environ for a JSON ``POST`` request with the given body."""
+    return EnvironBuilder(
+        method="POST", data=body, content_type="application/json"
+    ).get_environ()
+
+
+def parse(parser, environ, body, max_size):
+    """Parse the request with the given parser.
+
+    Returns:
+        The parsed request, or ``None`` if it has been rejected
+    """
+    environ = dict(environ, **{"wsgi.input": io.BytesIO(body)})
+    request = flask.Request(environ)
+    if parser == "flask":
+        return request.get_json(silent=True)
+
+    backend = parsing.orjson
+    if parser == "json":
+        parsing.orjson = None
+    try:
+        return parsing.parse_request(request, max_size)
+    except RequestTooLarge:
+        return None
+    finally:
+        parsing.orjson = backend
+
+
+def measure(parser, body, max_size, number):
+    """Return parse time and peak memory of the given parser.
+
+    Returns:
+        A dictionary with the time per request in microseconds, the peak
+        memory in KiB and whether the request has been parsed
+    """
+    environ = make_environ(body)
+    tracemalloc.start()
+    parsed = parse(parser, environ, body, max_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(
+        timeit.repeat(
+            lambda: parse(parser, environ, body, max_size), number=number, repeat=3
+        )
+    )
+    return {
+        "parser": parser,
+        "us": round(best / number * 1e6, 2),
+        "peak_kib": round(peak / 1024, 1),
+        "parsed": parsed is not None,
+    }
+
+
+def run(number=2000, oversized_mb=4, max_size=parsing.MAX_BODY_SIZE):
+    """Measure all parsers on the realistic and the oversized payloads.
+
+    Returns:
+        A list with one report for each payload
+    """
+    parsers = [p for p in PARSERS if p != "orjson" or parsing.orjson is not None]
+    payloads = [
+        ("realistic", dialogflow_payload(), number),
+        (
+            "oversized",
+            dialogflow_payload(padding=int(oversized_mb * 1024 * 1024)),
+            max(number // 100, 1),
+        ),
+    ]
+    reports = []
+    for name, payload, count in payloads:
+        body = json.dumps(payload).encode()
+        reports.append(
+            {
+                "payload": name,
+                "bytes": len(body),
+                "results": [
+                    measure(parser, body, max_size, count) for parser in parsers
+                ],
+            }
+        )
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--oversized-mb", type=float, default=4)
+    parser.add_argument("--max-body-size", type=int, default=parsing.MAX_BODY_SIZE)
+    args = parser.parse_args(argv)
+
+    report = {
+        "backend": parsing.BACKEND,
+        "max_body_size": args.max_body_size,
+        "payloads": run(args.number, args.oversized_mb, args.max_body_size),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Cold start benchmark of the Cloud Function.
+
+Each measure runs in a fresh Python process:
+* ``import_time``: ``python -X importtime`` report of ``import functions``
+* ``first_call``: time spent importing ``functions`` and serving the first
+  (cold) and the second (warm) request in dry-run mode. Flask is imported
+  before starting the clock, because the Cloud Functions runtime loads it
+  before the function code.
+
+Usage:
+    $ python -m benchmarks.bench_startup [--runs 5]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Modules that must not be loaded just by importing the Cloud Function
+HEAVY_MODULES = ["datadog", "requests", "sqlite3", "concurrent.futures"]
+
+FIRST_CALL = """
+import json, os, sys, time
+import flask
+from werkzeug.test import EnvironBuilder
+
+def make_request():
+    builder = EnvironBuilder(
+        method="POST",
+        headers={"Authorization": "Bearer token"},
+        json={"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}},
+    )
+    return flask.Request(builder.get_environ())
+
+heavy = %r
+start = time.perf_counter()
+import functions
+imported = time.perf_counter()
+loaded = [m for m in heavy if m in sys.modules]
+status = functions.entrypoint(make_request())[1]
+cold = time.perf_counter()
+functions.entrypoint(make_request())
+warm = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_call": cold - imported,
+    "second_call": warm - cold,
+    "total": cold - start,
+    "status": status,
+    "heavy_modules": loaded,
+}))
+"""
+
+
+def _environ():
+    env = dict(os.environ)
+    env.update(
+        {
+            "DD_API_KEY": "api_key",
+            "FUNCTION_NAME": "benchmark",
+            "BEARER_TOKEN": "token",
+            "DRY_RUN": "true",
+            "PYTHONPATH": os.getcwd(),
+        }
+    )
+    return env
+
+
+def import_time(module="functions"):
+    """Return the ``-X importtime`` report for the given module.
+
+    Returns:
+        A dictionary with the total import time (in seconds) and the
+        modules with the highest self time
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        env=_environ(),
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    total = next(cum for name, _, cum in modules if name == module)
+    top = sorted(modules, key=lambda m: m[1], reverse=True)[:10]
+    return {
+        "total": total / 1e6,
+        "top": [{"module": name, "self": us / 1e6} for name, us, _ in top],
+    }
+
+
+def first_call():
+    """Measure import and first request time in a fresh process."""
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_CALL % HEAVY_MODULES],
+        env=_environ(),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    runs = [first_call() for _ in range(args.runs)]
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_time": import_time(),
+        "median": {
+            key: statistics.median(run[key] for run in runs)
+            for key in ("import", "first_call", "second_call", "total")
+        },
+        "heavy_modules": runs[0]["heavy_modules"],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
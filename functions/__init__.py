@@ -1,4 +1,14 @@
+from . import bulk, readings, webhooks
+from .bulk import bulk_entrypoint
+from .readings import readings_entrypoint
 from .webhooks import entrypoint
 
+# Core handlers, by path, served by the Flask and WSGI applications
+ROUTES = {
+    "/webhook": webhooks.webhook,
+    "/bulk": bulk.bulk,
+    "/readings": readings.readings,
+}
 
-__all__ = ["entrypoint"]
+
+__all__ = ["ROUTES", "bulk_entrypoint", "entrypoint", "readings_entrypoint"]
@@ -0,0 +1,81 @@
+import asyncio
+
+from hev.aio import get_async_dispatcher
+from hev.exporters import get_dispatcher
+from hev.idempotency import get_idempotency, request_key
+from hev.responses import METHOD_NOT_ALLOWED, responses
+from hev.tracing import span, trace
+
+from .webhooks import (
+    build_series,
+    current_config,
+    enqueue,
+    latency_sink,
+    prepare,
+    respond,
+)
+
+
+async def async_entrypoint(request):
+    """Webhook entrypoint for the asyncio runtime. Authorization and
+    validation are the same of ``entrypoint``, while Datadog is reached
+    with a non-blocking pooled client, so that a worker is never stuck on
+    a Datadog round-trip.
+
+    Args:
+        request: ``hev.asgi.Request`` object
+
+    Returns:
+        A ``(response, status)`` pair
+    """
+    # Allow only POST methods
+    if request.method != "POST":
+        return responses.reply(METHOD_NOT_ALLOWED)
+
+    conf, error = current_config()
+    if error is not None:
+        return error
+    with trace("webhook", conf.trace_sample_rate, latency_sink(conf)):
+        return await _handle(request, conf)
+
+
+async def _handle(request, conf):
+    dialog, tenant, error = prepare(request, conf)
+    if error is not None:
+        return error
+
+    # Retried requests get the response of the first one, without exports
+    idempotency = get_idempotency(conf)
+    if idempotency is None:
+        return await _export(dialog, tenant, conf)
+
+    key = request_key(dialog.data, tenant.name)
+    cached = idempotency.begin(key, dialog.language)
+    if cached is not None:
+        return cached
+    try:
+        response, status = await _export(dialog, tenant, conf)
+    except Exception:
+        idempotency.finish(key)
+        raise
+    idempotency.finish(key, response, status)
+    return (response, status)
+
+
+async def _export(dialog, tenant, conf):
+    # Prepare exporters (reused across requests of the same event loop)
+    with span("exporters.setup"):
+        dispatcher = get_async_dispatcher(conf)
+
+    series = build_series(dispatcher, dialog.read(), tenant)
+    if conf.async_export:
+        # The queue may block when it's full: keep the event loop running
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, enqueue, get_dispatcher(conf), series, conf, dialog.language
+        )
+
+    # Send HEV parameters to all exporters concurrently
+    with span("exporters.dispatch"):
+        report = await dispatcher.dispatch(series)
+    return respond(report, dialog.language)
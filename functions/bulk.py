@@ -0,0 +1,116 @@
+import hev
+import hev.auth
+import json
+import logging
+
+from hev.adapters import cloud_function
+from hev.exceptions import ConfigException, NotAuthorized, BadRequest
+from hev.exporters import get_dispatcher
+from hev.handlers import Response
+from hev.ingest import (
+    batched,
+    build_series,
+    iter_json_array,
+    iter_ndjson,
+    validate_reading,
+)
+from hev.responses import (
+    CONFIGURATION_ERROR,
+    METHOD_NOT_ALLOWED,
+    NOT_AUTHORIZED,
+    responses,
+)
+from hev.tenants import get_registry
+from hev.tracing import trace
+
+from .webhooks import current_config, latency_sink
+
+# Readings sent with a single submission
+BATCH_SIZE = 500
+
+# Maximum number of row errors included in the response
+MAX_ERRORS = 100
+
+
+def bulk(request):
+    """Core handler to ingest batches of historical readings.
+
+    The body is either a JSON array or a newline delimited JSON stream
+    (``Content-Type: application/x-ndjson``) of readings such as
+    ``{"timestamp": 1546300800, "bpm": 60, "min": 80, "max": 120}``. The
+    body is parsed and validated while it's read, and valid readings are
+    sent in chunks with multi-point submissions.
+
+    Args:
+        request: a ``hev.handlers.Request``
+
+    Returns:
+        A ``hev.handlers.Response`` with the JSON reply
+    """
+    # Allow only POST methods
+    if request.method != "POST":
+        return Response.from_reply(responses.reply(METHOD_NOT_ALLOWED))
+
+    conf, error = current_config()
+    if error is not None:
+        return Response.from_reply(error)
+    with trace("bulk", conf.trace_sample_rate, latency_sink(conf)):
+        return Response.from_reply(_handle(request, conf))
+
+
+# Cloud Function entrypoint
+bulk_entrypoint = cloud_function(bulk)
+
+
+def _handle(request, conf):
+    try:
+        # Validate Environment Configuration
+        conf.validate()
+        tenant = hev.auth.authenticate(request, get_registry(conf))
+    except ConfigException as e:
+        logging.critical("Unable to configure Cloud Function: %s", str(e))
+        return responses.reply(CONFIGURATION_ERROR)
+    except NotAuthorized as e:
+        logging.critical(str(e))
+        return responses.reply(NOT_AUTHORIZED)
+
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        rows = iter_ndjson(request.stream)
+    else:
+        rows = iter_json_array(request.stream)
+
+    errors = []
+    stats = {"accepted": 0, "rejected": 0, "failed": 0}
+
+    def readings():
+        for row, data, error in rows:
+            if error is None:
+                try:
+                    yield validate_reading(data)
+                    continue
+                except BadRequest as e:
+                    error = str(e)
+
+            stats["rejected"] += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append({"row": row, "error": error})
+
+    dispatcher = get_dispatcher(conf)
+    for batch in batched(readings(), BATCH_SIZE):
+        if all(dispatcher.send_many(tenant.apply(build_series(batch)))):
+            stats["accepted"] += len(batch)
+        else:
+            stats["failed"] += len(batch)
+
+    if stats["failed"]:
+        logging.error("Bulk ingestion executed with errors: %s", stats)
+        message, status = "Failed", 503
+    elif stats["rejected"]:
+        logging.warning("Bulk ingestion rejected some readings: %s", stats)
+        message, status = "Invalid readings", 400
+    else:
+        logging.info("Bulk ingestion executed correctly: %s", stats)
+        message, status = "Success", 201
+
+    response = json.dumps(dict(stats, message=message, errors=errors))
+    return (response, status)
@@ -0,0 +1,99 @@
+import hev
+import hev.auth
+import json
+import math
+import time
+import logging
+
+from hev.adapters import cloud_function
+from hev.constants import EXPORTER_STORE
+from hev.exceptions import ConfigException, NotAuthorized
+from hev.handlers import Response
+from hev.responses import (
+    CONFIGURATION_ERROR,
+    METHOD_NOT_ALLOWED,
+    NOT_AUTHORIZED,
+    responses,
+)
+from hev.tenants import get_registry
+
+from .webhooks import current_config
+
+# Default period and window length of queries, in seconds
+DEFAULT_PERIOD = 86400
+DEFAULT_INTERVAL = 3600
+
+# Maximum number of windows returned by a query
+MAX_WINDOWS = 10000
+
+
+def readings(request):
+    """Core handler to read recent readings of the caller tenant from the
+    local store, downsampled in windows.
+
+    Query parameters are ``start`` and ``end`` (epoch seconds, by default
+    the last day) and ``interval`` (window length in seconds, by default
+    one hour).
+
+    Args:
+        request: a ``hev.handlers.Request``
+
+    Returns:
+        A ``hev.handlers.Response`` with the JSON reply
+    """
+    # Allow only GET methods
+    if request.method != "GET":
+        return Response.from_reply(responses.reply(METHOD_NOT_ALLOWED))
+    conf, error = current_config()
+    if error is not None:
+        return Response.from_reply(error)
+    return Response.from_reply(_query(request, conf))
+
+
+def _query(request, conf):
+    try:
+        # Validate Environment Configuration
+        conf.validate()
+        tenant = hev.auth.authenticate(request, get_registry(conf))
+    except ConfigException as e:
+        logging.critical("Unable to configure Cloud Function: %s", str(e))
+        return responses.reply(CONFIGURATION_ERROR)
+    except NotAuthorized as e:
+        logging.critical(str(e))
+        return responses.reply(NOT_AUTHORIZED)
+
+    if EXPORTER_STORE not in conf.exporters:
+        response = json.dumps({"message": "Local store is not enabled"})
+        return (response, 404)
+
+    try:
+        end = float(request.args.get("end", time.time()))
+        start = float(request.args.get("start", end - DEFAULT_PERIOD))
+        interval = float(request.args.get("interval", DEFAULT_INTERVAL))
+        if not all(math.isfinite(v) for v in (start, end, interval)):
+            # NaN would pass the checks below, as comparisons with it fail
+            raise ValueError("not finite")
+    except ValueError:
+        response = json.dumps({"message": "start, end and interval must be numbers"})
+        return (response, 400)
+    if interval <= 0 or (end - start) / interval > MAX_WINDOWS:
+        response = json.dumps({"message": "Too many windows"})
+        return (response, 400)
+
+    # numpy is required only when the local store is enabled
+    from hev.store import as_records, get_store
+
+    windows = get_store(conf).downsample(tenant.name, start, end, interval)
+    response = json.dumps(
+        {
+            "start": start,
+            "end": end,
+            "interval": interval,
+            "windows": as_records(windows),
+        }
+    )
+    return (response, 200)
+
+
+# Cloud Function entrypoint
+readings_entrypoint = cloud_function(readings)
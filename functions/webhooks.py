@@ -1,72 +1,209 @@
 import hev
-import json
+import hev.auth
+import time
 import logging
+import functools
 
-from flask import abort
+from hev.adapters import cloud_function
+from hev.api import DialogFlowRequest
+from hev.exceptions import ConfigException, NotAuthorized, BadRequest, RequestTooLarge
+from hev.exporters import get_dispatcher
+from hev.handlers import Response
+from hev.idempotency import get_idempotency, request_key
+from hev.responses import (
+    ACCEPTED,
+    CONFIGURATION_ERROR,
+    FAILED,
+    METHOD_NOT_ALLOWED,
+    NOT_AUTHORIZED,
+    SUCCESS,
+    TOO_LARGE,
+    responses,
+)
+from hev.tenants import get_registry
+from hev.tracing import span, trace
+from hev.worker import get_metrics_queue, get_queue
 
-from hev.api import DatadogAPI, DialogFlowRequest
-from hev.constants import KIND_DIASTOLIC, KIND_SYSTOLIC
-from hev.exceptions import ConfigException, NotAuthorized, BadRequest
 
-
-def entrypoint(request):
-    """Cloud Function entrypoint.
+def webhook(request):
+    """Webhook core handler, served by the Cloud Function and by the
+    Flask and WSGI applications.
 
     Args:
-        request: Flask Request object
+        request: a ``hev.handlers.Request``
 
     Returns:
-        The response text or any set of values that can be turned into a
-        Response object using
-        `make_response <http://flask.pocoo.org/docs/1.0/api/#flask.Flask.make_response>`.
+        A ``hev.handlers.Response`` with the JSON reply
     """
     # Allow only POST methods
     if request.method != "POST":
-        return abort(405)
+        return Response.from_reply(responses.reply(METHOD_NOT_ALLOWED))
+
+    # The same configuration is used for the whole request, even if it's
+    # reloaded in the meantime
+    conf, error = current_config()
+    if error is not None:
+        return Response.from_reply(error)
+    with trace("webhook", conf.trace_sample_rate, latency_sink(conf)):
+        return Response.from_reply(_handle(request, conf))
+
+
+# Cloud Function entrypoint
+entrypoint = cloud_function(webhook)
 
+
+def current_config():
+    """Return the configuration of a request, loading it on first use.
+
+    Returns:
+        A ``(conf, error)`` pair, where ``error`` is the ``(response,
+        status)`` pair to reply if the configuration can't be loaded
+    """
+    try:
+        return (hev.conf, None)
+    except ConfigException as e:
+        logging.critical("Unable to configure Cloud Function: %s", str(e))
+        return (None, responses.reply(CONFIGURATION_ERROR))
+
+
+def _handle(request, conf):
+    dialog, tenant, error = prepare(request, conf)
+    if error is not None:
+        return error
+
+    # Retried requests get the response of the first one, without exports
+    idempotency = get_idempotency(conf)
+    if idempotency is not None:
+        key = request_key(dialog.data, tenant.name)
+        return idempotency.run(
+            key, lambda: _export(dialog, tenant, conf), dialog.language
+        )
+    return _export(dialog, tenant, conf)
+
+
+def prepare(request, conf):
+    """Validate the configuration, the Bearer token and the DialogFlow
+    request. Shared by all webhook runtimes.
+
+    Args:
+        request: an object with ``headers``, ``mimetype`` and the request
+            body, such as a ``hev.handlers.Request``
+        conf: the configuration of the request
+
+    Returns:
+        A ``(dialog, tenant, error)`` tuple, where ``dialog`` is the
+        validated ``DialogFlowRequest`` and ``error`` is the
+        ``(response, status)`` pair to reply if the request is not valid
+    """
+    dialog = None
     try:
         # Validate Environment Configuration
-        hev.conf.validate()
-        hev.auth.is_authorized(request, hev.conf.bearer_token)
+        conf.validate()
+        tenant = hev.auth.authenticate(request, get_registry(conf))
 
         # Validate Request Object
-        dialog = DialogFlowRequest(request)
-        dialog.validate()
+        dialog = DialogFlowRequest(request, conf.max_body_size)
+        dialog.read()
     except ConfigException as e:
         logging.critical("Unable to configure Cloud Function: %s", str(e))
-        response = json.dumps({"message": "Configuration error"})
-        return (response, 500)
+        return (None, None, responses.reply(CONFIGURATION_ERROR))
     except NotAuthorized as e:
-        # TODO: update the response so that it can be parsed from a
-        # Google Action
         logging.critical(str(e))
-        response = json.dumps({"message": "Not Authorized"})
-        return (response, 401)
+        return (None, None, responses.reply(NOT_AUTHORIZED))
+    except RequestTooLarge as e:
+        logging.error(str(e))
+        return (None, None, responses.reply(TOO_LARGE))
     except BadRequest as e:
-        response = json.dumps({"message": str(e)})
-        logging.critical(response)
-        return (response, 400)
+        logging.critical("Bad request: %s", str(e))
+        language = dialog.language if dialog is not None else None
+        return (None, None, responses.bad_request(str(e), language))
+
+    return (dialog, tenant, None)
+
+
+def build_series(dispatcher, reading, tenant):
+    """Build series from the validated DialogFlow request, on behalf of
+    the tenant that owns the Bearer token.
+    """
+    series = dispatcher.build_parameters(
+        reading.bpm, reading.min, reading.max, time.time()
+    )
+    return tenant.apply(series)
 
-    # Prepare the API
-    api = DatadogAPI(hev.conf.dd_api_key, hev.conf.function_name, hev.conf.dry_run)
 
-    # Get values from DialogFlow request
-    bpm = dialog.get_parameter("bpm")
-    value_min = dialog.get_parameter("min")
-    value_max = dialog.get_parameter("max")
+def enqueue(dispatcher, series, conf, language=None):
+    """Queue HEV parameters for all exporters and reply without waiting
+    for them.
 
-    # Send HEV parameters to Datadog
-    op_1 = api.send_bpm(bpm)
-    op_2 = api.send_pressure(value_min, kind=KIND_DIASTOLIC)
-    op_3 = api.send_pressure(value_max, kind=KIND_SYSTOLIC)
+    Args:
+        language: DialogFlow language code of the reply
+
+    Returns:
+        The ``(response, status)`` pair of the reply
+    """
+    queue = get_queue(conf.queue_size, conf.queue_policy)
+    queued = [queue.put(exporter, series) for exporter in dispatcher.exporters]
+    if all(queued):
+        logging.info("Cloud Function queued HEV parameters.")
+        return responses.reply(ACCEPTED, language)
+
+    logging.error("Cloud Function is unable to queue HEV parameters.")
+    return responses.reply(FAILED, language)
+
+
+def respond(report, language=None):
+    """Return the reply for the given exporters report.
 
-    # Check all calls were a success
-    if op_1 and op_2 and op_3:
+    Args:
+        language: DialogFlow language code of the reply
+
+    Returns:
+        The ``(response, status)`` pair of the reply
+    """
+    failed = [name for name, results in report.items() if not all(results)]
+
+    # Check all exporters were a success
+    if not failed:
         logging.info("Cloud Function executed correctly.")
-        response = json.dumps({"message": "Success"})
-        status = 201
-    else:
-        logging.error("Cloud Function executed with errors.")
-        response = json.dumps({"message": "Failed"})
-        status = 503
-    return (response, status)
+        return responses.reply(SUCCESS, language)
+
+    logging.error("Cloud Function executed with errors: %s", failed)
+    return responses.failed(failed, language)
+
+
+def _export(dialog, tenant, conf):
+    # Prepare exporters (reused across warm invocations)
+    with span("exporters.setup"):
+        dispatcher = get_dispatcher(conf)
+
+    series = build_series(dispatcher, dialog.read(), tenant)
+    if conf.async_export:
+        return enqueue(dispatcher, series, conf, dialog.language)
+
+    # Send HEV parameters to all exporters concurrently
+    with span("exporters.dispatch"):
+        report = dispatcher.dispatch(series)
+    return respond(report, dialog.language)
+
+
+def latency_sink(conf):
+    """Return the trace sink of the request latency, or ``None`` if
+    self-metrics are disabled.
+    """
+    if not conf.trace_metrics:
+        return None
+    return functools.partial(report_latency, conf)
+
+
+def report_latency(conf, series):
+    """Queue request latency series, so that self-metrics never slow down
+    the request that is measured.
+
+    Args:
+        conf: the configuration of the request
+        series: the latency series
+    """
+    dispatcher = get_dispatcher(conf)
+    queue = get_metrics_queue()
+    for exporter in dispatcher.exporters:
+        queue.put(exporter, series)
@@ -1,6 +1,22 @@
-from .config import Config
+import threading
 
+from .config import load_config, watch_config
 
-conf = Config()
 
 __all__ = ["conf"]
+
+_conf_lock = threading.Lock()
+
+
+def __getattr__(name):
+    """Create the global ``conf`` on first access, so that importing the
+    package doesn't read the environment.
+    """
+    if name == "conf":
+        with _conf_lock:
+            if "conf" not in globals():
+                conf = load_config()
+                watch_config(conf)
+                globals()["conf"] = conf
+        return globals()["conf"]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,163 @@
+import io
+import json
+import logging
+import functools
+
+from http import HTTPStatus
+
+from .handlers import Headers, Request, Response, parse_query
+
+# Methods routed to core handlers; handlers reply 405 to the ones they
+# don't serve, the same way in every runtime
+METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
+
+# WSGI status lines, built once
+_STATUS_LINES = {
+    status.value: "%d %s" % (status.value, status.phrase) for status in HTTPStatus
+}
+
+_NOT_FOUND = Response(json.dumps({"message": "Not Found"}), 404)
+_INTERNAL_ERROR = Response(json.dumps({"message": "Internal Error"}), 500)
+
+
+def from_flask(request):
+    """Return the core request of a Flask Request. Headers and query
+    parameters are shared, while the body is read from the Flask stream
+    only when the handler needs it.
+    """
+    return Request(
+        request.method,
+        request.headers,
+        path=request.path,
+        args=request.args,
+        stream=request.stream,
+    )
+
+
+def from_wsgi(environ):
+    """Return the core request of a WSGI environ, without building any
+    framework request object.
+    """
+    headers = Headers()
+    for key, value in environ.items():
+        if key.startswith("HTTP_"):
+            headers[key[5:].replace("_", "-").lower()] = value
+    for key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+        if environ.get(key):
+            headers[key.replace("_", "-").lower()] = environ[key]
+
+    # The input stream may block past the end of the body, so it's read
+    # only up to the Content-Length unless the server terminates it
+    stream = environ.get("wsgi.input")
+    try:
+        stream = _BoundedStream(stream, int(headers["content-length"]))
+    except (KeyError, ValueError):
+        if not environ.get("wsgi.input_terminated"):
+            stream = io.BytesIO()
+
+    return Request(
+        environ.get("REQUEST_METHOD", "GET"),
+        headers,
+        path=environ.get("PATH_INFO") or "/",
+        args=parse_query(environ.get("QUERY_STRING", "")),
+        stream=stream,
+    )
+
+
+def cloud_function(handler):
+    """Generate the Cloud Function entrypoint of a core handler.
+
+    Args:
+        handler: a function that receives a ``hev.handlers.Request`` and
+            returns a ``hev.handlers.Response``
+
+    Returns:
+        A function that receives a Flask Request and returns a
+        ``(response, status, headers)`` tuple, as Cloud Functions and Flask
+        views do; the core handler is its ``handler`` attribute
+    """
+
+    @functools.wraps(handler)
+    def entrypoint(request):
+        response = handler(from_flask(request))
+        return (response.body, response.status, response.headers)
+
+    entrypoint.handler = handler
+    return entrypoint
+
+
+def register(app, routes):
+    """Add a Flask endpoint for each core handler, named after the handler.
+
+    Args:
+        app: the Flask application
+        routes: a dictionary that maps paths to core handlers
+    """
+    from flask import request
+
+    for path, handler in routes.items():
+        entrypoint = cloud_function(handler)
+        view = functools.partial(_view, entrypoint, request)
+        app.add_url_rule(path, handler.__name__, view, methods=METHODS)
+
+
+def _view(entrypoint, request):
+    # Flask views receive the request from the context local
+    return entrypoint(request._get_current_object())
+
+
+class WSGIApp(object):
+    """WSGI application that routes requests to core handlers. Requests
+    are built straight from the WSGI environ, without the per-request work
+    of a web framework (request and response objects, context locals and
+    URL matching).
+    """
+
+    def __init__(self, routes):
+        """Initialize the application.
+
+        Args:
+            routes: a dictionary that maps paths to core handlers
+        """
+        self.routes = routes
+
+    def __call__(self, environ, start_response):
+        handler = self.routes.get(environ.get("PATH_INFO") or "/")
+        if handler is None:
+            response = _NOT_FOUND
+        else:
+            try:
+                response = handler(from_wsgi(environ))
+            except Exception:
+                logging.exception(
+                    "Unhandled error serving '%s'", environ.get("PATH_INFO")
+                )
+                response = _INTERNAL_ERROR
+
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode()
+        headers = list(response.headers.items())
+        headers.append(("Content-Length", str(len(body))))
+        status = _STATUS_LINES.get(response.status) or "%d Unknown" % response.status
+        start_response(status, headers)
+        return [body]
+
+
+class _BoundedStream(object):
+    """Stream that reads at most ``length`` bytes of the wrapped stream."""
+
+    __slots__ = ("_stream", "_remaining")
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = max(length, 0)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        if not size:
+            return b""
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        return data
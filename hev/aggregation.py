@@ -0,0 +1,214 @@
+import math
+import time
+import atexit
+import logging
+import threading
+
+from .exporters import Exporter
+
+# Percentiles reported for each aggregated series
+PERCENTILES = (50, 95, 99)
+
+
+class AggregatingExporter(Exporter):
+    """Exporter that accumulates points in time windows and sends only
+    their summary to the wrapped exporter. Points are grouped by metric,
+    tags, host and window, so that readings of many devices reported to the same
+    instance are flushed with a single submission.
+
+    For each group, the following series are sent with the window start as
+    timestamp: ``<metric>.count``, ``<metric>.min``, ``<metric>.max``,
+    ``<metric>.avg`` and ``<metric>.p<N>`` for each percentile.
+
+    Only windows that are over are flushed by the background thread, so a
+    window is never submitted twice. ``close()`` flushes all windows and
+    is called when the interpreter shuts down.
+    """
+
+    def __init__(self, exporter, window=10.0, percentiles=PERCENTILES, clock=time.time):
+        """Initialize the aggregator. The flush thread starts with the
+        first received point.
+
+        Args:
+            exporter: the ``Exporter`` that receives aggregated series
+            window: window length in seconds
+            percentiles: percentiles reported for each window
+            clock: function that returns the current timestamp
+        """
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.window = window
+        self.percentiles = tuple(percentiles)
+        self._clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def send_many(self, series):
+        """Add series points to their windows.
+
+        Returns:
+            A list of booleans where ``True`` means the series points have
+            been aggregated; series without a numeric value are rejected
+        """
+        now = self._clock()
+        results = []
+        with self._lock:
+            if self._closed:
+                return [False] * len(series)
+
+            for s in series:
+                points = _as_points(s.get("points"), now)
+                if points is None:
+                    results.append(False)
+                    continue
+
+                tags = tuple(sorted(s.get("tags") or ()))
+                host = s.get("host")
+                for timestamp, value in points:
+                    start = int(timestamp // self.window * self.window)
+                    key = (s["metric"], tags, host, start)
+                    self._windows.setdefault(key, []).append(value)
+                results.append(True)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="hev-aggregator", daemon=True
+                )
+                self._thread.start()
+        return results
+
+    def flush(self, force=False):
+        """Send summaries of windows that are over.
+
+        Args:
+            force: if set, all windows are flushed, including the current one
+
+        Returns:
+            A list of booleans, one for each submitted series
+        """
+        now = self._clock()
+        with self._lock:
+            keys = [
+                key for key in self._windows if force or key[3] + self.window <= now
+            ]
+            windows = [(key, self._windows.pop(key)) for key in keys]
+
+        series = []
+        for (metric, tags, host, start), values in sorted(windows, key=_window_order):
+            summary = self.summarize(metric, list(tags), start, values)
+            if host is not None:
+                summary = [dict(s, host=host) for s in summary]
+            series.extend(summary)
+        if not series:
+            return []
+
+        try:
+            results = self.exporter.send_many(series)
+        except Exception:
+            logging.exception("Exporter '%s' failed", self.name)
+            results = [False] * len(series)
+
+        if not all(results):
+            logging.error(
+                "Unable to send %d aggregated series to '%s'",
+                results.count(False),
+                self.name,
+            )
+        return results
+
+    def summarize(self, metric, tags, timestamp, values):
+        """Build the summary series of the given window values."""
+        values = sorted(values)
+        count = len(values)
+        summary = [
+            ("count", count),
+            ("min", values[0]),
+            ("max", values[-1]),
+            ("avg", sum(values) / count),
+        ]
+        for percentile in self.percentiles:
+            # Nearest-rank percentile
+            rank = max(int(math.ceil(percentile / 100.0 * count)) - 1, 0)
+            summary.append(("p{}".format(percentile), values[rank]))
+
+        series = []
+        for suffix, value in summary:
+            s = {
+                "metric": "{}.{}".format(metric, suffix),
+                "points": [(timestamp, value)],
+            }
+            if tags:
+                s["tags"] = tags
+            series.append(s)
+        return series
+
+    def close(self, timeout=10.0):
+        """Stop the flush thread and send all pending windows."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(force=True)
+
+    def _run(self):
+        # Check windows a few times per window, so that a window is flushed
+        # shortly after it's over
+        interval = min(self.window / 4.0, 1.0)
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Aggregator '%s' flush failed", self.name)
+
+    def stats(self):
+        """Return the aggregator state, including the wrapped exporter one."""
+        with self._lock:
+            pending = sum(len(values) for values in self._windows.values())
+        stats = {"windows": len(self._windows), "pending": pending}
+        if hasattr(self.exporter, "stats"):
+            stats.update(self.exporter.stats())
+        return stats
+
+
+def aggregate(exporter, window):
+    """Wrap the exporter with an ``AggregatingExporter`` that is flushed
+    when the interpreter shuts down.
+    """
+    aggregator = AggregatingExporter(exporter, window)
+    atexit.register(aggregator.close)
+    return aggregator
+
+
+def _window_order(window):
+    # Windows without a host must be sortable with the others
+    (metric, tags, host, start), _ = window
+    return (start, metric, tags, host or "")
+
+
+def _as_points(points, now):
+    """Return the ``(timestamp, value)`` pairs of a series, or ``None`` if
+    the series has no numeric values.
+    """
+    if isinstance(points, (int, float)) and not isinstance(points, bool):
+        return [(now, points)]
+    if not isinstance(points, (list, tuple)) or not points:
+        return None
+
+    pairs = []
+    for point in points:
+        try:
+            timestamp, value = point
+        except (TypeError, ValueError):
+            return None
+        if value is None:
+            return None
+        pairs.append((timestamp, value))
+    return pairs
@@ -0,0 +1,412 @@
+import ssl
+import json
+import time
+import asyncio
+import logging
+import weakref
+import contextvars
+
+from urllib.parse import urlsplit
+
+from .constants import EXPORTER_DATADOG, TRANSPORT_HTTP
+from .exporters import Exporter, get_dispatcher
+from .handlers import Headers
+from .tracing import span
+
+# Default Datadog API endpoint
+DEFAULT_API_HOST = "https://api.datadoghq.com"
+
+# Maximum number of connections kept open to the Datadog API
+POOL_SIZE = 10
+
+
+class ConnectionPool(object):
+    """Minimal asyncio HTTP/1.1 client that keeps a pool of keep-alive
+    connections to a single origin. Connections are bound to the event loop
+    where they're created.
+    """
+
+    def __init__(self, url, size=POOL_SIZE, timeout=10.0):
+        """Initialize the pool. Connections are opened on demand.
+
+        Args:
+            url: origin of all requests, such as ``https://api.datadoghq.com``
+            size: maximum number of concurrent connections
+            timeout: seconds to wait for each request
+        """
+        parsed = urlsplit(url)
+        secure = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if secure else 80)
+        # Virtual hosts need the port, unless it's the scheme default one
+        self.authority = parsed.hostname
+        if parsed.port and parsed.port != (443 if secure else 80):
+            self.authority = "{}:{}".format(parsed.hostname, parsed.port)
+        self.size = size
+        self.timeout = timeout
+        self._ssl = ssl.create_default_context() if secure else None
+        self._idle = []
+        self._slots = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        """Send a request and read the whole response.
+
+        Returns:
+            A ``(status, body, headers)`` tuple, where ``headers`` is a
+            ``hev.handlers.Headers`` dictionary
+
+        Raises:
+            OSError: the connection failed
+            asyncio.TimeoutError: the request exceeded the timeout
+            ValueError: the response is malformed
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        async with self._slots:
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._connect()
+            # A reused connection may have been closed by the server while
+            # idle: the request is sent again, once, with a new connection
+            while True:
+                try:
+                    response = await asyncio.wait_for(
+                        self._send(conn, method, path, body, headers or {}),
+                        self.timeout,
+                    )
+                    break
+                except asyncio.TimeoutError:
+                    conn[1].close()
+                    raise
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    conn[1].close()
+                    if not reused:
+                        raise OSError(e)
+                except BaseException:
+                    conn[1].close()
+                    raise
+                reused = False
+                conn = await self._connect()
+
+            status, data, response_headers, keep_alive = response
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+            return status, data, response_headers
+
+    async def close(self):
+        """Close idle connections."""
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    async def _connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self._ssl),
+            self.timeout,
+        )
+
+    async def _send(self, conn, method, path, body, headers):
+        reader, writer = conn
+        lines = ["{} {} HTTP/1.1".format(method, path), "Host: " + self.authority]
+        lines.extend("{}: {}".format(k, v) for k, v in headers.items())
+        lines.append("Content-Length: {}".format(len(body)))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        version, status = status_line.split(b" ", 2)[:2]
+        response_headers = Headers()
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                data += chunk[:-2]
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            data = await reader.read()
+            response_headers["connection"] = "close"
+
+        keep_alive = response_headers.get("connection", "").lower() != "close" and (
+            version == b"HTTP/1.1"
+        )
+        return int(status), data, response_headers, keep_alive
+
+
+class AsyncDatadogAPI(object):
+    """Datadog exporter for the asyncio runtime. Series are submitted to the
+    Datadog ``/api/v1/series`` endpoint with a pooled keep-alive client, so
+    that waiting for Datadog never blocks a worker thread.
+    """
+
+    name = EXPORTER_DATADOG
+
+    timeout = None
+
+    def __init__(
+        self,
+        api_key,
+        function_name,
+        dry_run=False,
+        api_host=None,
+        timeout=10.0,
+        limiter=None,
+    ):
+        """Initialize the Datadog client.
+
+        Args:
+            api_key: Datadog API key
+            function_name: name used as a "host" for submitted metrics
+            dry_run: if ``True`` metrics are never sent to Datadog
+            api_host: Datadog API endpoint; ``None`` means the default one
+            timeout: Datadog HTTP requests timeout in seconds
+            limiter: optional ``hev.ratelimit.RateLimiter`` shared with the
+                threaded Datadog exporter; submissions wait for its tokens,
+                up to ``timeout`` seconds, and feed it the API responses
+        """
+        self._api_key = api_key
+        self._function_name = function_name
+        self._dry_run = dry_run
+        self._limiter = limiter
+        self._wait = timeout
+        self._pool = ConnectionPool(api_host or DEFAULT_API_HOST, timeout=timeout)
+
+    @span("datadog.send_many")
+    async def send_many(self, series):
+        """Sends multiple series to Datadog in one HTTP request.
+
+        Returns:
+            A list of booleans, one for each given series, where ``True``
+            means the series has been accepted
+        """
+        results = [s.get("points") is not None for s in series]
+        if self._dry_run:
+            # dry-run a success
+            return results
+
+        valid = [s for s, ok in zip(series, results) if ok]
+        if valid and not await self._submit(valid):
+            results = [False] * len(series)
+
+        for s, ok in zip(series, results):
+            if not ok:
+                logging.error(
+                    "Series '%s' %s not submitted", s["metric"], s.get("tags")
+                )
+        return results
+
+    async def close(self):
+        await self._pool.close()
+
+    async def _submit(self, series):
+        now = time.time()
+        payload = {"series": [self._metric(s, now) for s in series]}
+        headers = {"Content-Type": "application/json", "DD-API-KEY": self._api_key}
+        if not await self._acquire():
+            logging.error("Exporter '%s' timed out waiting for quota", self.name)
+            return False
+        try:
+            status, body, response_headers = await self._pool.request(
+                "POST", "/api/v1/series", json.dumps(payload).encode(), headers
+            )
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            logging.error("Unable to reach Datadog: %s", e)
+            return False
+
+        if self._limiter is not None:
+            # A 429 pauses the threaded and the asyncio submissions alike
+            self._limiter.observe(status, response_headers)
+
+        if not 200 <= status < 300:
+            logging.error("Datadog replied with %d: %s", status, body[:200])
+            return False
+        return True
+
+    async def _acquire(self):
+        # Tokens are waited for without blocking the event loop
+        if self._limiter is None:
+            return True
+        with span("datadog.throttle"):
+            deadline = time.monotonic() + self._wait
+            waited = 0.0
+            while True:
+                delay = self._limiter.try_acquire(waited)
+                if delay <= 0:
+                    return True
+                if time.monotonic() + delay > deadline:
+                    return False
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def _metric(self, series, now):
+        points = series["points"]
+        if not isinstance(points, (list, tuple)):
+            points = [(now, points)]
+        metric = {
+            "metric": series["metric"],
+            "points": [[timestamp, value] for timestamp, value in points],
+            "type": "gauge",
+            "host": series.get("host") or self._function_name,
+        }
+        if series.get("tags"):
+            metric["tags"] = series["tags"]
+        return metric
+
+
+class AsyncResilientExporter(object):
+    """Asyncio version of ``ResilientExporter``: retries failed series
+    with the same ``RetryPolicy`` and ``CircuitBreaker``, without blocking
+    the event loop while waiting.
+    """
+
+    def __init__(self, exporter, retry, breaker):
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.retry = retry
+        self.breaker = breaker
+
+    async def send_many(self, series):
+        attempts = self.retry.attempts(self.breaker, self.name, len(series))
+        while attempts.allow():
+            try:
+                sent = await self.exporter.send_many(attempts.pending_series(series))
+            except Exception:
+                logging.exception("Exporter '%s' failed", self.name)
+                sent = [False] * len(attempts.pending)
+
+            delay = attempts.record(sent)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        return attempts.results
+
+    def stats(self):
+        """Return the exporter resilience state."""
+        return self.breaker.stats()
+
+    async def close(self):
+        await self.exporter.close()
+
+
+class AsyncDispatcher(object):
+    """Asyncio version of ``Dispatcher``. Exporters with a coroutine
+    ``send_many()`` are awaited concurrently; the others run in the default
+    thread pool executor.
+    """
+
+    def __init__(self, exporters, timeout=10.0):
+        self.exporters = list(exporters)
+        self._timeout = timeout
+
+    build_parameters = staticmethod(Exporter.build_parameters)
+
+    async def dispatch(self, series):
+        """Sends series to all exporters concurrently.
+
+        Returns:
+            A dictionary that maps each exporter name to its results. An
+            exporter that raises or exceeds its timeout has all its series
+            marked as failed.
+        """
+        loop = asyncio.get_running_loop()
+        calls = []
+        for exporter in self.exporters:
+            if asyncio.iscoroutinefunction(exporter.send_many):
+                call = exporter.send_many(series)
+            else:
+                # Exporters run in the context of the caller, so that their
+                # spans are part of the current request trace
+                call = loop.run_in_executor(
+                    None, contextvars.copy_context().run, exporter.send_many, series
+                )
+            timeout = (
+                exporter.timeout if exporter.timeout is not None else self._timeout
+            )
+            calls.append(asyncio.wait_for(call, timeout))
+
+        report = {}
+        outcomes = await asyncio.gather(*calls, return_exceptions=True)
+        for exporter, outcome in zip(self.exporters, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                logging.error("Exporter '%s' timed out", exporter.name)
+                outcome = [False] * len(series)
+            elif isinstance(outcome, Exception):
+                logging.error("Exporter '%s' failed: %r", exporter.name, outcome)
+                outcome = [False] * len(series)
+            report[exporter.name] = outcome
+        return report
+
+    async def close(self):
+        """Close connections of asyncio exporters."""
+        for exporter in self.exporters:
+            if asyncio.iscoroutinefunction(getattr(exporter, "close", None)):
+                await exporter.close()
+
+
+# Dispatcher cache; connections belong to the event loop that opened them
+_dispatchers = weakref.WeakKeyDictionary()
+
+
+def get_async_dispatcher(conf):
+    """Return the ``AsyncDispatcher`` of the running event loop for the given
+    configuration. Exporters are the ones of ``get_dispatcher()``, except
+    the Datadog HTTP exporter that is replaced by ``AsyncDatadogAPI``. When
+    points are spooled, aggregated or scored for anomalies, the synchronous
+    Datadog exporter is kept and it runs in a thread.
+
+    Returns:
+        An ``AsyncDispatcher`` instance
+    """
+    loop = asyncio.get_running_loop()
+    dispatcher = get_dispatcher(conf)
+    cached = _dispatchers.get(loop)
+    if cached is not None and cached[0] is dispatcher:
+        return cached[1]
+
+    native = (
+        conf.dd_transport == TRANSPORT_HTTP
+        and conf.spool_path is None
+        and not conf.aggregation_window
+        and not conf.anomaly_policy
+    )
+    exporters = []
+    for exporter in dispatcher.exporters:
+        if native and exporter.name == EXPORTER_DATADOG:
+            # Submissions share the quota of the threaded exporter
+            limited = exporter.exporter
+            api = AsyncDatadogAPI(
+                conf.dd_api_key,
+                conf.function_name,
+                conf.dry_run,
+                api_host=conf.dd_api_host,
+                timeout=conf.export_timeout,
+                limiter=getattr(limited, "limiter", None),
+            )
+            exporter = AsyncResilientExporter(api, exporter.retry, exporter.breaker)
+        exporters.append(exporter)
+
+    async_dispatcher = AsyncDispatcher(exporters, conf.export_timeout)
+    _dispatchers[loop] = (dispatcher, async_dispatcher)
+    if cached is not None:
+        loop.create_task(cached[1].close())
+    return async_dispatcher
+
+
+async def close_async_dispatcher():
+    """Close the dispatcher of the running event loop, if any."""
+    cached = _dispatchers.pop(asyncio.get_running_loop(), None)
+    if cached is not None:
+        await cached[1].close()
@@ -0,0 +1,330 @@
+import json
+import time
+import argparse
+import warnings
+import threading
+
+from .aggregation import _as_points
+from .constants import (
+    ANOMALY_MIN_HISTORY,
+    ANOMALY_QUARANTINE,
+    ANOMALY_TAG,
+    KIND_DIASTOLIC,
+    KIND_SYSTOLIC,
+)
+from .exporters import Exporter
+from .store import _METRICS, FIELDS, Store, _number, _numpy, _timestamp
+
+# Plausible ranges of readings taken at rest: readings outside them pass
+# the request validation, but they're likely recognition errors
+RANGES = {"bpm": (40, 180), "systolic": (70, 220), "diastolic": (40, 130)}
+
+# Plausible difference between systolic and diastolic pressure, in mmHg
+PULSE_PRESSURE = (10, 100)
+
+# Anomalies of a reading, as bits of its flags
+RANGE = 1
+PULSE = 2
+OUTLIER = 4
+REASONS = ((RANGE, "range"), (PULSE, "pulse-pressure"), (OUTLIER, "outlier"))
+
+# Robust z-score above which a reading is an outlier
+THRESHOLD = 3.5
+
+# Readings in the rolling window, and the minimum to look for outliers
+WINDOW = 60
+MIN_HISTORY = ANOMALY_MIN_HISTORY
+
+# Smallest spread (median absolute deviation) of the rolling window, about
+# the natural variation of readings at rest, so that small changes after a
+# steady history are not outliers
+MIN_SPREAD = {"bpm": 3.0, "systolic": 4.0, "diastolic": 3.0}
+
+# Readings scored at once in batch mode, to bound memory usage
+CHUNK_SIZE = 65536
+
+# Prefix that replaces ``hev.`` in the metric of quarantined series
+QUARANTINE_PREFIX = "hev.quarantine."
+
+
+def score(values, window=WINDOW, threshold=THRESHOLD, start=0):
+    """Score readings in time order. Each reading is checked against the
+    plausible ranges, the pulse pressure and the robust z-score (median and
+    median absolute deviation) of the ``window`` readings that precede it.
+    Checks are vectorized over all readings.
+
+    Args:
+        values: array with ``bpm``, ``systolic`` and ``diastolic`` rows
+        window: number of previous readings used to look for outliers
+        threshold: robust z-score above which a reading is an outlier
+        start: index of the first scored reading; previous readings are
+            used only as history
+
+    Returns:
+        An array with the flags of each scored reading, where each bit is
+        one of ``RANGE``, ``PULSE`` and ``OUTLIER``
+    """
+    np = _numpy()
+    values = np.asarray(values, dtype=np.float64)
+    count = values.shape[1]
+    scored = values[:, start:]
+
+    flags = np.zeros(scored.shape[1], dtype=np.int64)
+    for row, field in enumerate(FIELDS):
+        low, high = RANGES[field]
+        flags[(scored[row] < low) | (scored[row] > high)] |= RANGE
+    pulse = scored[1] - scored[2]
+    flags[(pulse < PULSE_PRESSURE[0]) | (pulse > PULSE_PRESSURE[1])] |= PULSE
+
+    # Readings with a shorter history (at most ``window``) are scored one
+    # by one, the others with sliding window views of all readings
+    first = max(start, MIN_HISTORY)
+    full = max(first, window)
+    for i in range(first, min(full, count)):
+        begin = max(i - window, 0)
+        outlier = _outliers(values[:, begin:i, None], values[:, i, None], threshold)
+        flags[i - start] |= outlier[0] * OUTLIER
+
+    if count > full:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=1)
+        for offset in range(full, count, CHUNK_SIZE):
+            end = min(offset + CHUNK_SIZE, count)
+            # The history of the reading ``i`` is the window that starts
+            # at ``i - window``
+            begin, stop = offset - window, end - window
+            history = windows[:, begin:stop].swapaxes(1, 2)
+            outlier = _outliers(history, values[:, offset:end], threshold)
+            begin, stop = offset - start, end - start
+            flags[begin:stop] |= outlier * OUTLIER
+    return flags
+
+
+def _outliers(history, values, threshold):
+    """Return whether readings are outliers of their history.
+
+    Args:
+        history: ``(fields, window, readings)`` array
+        values: ``(fields, readings)`` array
+
+    Returns:
+        An array of ``0`` and ``1`` values, one for each reading
+    """
+    np = _numpy()
+    # Missing fields are ignored, and a field is checked only when its
+    # history has enough values
+    enough = np.count_nonzero(~np.isnan(history), axis=1) >= MIN_HISTORY
+    with warnings.catch_warnings():
+        # All-NaN windows are expected, their median is NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(history, axis=1)
+        spread = np.nanmedian(np.abs(history - median[:, None, :]), axis=1)
+    minimum = np.array([[MIN_SPREAD[field]] for field in FIELDS])
+    z = 0.6745 * (values - median) / np.maximum(spread, minimum)
+    outlier = enough & (np.abs(z) > threshold)
+    return outlier.any(axis=0).astype(np.int64)
+
+
+def reasons(flags):
+    """Return the names of the anomalies in the given flags."""
+    return [name for flag, name in REASONS if flags & flag]
+
+
+class Detector(object):
+    """Online anomaly detector. The latest ``window`` readings of each
+    tenant are kept in a ``(fields, window)`` array, that is the history of
+    the next scored readings.
+    """
+
+    def __init__(self, window=WINDOW, threshold=THRESHOLD):
+        """Initialize the detector.
+
+        Args:
+            window: readings kept for each tenant
+            threshold: robust z-score above which a reading is an outlier
+        """
+        self.window = window
+        self.threshold = threshold
+        self._history = {}
+        self._lock = threading.Lock()
+
+    def score(self, tenant, values):
+        """Score readings of a tenant, in time order, and add them to its
+        rolling window.
+
+        Args:
+            tenant: tenant name; ``None`` is the anonymous tenant
+            values: array with ``bpm``, ``systolic`` and ``diastolic`` rows
+
+        Returns:
+            An array with the flags of each reading
+        """
+        np = _numpy()
+        values = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            history = self._history.get(tenant)
+            if history is None:
+                history = np.empty((len(FIELDS), 0))
+            values = np.concatenate((history, values), axis=1)
+            flags = score(values, self.window, self.threshold, history.shape[1])
+            keep = max(values.shape[1] - self.window, 0)
+            self._history[tenant] = values[:, keep:].copy()
+        return flags
+
+
+class AnomalyExporter(Exporter):
+    """Exporter that scores readings before sending them to the wrapped
+    exporter. Readings are rebuilt from the series of the same tenant and
+    timestamp; points of anomalous readings are sent in their own series,
+    either tagged with ``anomaly:<reason>`` or quarantined under the
+    ``hev.quarantine.*`` metrics, so that they never look like normal
+    gauges to dashboards and monitors.
+    """
+
+    def __init__(self, exporter, detector, policy=ANOMALY_TAG):
+        """Initialize the exporter.
+
+        Args:
+            exporter: the wrapped exporter
+            detector: a ``Detector`` instance
+            policy: either ``tag`` or ``quarantine``
+        """
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.detector = detector
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._scored = 0
+        self._anomalies = 0
+
+    def send_many(self, series):
+        np = _numpy()
+        now = time.time()
+        readings = {}
+        points_of = []
+        for s in series:
+            tags = s.get("tags") or []
+            kind = next((t for t in tags if t in (KIND_SYSTOLIC, KIND_DIASTOLIC)), None)
+            field = _METRICS.get((s["metric"], kind))
+            points = _as_points(s.get("points"), now) if field is not None else None
+            if points is None:
+                points_of.append(None)
+                continue
+            tenant = next((t[7:] for t in tags if t.startswith("tenant:")), None)
+            for timestamp, value in points:
+                readings.setdefault((tenant, timestamp), {})[field] = value
+            points_of.append((tenant, points))
+
+        flags = {}
+        by_tenant = {}
+        for tenant, timestamp in sorted(readings, key=_reading_order):
+            by_tenant.setdefault(tenant, []).append(timestamp)
+        for tenant, timestamps in by_tenant.items():
+            values = np.array(
+                [
+                    [readings[tenant, t].get(f, np.nan) for t in timestamps]
+                    for f in FIELDS
+                ]
+            )
+            for timestamp, flag in zip(timestamps, self.detector.score(tenant, values)):
+                flags[tenant, timestamp] = int(flag)
+
+        anomalies = sum(1 for flag in flags.values() if flag)
+        with self._lock:
+            self._scored += len(flags)
+            self._anomalies += anomalies
+
+        # Series are split by anomalies; each one is sent as many series
+        split = []
+        parts = []
+        for s, points in zip(series, points_of):
+            if points is None:
+                parts.append([len(split)])
+                split.append(s)
+                continue
+            tenant, points = points
+            groups = {}
+            for point in points:
+                groups.setdefault(flags[tenant, point[0]], []).append(point)
+            parts.append(list(range(len(split), len(split) + len(groups))))
+            for flag, group in groups.items():
+                split.append(self._series(s, group, flag))
+
+        sent = self.exporter.send_many(split)
+        return [all(sent[i] for i in indexes) for indexes in parts]
+
+    def stats(self):
+        """Return the number of scored and anomalous readings, including
+        the wrapped exporter state.
+        """
+        with self._lock:
+            stats = {"scored": self._scored, "anomalies": self._anomalies}
+        if hasattr(self.exporter, "stats"):
+            stats.update(self.exporter.stats())
+        return stats
+
+    def close(self):
+        if hasattr(self.exporter, "close"):
+            self.exporter.close()
+
+    def _series(self, series, points, flags):
+        series = dict(series, points=points)
+        if flags:
+            anomalies = ["anomaly:" + name for name in reasons(flags)]
+            series["tags"] = list(series.get("tags") or []) + anomalies
+            if self.policy == ANOMALY_QUARANTINE:
+                series["metric"] = QUARANTINE_PREFIX + series["metric"][4:]
+        return series
+
+
+def _reading_order(key):
+    # Readings of the anonymous tenant (``None``) are sorted as well
+    return (key[0] or "", key[1])
+
+
+def rescore(store, tenant, start=None, end=None, window=WINDOW, threshold=THRESHOLD):
+    """Score the stored readings of a tenant in batch mode.
+
+    Args:
+        store: a ``Store`` instance
+        tenant: tenant name; ``None`` is the anonymous tenant
+
+    Returns:
+        A ``(rows, flags)`` pair, with the stored readings in the time
+        range and the flags of each reading
+    """
+    rows = store.range(tenant, start, end)
+    return rows, score(rows[1:], window, threshold)
+
+
+def main(argv=None):
+    """Print anomalous stored readings as JSON lines."""
+    import hev
+
+    parser = argparse.ArgumentParser(description="Score stored HEV readings")
+    parser.add_argument("--path", default=hev.conf.store_path)
+    parser.add_argument("--tenant", help="tenant name (default: all tenants)")
+    parser.add_argument(
+        "--start", type=_timestamp, help="epoch or relative (-7d), default: all"
+    )
+    parser.add_argument("--end", type=_timestamp, help="epoch or relative (-1h)")
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    store = Store(args.path)
+    tenants = [args.tenant] if args.tenant else store.tenants()
+    for tenant in tenants:
+        rows, flags = rescore(
+            store, tenant, args.start, args.end, args.window, args.threshold
+        )
+        for i in flags.nonzero()[0]:
+            record = {"tenant": tenant, "timestamp": rows[0, i]}
+            record.update((f, _number(rows[j + 1, i])) for j, f in enumerate(FIELDS))
+            record["anomalies"] = reasons(flags[i])
+            print(json.dumps(record))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,33 +1,343 @@
+import socket
 import logging
-import datadog
+import weakref
+import threading
 
+from .constants import TRANSPORT_DOGSTATSD, TRANSPORT_HTTP
 from .exceptions import BadRequest
+from .exporters import Exporter
+from .parsing import MAX_BODY_SIZE, parse_request
+from .schema import PARAMETERS, extract_reading
+from .tracing import span
 
+# Size of the keep-alive connection pool shared by all Datadog clients
+POOL_SIZE = 10
 
-class DatadogAPI(object):
+# Largest DogStatsD datagram that fits an Ethernet frame without
+# fragmentation, as suggested by the Datadog agent documentation
+MAX_PACKET_SIZE = 1432
+
+# Rate limiters fed by the Datadog HTTP API responses
+_rate_limiters = weakref.WeakSet()
+
+# Clients cache, reused across warm Cloud Function invocations
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, function_name, dry_run=False, **options):
+    """Return a cached ``DatadogAPI`` client for the given configuration.
+
+    The client is created lazily on the first call and reused by the
+    following invocations of a warm Cloud Function instance, so that
+    Datadog is initialized only once and the TLS connection is kept alive.
+    Because the Datadog API key is stored in a process-wide state, creating
+    a client for a different configuration evicts the previous one.
+
+    Args:
+        api_key: Datadog API key
+        function_name: name used as a "host" for submitted metrics
+        dry_run: if ``True`` metrics are never sent to Datadog
+        options: other ``DatadogAPI`` keyword arguments
+
+    Returns:
+        A ``DatadogAPI`` instance
+    """
+    key = (api_key, function_name, dry_run, tuple(sorted(options.items())))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                _clients.clear()
+                client = DatadogAPI(api_key, function_name, dry_run, **options)
+                _clients[key] = client
+    return client
+
+
+def reset_clients():
+    """Invalidate all cached clients. Must be called when the configuration
+    changes in a way that is not reflected by the cache key.
+    """
+    with _clients_lock:
+        _clients.clear()
+
+
+def reset_session():
+    """Drop the pooled session of the Datadog HTTP client, if any. Must be
+    called in forked processes, so that they don't share the connections
+    opened by the parent.
+    """
+    import sys
+
+    if "datadog.api.http_client" not in sys.modules:
+        return
+
+    from datadog.api.http_client import RequestClient
+
+    with RequestClient._session_lock:
+        RequestClient._session = None
+
+
+def watch_rate_limits(limiter):
+    """Feed the given ``RateLimiter`` with the status and rate limit headers
+    of each Datadog HTTP API response.
+    """
+    _rate_limiters.add(limiter)
+
+
+def _observe_response(response, *args, **kwargs):
+    for limiter in list(_rate_limiters):
+        limiter.observe(response.status_code, response.headers)
+
+
+def _datadog_errors():
+    """Return errors raised by the Datadog client when the API is not
+    reachable.
+    """
+    from datadog.api import exceptions
+
+    return (
+        exceptions.ApiError,
+        exceptions.ClientError,
+        exceptions.HttpBackoff,
+        exceptions.HTTPError,
+        exceptions.HttpTimeout,
+    )
+
+
+def _ensure_session(pool_size=POOL_SIZE):
+    """Install a pooled keep-alive session in the Datadog HTTP client,
+    unless one is already available.
+
+    Returns:
+        The ``requests.Session`` used to reach Datadog
+    """
+    import datadog
+    import requests
+
+    from datadog.api.http_client import RequestClient
+
+    with RequestClient._session_lock:
+        if RequestClient._session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                max_retries=datadog.api._max_retries,
+            )
+            session = requests.Session()
+            session.hooks["response"].append(_observe_response)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            RequestClient._session = session
+    return RequestClient._session
+
+
+class HTTPTransport(object):
+    """Transport that submits series with the Datadog HTTP Metric API.
+
+    Initializing this class has a side-effect that is initializing the
+    static Datadog API class.
+    """
+
+    name = TRANSPORT_HTTP
+
+    def __init__(self, api_key, api_host=None, timeout=None):
+        """Initialize the Datadog API client.
+
+        Args:
+            api_key: Datadog API key
+            api_host: Datadog API endpoint; ``None`` means the default one
+            timeout: Datadog HTTP requests timeout in seconds
+        """
+        import datadog
+
+        options = {"api_key": api_key, "api_host": api_host}
+        if timeout is not None:
+            options["timeout"] = timeout
+        datadog.initialize(**options)
+        _ensure_session()
+        self.api = datadog.api
+        self._errors = _datadog_errors()
+
+    def submit(self, metrics):
+        """Sends metrics with a single HTTP request.
+
+        Returns:
+            A boolean where ``True`` means the payload has been accepted
+        """
+        try:
+            response = self.api.Metric.send(metrics=metrics)
+        except self._errors as e:
+            logging.error("Unable to reach Datadog: %s", e)
+            return False
+
+        if response.get("status") != "ok":
+            logging.error(response)
+            return False
+        return True
+
+
+class DogStatsdTransport(object):
+    """Transport that sends series as DogStatsD gauges to a local Datadog
+    agent over UDP. Datagrams are sent without waiting for the agent, and
+    many metrics are packed in the same datagram.
+
+    The ``host`` of each series is sent as a ``host:`` tag, so that the
+    agent reports the same host of the HTTP transport.
+    """
+
+    name = TRANSPORT_DOGSTATSD
+
+    def __init__(self, host="127.0.0.1", port=8125, max_packet_size=MAX_PACKET_SIZE):
+        """Initialize the DogStatsD client. The socket is opened on the
+        first submission.
+
+        Args:
+            host: address of the Datadog agent
+            port: DogStatsD port of the Datadog agent
+            max_packet_size: maximum size of a datagram in bytes
+        """
+        self._address = (host, port)
+        self._max_packet_size = max_packet_size
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def submit(self, metrics):
+        """Sends metrics packed in as few datagrams as possible.
+
+        Returns:
+            A boolean where ``True`` means all datagrams have been sent.
+            Delivery to the agent is not confirmed by the UDP protocol.
+        """
+        try:
+            sock = self._get_socket()
+            for packet in self.packets(metrics):
+                sock.send(packet)
+        except OSError as e:
+            logging.error("Unable to reach DogStatsD at %s:%s: %s", *self._address, e)
+            return False
+        return True
+
+    def packets(self, metrics):
+        """Serialize metrics in datagrams no longer than the maximum packet
+        size. Each point is a line such as
+        ``hev.parameters.pressure:80|g|#min,host:hev|T1546300800``.
+        """
+        packet = b""
+        for line in self._lines(metrics):
+            if packet and len(packet) + len(line) + 1 > self._max_packet_size:
+                yield packet
+                packet = b""
+            packet = packet + b"\n" + line if packet else line
+        if packet:
+            yield packet
+
+    def _lines(self, metrics):
+        for metric in metrics:
+            tags = list(metric.get("tags") or [])
+            if metric.get("host"):
+                tags.append("host:{}".format(metric["host"]))
+            suffix = "|#" + ",".join(tags) if tags else ""
+
+            points = metric["points"]
+            if not isinstance(points, (list, tuple)):
+                points = [(None, points)]
+            for timestamp, value in points:
+                line = "{}:{}|g{}".format(metric["metric"], value, suffix)
+                if timestamp is not None:
+                    line += "|T{}".format(int(timestamp))
+                yield line.encode()
+
+    def _get_socket(self):
+        if self._socket is None:
+            with self._lock:
+                if self._socket is None:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    # Never block the request when the socket buffer is full
+                    sock.setblocking(False)
+                    sock.connect(self._address)
+                    self._socket = sock
+        return self._socket
+
+    def close(self):
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+
+class DatadogAPI(Exporter):
     """API abstraction built on top of Datadog API. This instance can
     hides Datadog implementation details, such as "Host", "Tags" and
     metrics names. Using this instance is suggested for the scope of
     the Cloud Function.
 
-    Initializing this class has a side-effect that is initializing
-    the static Datadog API class.
+    Series are submitted with the HTTP Metric API, or with DogStatsD when
+    a local Datadog agent is available. With the HTTP transport,
+    initializing this class has a side-effect that is initializing
+    the static Datadog API class. Use ``get_client()`` to reuse the same
+    instance across requests. The Datadog client is expensive to import,
+    so it's imported only when the first instance is created.
     """
 
-    def __init__(self, api_key, function_name, dry_run=False):
-        # Init Datadog API
-        options = {"api_key": api_key}
-        datadog.initialize(**options)
-        self._api = datadog.api
+    name = "datadog"
+
+    def __init__(
+        self,
+        api_key,
+        function_name,
+        dry_run=False,
+        api_host=None,
+        timeout=None,
+        spool_path=None,
+        spool_max_points=100000,
+        transport=TRANSPORT_HTTP,
+        statsd_host="127.0.0.1",
+        statsd_port=8125,
+    ):
+        """Initialize the Datadog API.
+
+        Args:
+            api_key: Datadog API key
+            function_name: name used as a "host" for submitted metrics
+            dry_run: if ``True`` metrics are never sent to Datadog
+            api_host: Datadog API endpoint; ``None`` means the default one
+            timeout: Datadog HTTP requests timeout in seconds
+            spool_path: if set, a local spool is opened to store points that
+                can't be submitted, that are replayed after the next success
+            spool_max_points: maximum number of points kept in the spool
+            transport: either ``http`` or ``dogstatsd``
+            statsd_host: Datadog agent address, for the DogStatsD transport
+            statsd_port: Datadog agent DogStatsD port
+        """
+        if transport == TRANSPORT_DOGSTATSD:
+            self._transport = DogStatsdTransport(statsd_host, statsd_port)
+            self._api = None
+        else:
+            self._transport = HTTPTransport(api_key, api_host, timeout)
+            self._api = self._transport.api
         self._function_name = function_name
         self._dry_run = dry_run
+        self._spool = None
+        self._replaying = threading.Lock()
+        if spool_path is not None:
+            from .spool import Spool
+
+            self._spool = Spool(spool_path, spool_max_points)
 
+    @span("datadog.send_bpm")
     def send_bpm(self, value):
         """Sends heart BPM to Datadog."""
         if self._dry_run:
             # dry-run a success
             return True
 
+        if self._api is None:
+            return all(
+                self.send_many([{"metric": "hev.parameters.bpm", "points": value}])
+            )
+
         response = self._api.Metric.send(
             host=self._function_name, metric="hev.parameters.bpm", points=value
         )
@@ -38,6 +348,7 @@ class DatadogAPI(object):
         else:
             return True
 
+    @span("datadog.send_pressure")
     def send_pressure(self, value, kind=None):
         """Sends pressure metrics to Datadog."""
         if self._dry_run:
@@ -46,6 +357,14 @@ class DatadogAPI(object):
 
         tags = [kind] if kind is not None else None
 
+        if self._api is None:
+            series = {
+                "metric": "hev.parameters.pressure",
+                "points": value,
+                "tags": tags,
+            }
+            return all(self.send_many([series]))
+
         response = self._api.Metric.send(
             host=self._function_name,
             metric="hev.parameters.pressure",
@@ -59,6 +378,98 @@ class DatadogAPI(object):
         else:
             return True
 
+    @span("datadog.send_many")
+    def send_many(self, series):
+        """Sends multiple series to Datadog in one submission.
+
+        Args:
+            series: a list of dictionaries with ``metric``, ``points`` and
+                optional ``tags`` and ``host`` keys. The ``host`` is the
+                function name, unless it's set in the series.
+
+        Returns:
+            A list of booleans, one for each given series, where ``True``
+            means the series has been accepted. Datadog accepts or rejects
+            the payload as a whole, so a series fails either because it's
+            malformed (no points) or because the submission failed.
+        """
+        results = [s.get("points") is not None for s in series]
+        if self._dry_run:
+            # dry-run a success
+            return results
+
+        valid = [s for s, ok in zip(series, results) if ok]
+        if valid and not self._submit(valid):
+            results = [False] * len(series)
+
+        for s, ok in zip(series, results):
+            if not ok:
+                logging.error(
+                    "Series '%s' %s not submitted", s["metric"], s.get("tags")
+                )
+
+        return results
+
+    @property
+    def spool(self):
+        """The spool of points that couldn't be submitted, or ``None``. It's
+        filled by ``hev.spool.SpoolingExporter`` once all attempts fail.
+        """
+        return self._spool
+
+    def replay(self, batch_size=5000, send_many=None):
+        """Sends spooled points to Datadog, in batches. In dry-run mode
+        nothing is sent and the points are kept.
+
+        Args:
+            batch_size: maximum number of points of each submission
+            send_many: function used to submit the batches, such as the
+                ``send_many()`` of a rate limited exporter; ``None`` means
+                the one of this client
+
+        Returns:
+            The number of replayed points
+        """
+        if self._spool is None or self._dry_run:
+            return 0
+        with self._replaying:
+            return self._spool.replay(self._replayer(send_many), batch_size)
+
+    def replay_in_background(self, send_many=None):
+        """Sends spooled points to Datadog in a background thread, unless a
+        replay is already running.
+
+        Args:
+            send_many: function used to submit the batches, as in ``replay()``
+        """
+        if self._spool is None or self._dry_run:
+            return
+        if not self._replaying.acquire(blocking=False):
+            return
+
+        def replay():
+            try:
+                replayed = self._spool.replay(self._replayer(send_many))
+                logging.info("Replayed %d spooled points", replayed)
+            finally:
+                self._replaying.release()
+
+        threading.Thread(target=replay, name="hev-spool-replay", daemon=True).start()
+
+    def _replayer(self, send_many):
+        # Replayed batches take the same path of submissions, dry-run included
+        send_many = send_many or self.send_many
+        return lambda series: all(send_many(series))
+
+    def _submit(self, series):
+        """Sends series to Datadog with the configured transport.
+
+        Returns:
+            A boolean where ``True`` means the payload has been accepted
+        """
+        metrics = [dict({"host": self._function_name}, **s) for s in series]
+        return self._transport.submit(metrics)
+
 
 class DialogFlowRequest(object):
     """DialogFlow request class used to validate received data.
@@ -66,20 +477,39 @@ class DialogFlowRequest(object):
     encapsulated in this class.
     """
 
-    MANDATORY = ["bpm", "min", "max"]
+    MANDATORY = [field.name for field in PARAMETERS]
 
-    def __init__(self, request):
+    def __init__(self, request, max_body_size=MAX_BODY_SIZE):
         """Wrap Flask Request instance that contains DialogFlow data.
         The constructor stores parsed JSON data.
 
         Args:
             request: Flask Request instance.
+            max_body_size: maximum request body size in bytes
 
         Returns:
             A DialogFlow request instance that contains utility methods
             to manipulate and retrieve parameters.
+
+        Raises:
+            RequestTooLarge: the request body exceeds ``max_body_size``
         """
-        self._data = request.get_json(silent=True)
+        with span("dialogflow.parse"):
+            self._data = parse_request(request, max_body_size)
+        self._reading = None
+
+    @property
+    def data(self):
+        """The parsed request, or ``None`` if it's not valid JSON."""
+        return self._data
+
+    @property
+    def language(self):
+        """The DialogFlow ``languageCode`` of the request, if any."""
+        try:
+            return self._data["queryResult"]["languageCode"]
+        except (KeyError, TypeError):
+            return None
 
     def validate(self):
         """Validate DialogFlowRequest to be sure it contains expected data.
@@ -90,18 +520,33 @@ class DialogFlowRequest(object):
         Raises:
             BadRequest: malformed data must abort the function execution
         """
-        if self._data is None:
-            raise BadRequest("Malformed request")
+        self.read()
+        return True
 
-        missing = []
-        for field in self.MANDATORY:
-            if self.get_parameter(field) is None:
-                missing.append(field)
+    def read(self):
+        """Validate and extract HEV parameters with a single pass over the
+        DialogFlow parameters. Types and ranges are checked according to
+        the ``hev.schema.PARAMETERS`` schema.
 
-        if missing:
-            raise BadRequest("Missing mandatory fields: {}".format(missing))
+        Returns:
+            A ``Reading`` instance
 
-        return True
+        Raises:
+            BadRequest: malformed data must abort the function execution.
+                The message reports all missing and invalid fields.
+        """
+        if self._reading is None:
+            if self._data is None:
+                raise BadRequest("Malformed request")
+
+            with span("dialogflow.validate"):
+                try:
+                    params = self._data["queryResult"]["parameters"]
+                except (KeyError, TypeError):
+                    params = None
+                self._reading = extract_reading(params)
+
+        return self._reading
 
     def get_parameter(self, param):
         """Get the DialogFlow parameter.
@@ -0,0 +1,111 @@
+import json
+import logging
+
+from . import handlers
+from .handlers import Headers, parse_query
+
+# Maximum accepted request body, in bytes
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class Request(handlers.Request):
+    """HTTP request received by an ASGI application, with the whole body
+    already read.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, scope, body=b""):
+        """Initialize the request.
+
+        Args:
+            scope: the ASGI connection scope
+            body: the whole request body
+        """
+        headers = Headers(
+            (name.decode("latin-1").lower(), value.decode("latin-1"))
+            for name, value in scope.get("headers", [])
+        )
+        query = scope.get("query_string", b"").decode("latin-1")
+        super(Request, self).__init__(
+            scope["method"], headers, body, scope["path"], parse_query(query)
+        )
+
+
+class ASGIApp(object):
+    """ASGI application that routes ``POST`` requests to webhook handlers.
+    A handler is a coroutine function that receives a ``Request`` and
+    returns a ``(response, status)`` pair, where ``response`` is a JSON
+    document.
+    """
+
+    def __init__(self, routes, on_shutdown=None, max_body_size=MAX_BODY_SIZE):
+        """Initialize the application.
+
+        Args:
+            routes: a dictionary that maps paths to handlers
+            on_shutdown: optional coroutine function called when the
+                server shuts down, to release resources
+            max_body_size: larger request bodies are rejected with ``413``
+        """
+        self.routes = routes
+        self._on_shutdown = on_shutdown
+        self._max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        handler = self.routes.get(scope["path"])
+        if handler is None:
+            response, status = json.dumps({"message": "Not Found"}), 404
+        else:
+            body = await self._read_body(receive)
+            if body is None:
+                response, status = json.dumps({"message": "Payload Too Large"}), 413
+            else:
+                try:
+                    response, status = await handler(Request(scope, body))
+                except Exception:
+                    logging.exception("Unhandled error serving '%s'", scope["path"])
+                    response, status = json.dumps({"message": "Internal Error"}), 500
+
+        data = response.encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(data)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": data})
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self._max_body_size:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._on_shutdown is not None:
+                    await self._on_shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -1,6 +1,10 @@
+import hmac
+
 from .exceptions import NotAuthorized
+from .tracing import span
 
 
+@span("auth")
 def is_authorized(request, authorized_token):
     """Return if the given request is authorized.
 
@@ -22,14 +26,48 @@ def is_authorized(request, authorized_token):
             authorized. It's raised when a Bearer token is missed
             or is wrong.
     """
-    auth_header = request.headers.get("Authorization")
-
-    # do something only if request contains a Bearer token
+    token = _bearer_token(request)
     if (
-        auth_header is None
-        or not auth_header.startswith("Bearer")
-        or auth_header[7:] != authorized_token
+        token is None
+        or authorized_token is None
+        or not hmac.compare_digest(token.encode(), authorized_token.encode())
     ):
         raise NotAuthorized("Authorization headers are missing")
 
     return True
+
+
+@span("auth")
+def authenticate(request, registry):
+    """Return the tenant that owns the Bearer token of the given request.
+
+    Args:
+        request: A Flask Request object
+        registry: A token registry, such as the one returned by
+            ``hev.tenants.get_registry()``
+
+    Returns:
+        The ``Tenant`` that owns the token
+
+    Raises:
+        NotAuthorized: An error occurred when the request is not
+            authorized. It's raised when a Bearer token is missed
+            or is not registered.
+    """
+    token = _bearer_token(request)
+    tenant = None
+    if token is not None and registry is not None:
+        tenant = registry.resolve(token)
+    if tenant is None:
+        raise NotAuthorized("Authorization headers are missing")
+    return tenant
+
+
+def _bearer_token(request):
+    """Return the Bearer token of the request, if any."""
+    auth_header = request.headers.get("Authorization")
+
+    # do something only if request contains a Bearer token
+    if auth_header is None or not auth_header.startswith("Bearer "):
+        return None
+    return auth_header[7:]
@@ -0,0 +1,96 @@
+import time
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import BadRequest
+from .ingest import batched, build_series, validate_reading
+
+
+class Backfill(object):
+    """Pipeline that sends historical readings to an exporter. Rows are
+    validated, grouped in batches and sent with a bounded number of
+    concurrent submissions, so that memory usage doesn't depend on the
+    number of rows.
+    """
+
+    def __init__(self, exporter, batch_size=500, max_inflight=4, progress_interval=5.0):
+        """Initialize the pipeline.
+
+        Args:
+            exporter: an ``Exporter`` that receives readings
+            batch_size: readings sent with a single submission
+            max_inflight: maximum number of concurrent submissions
+            progress_interval: seconds between progress reports
+        """
+        self._exporter = exporter
+        self._batch_size = batch_size
+        self._max_inflight = max_inflight
+        self._progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self.stats = {"rows": 0, "accepted": 0, "rejected": 0, "failed": 0}
+
+    def run(self, rows):
+        """Send readings from the given rows.
+
+        Args:
+            rows: an iterable of ``(row, data, error)`` tuples, such as the
+                ones returned by ``hev.ingest`` parsers
+
+        Returns:
+            A dictionary with the pipeline statistics
+        """
+        start = time.monotonic()
+        last_report = start
+        slots = threading.BoundedSemaphore(self._max_inflight)
+
+        with ThreadPoolExecutor(max_workers=self._max_inflight) as executor:
+            for batch in batched(self._readings(rows), self._batch_size):
+                slots.acquire()
+                future = executor.submit(self._send, batch)
+                future.add_done_callback(lambda f: slots.release())
+
+                now = time.monotonic()
+                if now - last_report >= self._progress_interval:
+                    self._report(now - start)
+                    last_report = now
+
+        self.stats["elapsed"] = time.monotonic() - start
+        self._report(self.stats["elapsed"])
+        return self.stats
+
+    def _readings(self, rows):
+        for row, data, error in rows:
+            self.stats["rows"] += 1
+            if error is None:
+                try:
+                    yield validate_reading(data)
+                    continue
+                except BadRequest as e:
+                    error = str(e)
+
+            self.stats["rejected"] += 1
+            logging.warning("Row %d rejected: %s", row, error)
+
+    def _send(self, batch):
+        try:
+            ok = all(self._exporter.send_many(build_series(batch)))
+        except Exception:
+            logging.exception("Unable to send %d readings", len(batch))
+            ok = False
+
+        with self._lock:
+            self.stats["accepted" if ok else "failed"] += len(batch)
+
+    def _report(self, elapsed):
+        with self._lock:
+            stats = dict(self.stats)
+        logging.info(
+            "%d rows read, %d accepted, %d rejected, %d failed (%.0f rows/s)",
+            stats["rows"],
+            stats["accepted"],
+            stats["rejected"],
+            stats["failed"],
+            stats["rows"] / elapsed if elapsed else 0,
+        )
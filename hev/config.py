@@ -1,8 +1,18 @@
+import os
+import json
 import logging
+import threading
 
-from os import getenv
-
-from .utils import as_bool
+from .utils import as_bool, as_float, as_list
+from .constants import (
+    ANOMALY_MIN_HISTORY,
+    ANOMALY_POLICIES,
+    EXPORTERS,
+    QUEUE_DROP_OLDEST,
+    QUEUE_POLICIES,
+    TRANSPORT_HTTP,
+    TRANSPORTS,
+)
 from .exceptions import ConfigException
 
 
@@ -13,12 +23,57 @@ class Config(object):
 
     MANDATORY_ATTRIBUTES = ["dd_api_key", "function_name", "bearer_token"]
 
-    def __init__(self):
-        """Initialize the Config instance using environment variables."""
+    def __init__(self, environ=None):
+        """Initialize the Config instance using environment variables.
+
+        Args:
+            environ: mapping of environment variables; ``None`` means the
+                environment of the process
+        """
+        getenv = (os.environ if environ is None else environ).get
         self.dd_api_key = getenv("DD_API_KEY")
+        self.dd_api_host = getenv("DD_API_HOST")
+        self.dd_transport = getenv("DD_TRANSPORT", TRANSPORT_HTTP)
+        self.dd_agent_host = getenv("DD_AGENT_HOST", "127.0.0.1")
+        self.dd_dogstatsd_port = int(getenv("DD_DOGSTATSD_PORT", 8125))
+        self.dd_rate_limit = as_float(getenv("DD_RATE_LIMIT"))
+        self.dd_rate_burst = int(getenv("DD_RATE_BURST", 10))
         self.function_name = getenv("FUNCTION_NAME")
         self.bearer_token = getenv("BEARER_TOKEN")
+        self.bearer_tokens = getenv("BEARER_TOKENS")
+        self.tokens_path = getenv("TOKENS_PATH")
+        self.tokens_reload = float(getenv("TOKENS_RELOAD", 5))
+        self.max_body_size = int(getenv("MAX_BODY_SIZE", 256 * 1024))
         self.dry_run = as_bool(getenv("DRY_RUN", False))
+        self.async_export = as_bool(getenv("ASYNC_EXPORT", False))
+        self.queue_size = int(getenv("QUEUE_SIZE", 1000))
+        self.queue_policy = getenv("QUEUE_POLICY", QUEUE_DROP_OLDEST)
+        self.exporters = as_list(getenv("EXPORTERS", "datadog"))
+        self.jsonl_path = getenv("JSONL_PATH", "/tmp/hev.jsonl")
+        self.export_timeout = float(getenv("EXPORT_TIMEOUT", 10))
+        self.export_retries = int(getenv("EXPORT_RETRIES", 2))
+        self.export_deadline = as_float(getenv("EXPORT_DEADLINE"))
+        self.retry_backoff = float(getenv("RETRY_BACKOFF", 0.1))
+        self.breaker_threshold = int(getenv("BREAKER_THRESHOLD", 5))
+        self.breaker_reset = float(getenv("BREAKER_RESET", 30))
+        self.spool_path = getenv("SPOOL_PATH")
+        self.spool_max_points = int(getenv("SPOOL_MAX_POINTS", 100000))
+        self.aggregation_window = as_float(getenv("AGGREGATION_WINDOW"))
+        self.anomaly_policy = getenv("ANOMALY_POLICY")
+        self.anomaly_window = int(getenv("ANOMALY_WINDOW", 60))
+        self.anomaly_threshold = float(getenv("ANOMALY_THRESHOLD", 3.5))
+        self.trace_sample_rate = float(getenv("TRACE_SAMPLE_RATE", 0))
+        self.trace_metrics = as_bool(getenv("TRACE_METRICS", False))
+        self.idempotency_ttl = as_float(getenv("IDEMPOTENCY_TTL"))
+        self.idempotency_max_entries = int(getenv("IDEMPOTENCY_MAX_ENTRIES", 10000))
+        self.server_bind = getenv("SERVER_BIND", "0.0.0.0:8080")
+        self.server_workers = int(getenv("SERVER_WORKERS", 2))
+        self.server_graceful_timeout = float(getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+        self.server_drain_delay = float(getenv("SERVER_DRAIN_DELAY", 5))
+        self.store_path = getenv("STORE_PATH", "/tmp/hev-store")
+        self.store_capacity = int(getenv("STORE_CAPACITY", 525600))
+        self.secrets_path = getenv("SECRETS_PATH")
+        self.config_reload = float(getenv("CONFIG_RELOAD", 0))
 
     def validate(self):
         """Validate the configuration instance.
@@ -33,11 +88,295 @@ class Config(object):
         """
         bail_out = False
         for attr in self.MANDATORY_ATTRIBUTES:
+            if attr == "bearer_token" and (self.bearer_tokens or self.tokens_path):
+                # Tokens are provided by the multi-tenant registry
+                continue
             if getattr(self, attr, None) is None:
                 bail_out = True
                 logging.error(
                     "Environment variable '{}' is not set".format(attr.upper())
                 )
 
+        if self.queue_policy not in QUEUE_POLICIES:
+            bail_out = True
+            logging.error(
+                "Environment variable 'QUEUE_POLICY' must be one of {}".format(
+                    QUEUE_POLICIES
+                )
+            )
+
+        if self.dd_transport not in TRANSPORTS:
+            bail_out = True
+            logging.error(
+                "Environment variable 'DD_TRANSPORT' must be one of {}".format(
+                    TRANSPORTS
+                )
+            )
+
+        if self.anomaly_policy is not None and (
+            self.anomaly_policy not in ANOMALY_POLICIES
+        ):
+            bail_out = True
+            logging.error(
+                "Environment variable 'ANOMALY_POLICY' must be one of {}".format(
+                    ANOMALY_POLICIES
+                )
+            )
+
+        if self.dd_rate_limit is not None and self.dd_rate_limit <= 0:
+            bail_out = True
+            logging.error("Environment variable 'DD_RATE_LIMIT' must be positive")
+
+        if self.dd_rate_burst < 1:
+            bail_out = True
+            logging.error("Environment variable 'DD_RATE_BURST' must be at least 1")
+
+        if self.anomaly_window < ANOMALY_MIN_HISTORY:
+            # Shorter windows never have enough readings to look for outliers
+            bail_out = True
+            logging.error(
+                "Environment variable 'ANOMALY_WINDOW' must be at least {}".format(
+                    ANOMALY_MIN_HISTORY
+                )
+            )
+
+        if self.anomaly_threshold <= 0:
+            bail_out = True
+            logging.error("Environment variable 'ANOMALY_THRESHOLD' must be positive")
+
+        unknown = [name for name in self.exporters if name not in EXPORTERS]
+        if unknown:
+            bail_out = True
+            logging.error("Exporters {} are not available".format(unknown))
+
         if bail_out:
             raise ConfigException("Mandatory environment variables are not set")
+
+    def snapshot(self):
+        """Return an immutable and validated copy of the configuration."""
+        return ConfigSnapshot(self)
+
+
+class ConfigSnapshot(object):
+    """Immutable copy of a ``Config``, validated when it's built. A reload
+    replaces the whole snapshot, so that a request that holds one always
+    sees consistent values, and validating a snapshot costs a single
+    attribute read.
+    """
+
+    __slots__ = tuple(vars(Config({}))) + ("_error",)
+
+    def __init__(self, conf):
+        """Copy and validate the given configuration.
+
+        Args:
+            conf: a ``Config`` instance
+        """
+        for name in self.__slots__[:-1]:
+            value = getattr(conf, name)
+            if isinstance(value, list):
+                value = tuple(value)
+            object.__setattr__(self, name, value)
+
+        try:
+            conf.validate()
+            error = None
+        except ConfigException as e:
+            error = str(e)
+        object.__setattr__(self, "_error", error)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Configuration snapshots are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Configuration snapshots are read-only")
+
+    def validate(self):
+        """Raise the outcome of the validation of this snapshot.
+
+        Raises:
+            ConfigException: the configuration is not valid
+        """
+        if self._error is not None:
+            raise ConfigException(self._error)
+
+    def changes(self, other):
+        """Return the names of attributes that differ from another snapshot."""
+        return [
+            name
+            for name in self.__slots__[:-1]
+            if getattr(self, name) != getattr(other, name, None)
+        ]
+
+
+def read_secrets(path):
+    """Read variables from a mounted secrets file, either a JSON object or
+    ``KEY=VALUE`` lines, or from a directory with a file for each variable,
+    such as a Kubernetes secret volume.
+
+    Returns:
+        A dictionary of variables
+
+    Raises:
+        ConfigException: the secrets can't be read
+    """
+    try:
+        if os.path.isdir(path):
+            secrets = {}
+            for name in os.listdir(path):
+                item = os.path.join(path, name)
+                if not name.startswith(".") and os.path.isfile(item):
+                    with open(item) as f:
+                        secrets[name] = f.read().strip()
+            return secrets
+
+        with open(path) as f:
+            content = f.read()
+    except OSError as e:
+        raise ConfigException("Unable to read secrets '{}': {}".format(path, e))
+
+    if content.lstrip().startswith("{"):
+        try:
+            return {k: str(v) for k, v in json.loads(content).items()}
+        except ValueError as e:
+            raise ConfigException("Unable to parse secrets '{}': {}".format(path, e))
+
+    secrets = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            name, _, value = line.partition("=")
+            secrets[name.strip()] = value.strip()
+    return secrets
+
+
+def load_config(environ=None):
+    """Load a snapshot of the configuration. Environment variables are
+    overridden by the ones of the ``SECRETS_PATH`` file, if any.
+
+    Args:
+        environ: mapping of environment variables; ``None`` means the
+            environment of the process
+
+    Returns:
+        A ``ConfigSnapshot`` instance
+
+    Raises:
+        ConfigException: secrets can't be read, or a value can't be parsed
+    """
+    environ = dict(os.environ if environ is None else environ)
+    if environ.get("SECRETS_PATH"):
+        environ.update(read_secrets(environ["SECRETS_PATH"]))
+    try:
+        return Config(environ).snapshot()
+    except ValueError as e:
+        raise ConfigException("Invalid configuration value: {}".format(e))
+
+
+_reload_lock = threading.Lock()
+
+
+def reload_config(environ=None):
+    """Load the configuration again and replace ``hev.conf`` with it. The
+    swap is atomic: requests in progress keep the snapshot they started
+    with. An invalid configuration is ignored.
+
+    Returns:
+        The new ``ConfigSnapshot``, or ``None`` if the current one is kept
+    """
+    import hev
+
+    with _reload_lock:
+        try:
+            conf = load_config(environ)
+            conf.validate()
+        except ConfigException as e:
+            logging.error("Configuration not reloaded: %s", e)
+            return None
+
+        previous = hev.conf
+        if isinstance(previous, ConfigSnapshot):
+            changed = conf.changes(previous)
+            if not changed:
+                return previous
+            logging.info("Configuration reloaded, changed: %s", ", ".join(changed))
+        hev.conf = conf
+        return conf
+
+
+def _mtime(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if os.path.isdir(path):
+            # Mounted secret volumes replace files through symbolic links
+            for name in os.listdir(path):
+                mtime = max(mtime, os.stat(os.path.join(path, name)).st_mtime_ns)
+        return mtime
+    except OSError:
+        return None
+
+
+class ConfigWatcher(object):
+    """Background thread that reloads the configuration when the secrets
+    file changes. The modification time is polled, so that no platform
+    specific notification API is required.
+    """
+
+    def __init__(self, path, interval=30.0, reload=reload_config):
+        """Initialize the watcher. The thread is not started.
+
+        Args:
+            path: secrets file or directory
+            interval: seconds between modification checks
+            reload: function called when the secrets change
+        """
+        self.path = path
+        self.interval = interval
+        self._reload = reload
+        self._mtime = _mtime(path)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Reload the configuration if the secrets changed.
+
+        Returns:
+            A boolean where ``True`` means the secrets changed
+        """
+        mtime = _mtime(self.path)
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        self._reload()
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="hev-config-watcher", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Unable to reload the configuration")
+
+
+def watch_config(conf):
+    """Start a ``ConfigWatcher`` if the configuration has a secrets file
+    and a ``CONFIG_RELOAD`` interval.
+
+    Returns:
+        The started watcher, or ``None``
+    """
+    if not conf.secrets_path or not conf.config_reload:
+        return None
+    return ConfigWatcher(conf.secrets_path, conf.config_reload).start()
@@ -1,2 +1,28 @@
 KIND_DIASTOLIC = "min"
 KIND_SYSTOLIC = "max"
+
+# Backpressure policies for the asynchronous export queue
+QUEUE_DROP_OLDEST = "drop-oldest"
+QUEUE_BLOCK = "block"
+QUEUE_REJECT = "reject"
+QUEUE_POLICIES = (QUEUE_DROP_OLDEST, QUEUE_BLOCK, QUEUE_REJECT)
+
+# Available exporters
+EXPORTER_DATADOG = "datadog"
+EXPORTER_JSONL = "jsonl"
+EXPORTER_MEMORY = "memory"
+EXPORTER_STORE = "store"
+EXPORTERS = (EXPORTER_DATADOG, EXPORTER_JSONL, EXPORTER_MEMORY, EXPORTER_STORE)
+
+# Datadog transports
+TRANSPORT_HTTP = "http"
+TRANSPORT_DOGSTATSD = "dogstatsd"
+TRANSPORTS = (TRANSPORT_HTTP, TRANSPORT_DOGSTATSD)
+
+# Policies for anomalous readings
+ANOMALY_TAG = "tag"
+ANOMALY_QUARANTINE = "quarantine"
+ANOMALY_POLICIES = (ANOMALY_TAG, ANOMALY_QUARANTINE)
+
+# Minimum number of readings in the rolling window to look for outliers
+ANOMALY_MIN_HISTORY = 10
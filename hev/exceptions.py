@@ -21,3 +21,18 @@ class BadRequest(Exception):
     """
 
     pass
+
+
+class RequestTooLarge(BadRequest):
+    """RequestTooLarge must be raised when the received request
+    body exceeds the maximum accepted size.
+    """
+
+    def __init__(self, size, max_size):
+        if size is None:
+            message = "Request body exceeds {} bytes".format(max_size)
+        else:
+            message = "Request body of {} bytes exceeds {} bytes".format(size, max_size)
+        super(RequestTooLarge, self).__init__(message)
+        self.size = size
+        self.max_size = max_size
@@ -0,0 +1,376 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+
+from .constants import (
+    EXPORTER_DATADOG,
+    EXPORTER_JSONL,
+    EXPORTER_MEMORY,
+    EXPORTER_STORE,
+    KIND_DIASTOLIC,
+    KIND_SYSTOLIC,
+    TRANSPORT_HTTP,
+)
+
+
+class Exporter(object):
+    """Generic interface of a service that receives HEV parameters. Each
+    exporter receives a list of series, where a series is a dictionary with
+    ``metric``, ``points`` and optional ``tags`` keys.
+
+    Subclasses must implement ``send_many()``.
+    """
+
+    # Name used to report the exporter status
+    name = None
+
+    # Seconds the dispatcher waits for this exporter; ``None`` means the
+    # dispatcher default is used
+    timeout = None
+
+    def send_many(self, series):
+        """Sends multiple series to the exporter backend.
+
+        Args:
+            series: a list of series
+
+        Returns:
+            A list of booleans, one for each given series, where ``True``
+            means the series has been accepted
+        """
+        raise NotImplementedError
+
+    def send_parameters(self, bpm, value_min, value_max):
+        """Sends all HEV parameters with a single submission.
+
+        Args:
+            bpm: heart BPM value
+            value_min: diastolic pressure value
+            value_max: systolic pressure value
+
+        Returns:
+            A list of booleans, one for each submitted series, where ``True``
+            means the series has been accepted
+        """
+        return self.send_many(self.build_parameters(bpm, value_min, value_max))
+
+    @staticmethod
+    def build_parameters(bpm, value_min, value_max, timestamp=None):
+        """Build the list of series that represents HEV parameters.
+
+        Args:
+            bpm: heart BPM value
+            value_min: diastolic pressure value
+            value_max: systolic pressure value
+            timestamp: when values have been measured; if set, points are
+                ``(timestamp, value)`` pairs so that retried or replayed
+                submissions always refer to the same point in time
+
+        Returns:
+            A list of series that can be submitted with ``send_many()``
+        """
+
+        def point(value):
+            if timestamp is None or value is None:
+                return value
+            return [(timestamp, value)]
+
+        return [
+            {"metric": "hev.parameters.bpm", "points": point(bpm)},
+            {
+                "metric": "hev.parameters.pressure",
+                "points": point(value_min),
+                "tags": [KIND_DIASTOLIC],
+            },
+            {
+                "metric": "hev.parameters.pressure",
+                "points": point(value_max),
+                "tags": [KIND_SYSTOLIC],
+            },
+        ]
+
+
+class JSONLExporter(Exporter):
+    """Exporter that appends each series as a JSON line to a local file."""
+
+    name = EXPORTER_JSONL
+
+    def __init__(self, path, host=None):
+        self._path = path
+        self._host = host
+        self._lock = threading.Lock()
+
+    def send_many(self, series):
+        now = time.time()
+        lines = "".join(json.dumps(self._record(s, now)) + "\n" for s in series)
+        try:
+            with self._lock, open(self._path, "a") as f:
+                f.write(lines)
+        except OSError:
+            logging.exception("Unable to write series to '%s'", self._path)
+            return [False] * len(series)
+        return [True] * len(series)
+
+    def _record(self, series, now):
+        # The series host, if any, takes precedence over the exporter one
+        record = dict({"host": self._host}, **series)
+        record["timestamp"] = now
+        return record
+
+
+class MemoryExporter(Exporter):
+    """Exporter that keeps series in memory. Meant to be used in tests."""
+
+    name = EXPORTER_MEMORY
+
+    def __init__(self):
+        self.series = []
+        self._lock = threading.Lock()
+
+    def send_many(self, series):
+        with self._lock:
+            self.series.extend(series)
+        return [True] * len(series)
+
+    def clear(self):
+        with self._lock:
+            self.series = []
+
+
+class Dispatcher(Exporter):
+    """Exporter that sends the same series to many exporters concurrently.
+    The dispatch time is bounded by the slowest exporter timeout, instead
+    of the sum of all exporters execution time.
+    """
+
+    name = "dispatcher"
+
+    def __init__(self, exporters, timeout=10.0):
+        """Initialize the dispatcher.
+
+        Args:
+            exporters: a list of ``Exporter`` instances
+            timeout: seconds to wait for exporters that don't define their
+                own timeout
+        """
+        self.exporters = list(exporters)
+        self._timeout = timeout
+
+    def dispatch(self, series):
+        """Sends series to all exporters concurrently.
+
+        Returns:
+            A dictionary that maps each exporter name to its results. An
+            exporter that raises or exceeds its timeout has all its series
+            marked as failed.
+        """
+        from concurrent.futures import TimeoutError
+
+        start = time.monotonic()
+        # Exporters run in the context of the caller, so that their spans
+        # are part of the current request trace
+        futures = [
+            (
+                exporter,
+                _get_executor().submit(
+                    contextvars.copy_context().run, exporter.send_many, series
+                ),
+            )
+            for exporter in self.exporters
+        ]
+
+        report = {}
+        for exporter, future in futures:
+            timeout = (
+                exporter.timeout if exporter.timeout is not None else self._timeout
+            )
+            remaining = max(timeout - (time.monotonic() - start), 0)
+            try:
+                report[exporter.name] = future.result(timeout=remaining)
+            except TimeoutError:
+                logging.error("Exporter '%s' timed out", exporter.name)
+                report[exporter.name] = [False] * len(series)
+            except Exception:
+                logging.exception("Exporter '%s' failed", exporter.name)
+                report[exporter.name] = [False] * len(series)
+        return report
+
+    def send_many(self, series):
+        """Sends series to all exporters concurrently.
+
+        Returns:
+            A list of booleans where ``True`` means the series has been
+            accepted by all exporters
+        """
+        report = self.dispatch(series)
+        return [all(results) for results in zip(*report.values())]
+
+    def stats(self):
+        """Return the state of exporters that expose one, such as the
+        circuit breaker state. Meant to be used for monitoring.
+        """
+        return {
+            exporter.name: exporter.stats()
+            for exporter in self.exporters
+            if hasattr(exporter, "stats")
+        }
+
+    def close(self):
+        """Release exporters that hold resources, such as pending
+        aggregation windows.
+        """
+        for exporter in self.exporters:
+            if hasattr(exporter, "close"):
+                exporter.close()
+
+
+# Thread pool shared by all dispatchers, created on first use
+MAX_WORKERS = 8
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS, thread_name_prefix="hev-exporter"
+                )
+    return _executor
+
+
+# Dispatcher cache, reused across warm Cloud Function invocations
+DISPATCHER_ATTRIBUTES = [
+    "exporters",
+    "dd_api_key",
+    "dd_api_host",
+    "dd_transport",
+    "dd_agent_host",
+    "dd_dogstatsd_port",
+    "dd_rate_limit",
+    "dd_rate_burst",
+    "function_name",
+    "dry_run",
+    "jsonl_path",
+    "export_timeout",
+    "export_retries",
+    "export_deadline",
+    "retry_backoff",
+    "breaker_threshold",
+    "breaker_reset",
+    "spool_path",
+    "spool_max_points",
+    "aggregation_window",
+    "anomaly_policy",
+    "anomaly_window",
+    "anomaly_threshold",
+    "store_path",
+    "store_capacity",
+]
+_dispatcher = None
+_dispatcher_key = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(conf):
+    """Return a cached ``Dispatcher`` built from the given configuration.
+    The dispatcher is rebuilt only when the related configuration changes.
+
+    Args:
+        conf: a ``Config`` instance
+
+    Returns:
+        A ``Dispatcher`` instance
+    """
+    global _dispatcher, _dispatcher_key
+    key = tuple(
+        tuple(value) if isinstance(value, list) else value
+        for value in (getattr(conf, attr) for attr in DISPATCHER_ATTRIBUTES)
+    )
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher_key != key:
+            if _dispatcher is not None:
+                _dispatcher.close()
+            _dispatcher = Dispatcher(_build_exporters(conf), conf.export_timeout)
+            _dispatcher_key = key
+        return _dispatcher
+
+
+def reset_dispatcher():
+    """Invalidate the cached dispatcher."""
+    global _dispatcher, _dispatcher_key
+    with _dispatcher_lock:
+        dispatcher, _dispatcher = _dispatcher, None
+        _dispatcher_key = None
+    if dispatcher is not None:
+        dispatcher.close()
+
+
+def _build_exporters(conf):
+    # Imported here to avoid circular imports, because the DatadogAPI and
+    # the exporter wrappers are Exporters themselves
+    from .api import get_client, watch_rate_limits
+    from .aggregation import aggregate
+    from .ratelimit import RateLimitedExporter, RateLimiter
+    from .resilience import CircuitBreaker, ResilientExporter, RetryPolicy
+    from .spool import SpoolingExporter
+
+    exporters = []
+    for name in conf.exporters:
+        client = None
+        if name == EXPORTER_DATADOG:
+            exporter = client = get_client(
+                conf.dd_api_key,
+                conf.function_name,
+                conf.dry_run,
+                api_host=conf.dd_api_host,
+                timeout=conf.export_timeout,
+                spool_path=conf.spool_path,
+                spool_max_points=conf.spool_max_points,
+                transport=conf.dd_transport,
+                statsd_host=conf.dd_agent_host,
+                statsd_port=conf.dd_dogstatsd_port,
+            )
+            if conf.dd_transport == TRANSPORT_HTTP:
+                # Submissions of all threads share the Datadog quota
+                limiter = RateLimiter(conf.dd_rate_limit, conf.dd_rate_burst)
+                watch_rate_limits(limiter)
+                exporter = RateLimitedExporter(exporter, limiter, conf.export_timeout)
+        elif name == EXPORTER_JSONL:
+            exporter = JSONLExporter(conf.jsonl_path, conf.function_name)
+        elif name == EXPORTER_MEMORY:
+            exporter = MemoryExporter()
+        elif name == EXPORTER_STORE:
+            # numpy is required only when the local store is enabled
+            from .store import StoreExporter, get_store
+
+            exporter = StoreExporter(get_store(conf))
+
+        retry = RetryPolicy(
+            retries=conf.export_retries,
+            backoff=conf.retry_backoff,
+            deadline=conf.export_deadline,
+        )
+        breaker = CircuitBreaker(name, conf.breaker_threshold, conf.breaker_reset)
+        exporter = ResilientExporter(exporter, retry, breaker)
+        # Points are spooled once all attempts fail or they're rejected
+        if client is not None and client.spool is not None:
+            exporter = SpoolingExporter(exporter, client)
+        # The local store keeps readings, not aggregates
+        if conf.aggregation_window and name != EXPORTER_STORE:
+            exporter = aggregate(exporter, conf.aggregation_window)
+        # Readings are scored before they're aggregated and sent to Datadog
+        if conf.anomaly_policy and name == EXPORTER_DATADOG:
+            # numpy is required only when anomaly detection is enabled
+            from .anomaly import AnomalyExporter, Detector
+
+            detector = Detector(conf.anomaly_window, conf.anomaly_threshold)
+            exporter = AnomalyExporter(exporter, detector, conf.anomaly_policy)
+        exporters.append(exporter)
+    return exporters
@@ -0,0 +1,117 @@
+import json
+
+from urllib.parse import parse_qsl
+
+# Headers of JSON replies
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class Headers(dict):
+    """Case insensitive request headers."""
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+
+class Request(object):
+    """Framework agnostic HTTP request, the input of core handlers. It
+    exposes the subset of the Flask Request interface used by handlers, so
+    that the same authorization and validation logic serves all runtimes.
+
+    The body is either the whole ``body`` bytes or a ``stream`` bounded by
+    the request length, that is read only if a handler needs it.
+    """
+
+    __slots__ = ("method", "path", "headers", "args", "stream", "_body", "_json")
+
+    def __init__(
+        self, method, headers=None, body=b"", path="/", args=None, stream=None
+    ):
+        """Initialize the request.
+
+        Args:
+            method: the HTTP method
+            headers: an object with a case insensitive ``get()`` method,
+                or a dictionary with lowercase header names
+            body: the whole request body; ignored if ``stream`` is set
+            path: the request path
+            args: a dictionary with the query parameters
+            stream: a file-like object with the request body
+        """
+        self.method = method
+        self.path = path
+        if headers is None or type(headers) is dict:
+            headers = Headers((k.lower(), v) for k, v in (headers or {}).items())
+        self.headers = headers
+        self.args = args if args is not None else {}
+        self.stream = stream
+        self._body = body if stream is None else None
+        self._json = None
+
+    @property
+    def data(self):
+        """The whole request body; a streamed body is read once."""
+        if self._body is None:
+            self._body = self.stream.read()
+            self.stream = None
+        return self._body
+
+    @property
+    def mimetype(self):
+        return self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+    def get_json(self, silent=False):
+        """Parse the body as JSON; parsed data is cached.
+
+        Returns:
+            The parsed JSON, or ``None`` if ``silent`` is set and the body
+            is not valid JSON
+        """
+        if self._json is None:
+            try:
+                self._json = json.loads(self.data)
+            except ValueError:
+                if silent:
+                    return None
+                raise
+        return self._json
+
+
+class Response(object):
+    """Plain HTTP response returned by core handlers."""
+
+    __slots__ = ("body", "status", "headers")
+
+    def __init__(self, body, status=200, headers=JSON_HEADERS):
+        """Initialize the response.
+
+        Args:
+            body: the response text or bytes
+            status: the HTTP status code
+            headers: a dictionary with the response headers; it's shared
+                across responses, so it must not be changed
+        """
+        self.body = body
+        self.status = status
+        self.headers = headers
+
+    @classmethod
+    def from_reply(cls, reply):
+        """Build a JSON response from a ``(response, status)`` pair, such
+        as the ones of ``hev.responses``.
+        """
+        return cls(reply[0], reply[1])
+
+    def get_json(self):
+        """Parse the body as JSON."""
+        return json.loads(self.body)
+
+
+def parse_query(query):
+    """Return the query parameters of a query string as a dictionary; the
+    first value of repeated parameters is kept, as in Flask ``args.get()``.
+    """
+    args = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        args.setdefault(name, value)
+    return args
@@ -0,0 +1,252 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .responses import IN_PROGRESS as REPLY_IN_PROGRESS, responses
+
+# Value stored while the first request with a given key is being served
+IN_PROGRESS = "in-progress"
+
+# Seconds after which an in-progress marker expires, so that a crashed
+# request doesn't block its retries
+IN_PROGRESS_TTL = 30
+
+
+class Store(object):
+    """Interface of the storage used to remember served requests. A shared
+    store (e.g. Redis or Memcached) lets all Cloud Function instances
+    recognize retries; values are JSON serializable.
+
+    Subclasses must implement all methods.
+    """
+
+    def get(self, key):
+        """Return the value stored for the key, or ``None`` if missing or
+        expired.
+        """
+        raise NotImplementedError
+
+    def add(self, key, value, ttl):
+        """Store the value only if the key is missing or expired.
+
+        Returns:
+            A boolean where ``True`` means the value has been stored
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Store the value for ``ttl`` seconds."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove the key, if present."""
+        raise NotImplementedError
+
+
+class MemoryStore(Store):
+    """In-process LRU store with expiration. Memory is bounded by the
+    maximum number of entries: the least recently used entry is evicted
+    first.
+    """
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        """Initialize the store.
+
+        Args:
+            max_entries: maximum number of stored keys
+            clock: function that returns the current time in seconds
+        """
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def add(self, key, value, ttl):
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key, value, ttl):
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+def request_key(data, namespace=None):
+    """Return the idempotency key of a DialogFlow request. DialogFlow sends
+    the same ``responseId`` when a webhook call is retried; requests without
+    it are identified by the hash of their content.
+
+    Args:
+        data: the parsed DialogFlow request
+        namespace: optional prefix, such as the tenant name, so that
+            requests of different callers never share a key
+
+    Returns:
+        A string that identifies the request
+    """
+    if isinstance(data, dict) and data.get("responseId"):
+        key = "dialogflow:{}:{}".format(data.get("session", ""), data["responseId"])
+    else:
+        content = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        key = "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+    return key if namespace is None else "{}:{}".format(namespace, key)
+
+
+class Idempotency(object):
+    """Serve each request only once. Successful responses are stored and
+    returned to retries of the same request, without executing it again;
+    failed requests are forgotten, so that they can be retried.
+    """
+
+    def __init__(self, store, ttl=300):
+        """Initialize the idempotency layer.
+
+        Args:
+            store: a ``Store`` instance
+            ttl: seconds a successful response is remembered
+        """
+        self.store = store
+        self.ttl = ttl
+
+    def run(self, key, handler, language=None):
+        """Execute the handler, unless the request has already been served.
+
+        Args:
+            key: the request idempotency key
+            handler: function that serves the request and returns a
+                ``(response, status)`` pair
+            language: DialogFlow language code of the ``409`` reply
+
+        Returns:
+            A ``(response, status)`` pair: the handler result, the stored
+            result of the first request, or ``409`` if the first request
+            is still being served
+        """
+        cached = self.begin(key, language)
+        if cached is not None:
+            return cached
+
+        try:
+            response, status = handler()
+        except Exception:
+            self.finish(key)
+            raise
+
+        self.finish(key, response, status)
+        return (response, status)
+
+    def begin(self, key, language=None):
+        """Mark the request as in progress, unless it has already been
+        served. Must be followed by ``finish()`` when ``None`` is returned.
+
+        Args:
+            key: the request idempotency key
+            language: DialogFlow language code of the ``409`` reply
+
+        Returns:
+            ``None`` if the request must be served, otherwise the
+            ``(response, status)`` pair of the reply
+        """
+        if self.store.add(key, IN_PROGRESS, IN_PROGRESS_TTL):
+            return None
+
+        cached = self.store.get(key)
+        if cached == IN_PROGRESS:
+            logging.warning("Request '%s' is already in progress", key)
+            return responses.reply(REPLY_IN_PROGRESS, language)
+        if cached is not None:
+            logging.info("Request '%s' already served", key)
+            return tuple(cached)
+
+        # The first request has just been forgotten: serve this one
+        self.store.set(key, IN_PROGRESS, IN_PROGRESS_TTL)
+        return None
+
+    def finish(self, key, response=None, status=None):
+        """Store the response of a successful request; failed requests,
+        or requests without a status, are forgotten.
+        """
+        if status is not None and status < 300:
+            self.store.set(key, [response, status], self.ttl)
+        else:
+            self.store.delete(key)
+
+
+# Idempotency layer, reused across warm Cloud Function invocations
+_store = None
+_idempotency = None
+_idempotency_key = None
+_idempotency_lock = threading.Lock()
+
+
+def set_store(store):
+    """Use the given store instead of the in-process one, e.g. a store
+    shared by all instances. ``None`` restores the in-process store.
+    """
+    global _store, _idempotency
+    with _idempotency_lock:
+        _store = store
+        _idempotency = None
+
+
+def get_idempotency(conf):
+    """Return the idempotency layer for the given configuration.
+
+    Returns:
+        An ``Idempotency`` instance, or ``None`` if it's not enabled
+    """
+    global _idempotency, _idempotency_key
+    if not conf.idempotency_ttl:
+        return None
+
+    key = (conf.idempotency_ttl, conf.idempotency_max_entries)
+    with _idempotency_lock:
+        if _idempotency is None or _idempotency_key != key:
+            store = _store
+            if store is None:
+                store = MemoryStore(conf.idempotency_max_entries)
+            _idempotency = Idempotency(store, conf.idempotency_ttl)
+            _idempotency_key = key
+        return _idempotency
+
+
+def reset_idempotency():
+    """Drop the idempotency layer and the requests it remembers."""
+    global _idempotency, _idempotency_key
+    with _idempotency_lock:
+        _idempotency = None
+        _idempotency_key = None
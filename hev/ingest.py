@@ -0,0 +1,212 @@
+import io
+import csv
+import json
+import codecs
+
+from .constants import KIND_DIASTOLIC, KIND_SYSTOLIC
+from .exceptions import BadRequest
+from .schema import PARAMETERS, Field, compile_schema
+
+# Bytes read from the input stream at a time
+CHUNK_SIZE = 64 * 1024
+
+# Maximum size of a single JSON array item
+MAX_ITEM_SIZE = 1024 * 1024
+
+# Validator for timestamped readings, compiled at import time
+_extract = compile_schema((Field("timestamp", 0),) + PARAMETERS, lambda *v: v)
+
+
+def iter_chunks(stream, chunk_size=CHUNK_SIZE):
+    """Read the given binary stream as decoded UTF-8 text chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+
+def iter_ndjson(stream, chunk_size=CHUNK_SIZE):
+    """Parse a newline delimited JSON stream, one line at a time.
+
+    Yields:
+        ``(row, data, error)`` tuples, where ``row`` starts from 1 and
+        ``error`` is set if the line is not valid JSON or it's larger than
+        ``MAX_ITEM_SIZE``. Empty lines are skipped but still counted.
+    """
+    row = 0
+    pending = ""
+    oversized = False
+    for chunk in iter_chunks(stream, chunk_size):
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            row += 1
+            if oversized:
+                # The end of a line that has already been reported
+                oversized = False
+            elif len(line) > MAX_ITEM_SIZE:
+                yield (row, None, "Line too large")
+            elif line.strip():
+                yield _loads(row, line)
+
+        # Lines are not buffered past the limit: the rest is skipped
+        if oversized:
+            pending = ""
+        elif len(pending) > MAX_ITEM_SIZE:
+            yield (row + 1, None, "Line too large")
+            oversized = True
+            pending = ""
+    if pending.strip():
+        yield _loads(row + 1, pending)
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Parse a JSON array stream, one item at a time, without loading the
+    whole document in memory.
+
+    Yields:
+        ``(row, data, error)`` tuples, where ``row`` starts from 1. The
+        stream can't be parsed after a malformed item, so the last tuple
+        contains the error and the iteration stops.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter_chunks(stream, chunk_size)
+    buffer = ""
+    pos = 0
+    eof = False
+    started = False
+    row = 0
+
+    while True:
+        # Skip whitespaces and separators, reading more data when needed
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                if started:
+                    yield (row + 1, None, "Unterminated JSON array")
+                return
+            chunk = next(chunks, "")
+            eof = not chunk
+            buffer, pos = chunk, 0
+            continue
+
+        if not started:
+            if buffer[pos] != "[":
+                yield (1, None, "Expected a JSON array")
+                return
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == "]":
+            return
+
+        try:
+            data, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            data, end = None, None
+
+        # Values that end with the buffer may be truncated (e.g. numbers)
+        truncated = end is None or end == len(buffer)
+        if truncated and not eof and len(buffer) - pos <= MAX_ITEM_SIZE:
+            chunk = next(chunks, "")
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        row += 1
+        if end is None:
+            yield (row, None, "Malformed JSON")
+            return
+        yield (row, data, None)
+        pos = end
+
+
+def iter_csv(stream):
+    """Parse a CSV stream with a header row, one row at a time. Numeric
+    values are converted to numbers and empty values to ``None``.
+
+    Yields:
+        ``(row, data, error)`` tuples, where ``row`` starts from 1 for the
+        first row after the header
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    for row, record in enumerate(csv.DictReader(text), 1):
+        data = {key: _as_number(value) for key, value in record.items() if key}
+        yield (row, data, None)
+
+
+def validate_reading(data):
+    """Validate a timestamped reading, using the same rules applied to
+    DialogFlow parameters.
+
+    Args:
+        data: a dictionary with ``timestamp`` and HEV parameters
+
+    Returns:
+        A ``(timestamp, bpm, min, max)`` tuple
+
+    Raises:
+        BadRequest: if the reading is malformed
+    """
+    if not isinstance(data, dict):
+        raise BadRequest("Reading must be a JSON object")
+    return _extract(data)
+
+
+def batched(iterable, size):
+    """Group items of the given iterable in lists of ``size`` items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_series(readings):
+    """Build multi-point series for a batch of readings.
+
+    Args:
+        readings: a list of ``(timestamp, bpm, min, max)`` tuples
+
+    Returns:
+        A list of series, with one point per reading
+    """
+    return [
+        {"metric": "hev.parameters.bpm", "points": [(r[0], r[1]) for r in readings]},
+        {
+            "metric": "hev.parameters.pressure",
+            "points": [(r[0], r[2]) for r in readings],
+            "tags": [KIND_DIASTOLIC],
+        },
+        {
+            "metric": "hev.parameters.pressure",
+            "points": [(r[0], r[3]) for r in readings],
+            "tags": [KIND_SYSTOLIC],
+        },
+    ]
+
+
+def _loads(row, line):
+    try:
+        return (row, json.loads(line), None)
+    except ValueError:
+        return (row, None, "Malformed JSON")
+
+
+def _as_number(value):
+    if value is None or not value.strip():
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
@@ -0,0 +1,111 @@
+import json
+
+from .exceptions import BadRequest, RequestTooLarge
+
+try:
+    # Optional faster JSON parser, installed with the ``json`` extra
+    import orjson
+except ImportError:
+    orjson = None
+
+# Default maximum request body, in bytes
+MAX_BODY_SIZE = 256 * 1024
+
+# Bytes read from the request stream at once
+CHUNK_SIZE = 64 * 1024
+
+# Name of the JSON parser in use
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data):
+    """Parse a JSON document with the fastest available parser.
+
+    Args:
+        data: UTF-8 encoded bytes or a string
+
+    Returns:
+        The parsed document
+
+    Raises:
+        ValueError: the document is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def is_json(mimetype):
+    """Return ``True`` if the mimetype is the one of a JSON body."""
+    return mimetype == "application/json" or (
+        mimetype.startswith("application/") and mimetype.endswith("+json")
+    )
+
+
+def read_body(request, max_size=MAX_BODY_SIZE):
+    """Read the request body, rejecting large bodies as early as possible:
+    a ``Content-Length`` over the limit is rejected before reading, while
+    bodies without it are read in chunks until the limit is exceeded.
+
+    Args:
+        request: a Flask Request, or an object with ``headers`` and the
+            whole body in ``data`` such as ``hev.asgi.Request``
+        max_size: maximum body size in bytes
+
+    Returns:
+        The body bytes
+
+    Raises:
+        RequestTooLarge: the body exceeds ``max_size``
+        BadRequest: the ``Content-Length`` header is not valid
+    """
+    length = request.headers.get("Content-Length")
+    if length is not None:
+        try:
+            length = int(length)
+        except ValueError:
+            raise BadRequest("Invalid Content-Length")
+        if length > max_size:
+            raise RequestTooLarge(length, max_size)
+
+    stream = getattr(request, "stream", None)
+    if stream is None:
+        data = request.data
+    else:
+        chunks, size = [], 0
+        while size <= max_size:
+            chunk = stream.read(min(CHUNK_SIZE, max_size + 1 - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        data = b"".join(chunks)
+
+    if len(data) > max_size:
+        raise RequestTooLarge(None, max_size)
+    return data
+
+
+def parse_request(request, max_size=MAX_BODY_SIZE):
+    """Parse the JSON body of a request within the size limit. Like
+    ``request.get_json(silent=True)``, bodies that are not JSON are
+    ignored. Objects without a raw body (e.g. already parsed requests)
+    are parsed with their own ``get_json()``.
+
+    Returns:
+        The parsed JSON, or ``None`` if the body is not valid JSON
+
+    Raises:
+        RequestTooLarge: the body exceeds ``max_size``
+    """
+    if not hasattr(request, "headers"):
+        return request.get_json(silent=True)
+
+    if not is_json(request.mimetype):
+        return None
+
+    data = read_body(request, max_size)
+    try:
+        return loads(data)
+    except ValueError:
+        return None
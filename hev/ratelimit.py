@@ -0,0 +1,340 @@
+import time
+import logging
+import threading
+
+from .exporters import Exporter
+from .tracing import span
+
+# Datadog rate limit response headers
+HEADER_LIMIT = "X-RateLimit-Limit"
+HEADER_PERIOD = "X-RateLimit-Period"
+HEADER_REMAINING = "X-RateLimit-Remaining"
+HEADER_RESET = "X-RateLimit-Reset"
+
+# Seconds to pause submissions after a 429 without rate limit headers
+DEFAULT_PAUSE = 1.0
+
+# Shortest wait for a token, so that rounding errors never stall the wait
+MIN_DELAY = 0.001
+
+# Maximum number of series merged in a single submission
+MAX_BATCH_SERIES = 5000
+
+
+class RateLimiter(object):
+    """Token bucket shared by all threads that submit to the same API. The
+    refill rate starts from the configured one and adapts to the rate limit
+    headers of the API responses; a ``429`` reply pauses submissions until
+    the quota is reset.
+    """
+
+    def __init__(self, rate=None, burst=10, clock=time.monotonic, sleep=time.sleep):
+        """Initialize the limiter with a full bucket.
+
+        Args:
+            rate: submissions per second; ``None`` means no limit until
+                the API reports one
+            burst: maximum number of submissions sent without waiting
+            clock: function that returns the current time in seconds
+            sleep: function used to wait for tokens
+        """
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._throttled = 0
+        self._waits = 0
+        self._waited = 0.0
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting for it up to ``timeout`` seconds.
+
+        Returns:
+            A boolean where ``True`` means the submission can be sent
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        waited = 0.0
+        while True:
+            delay = self.try_acquire(waited)
+            if delay <= 0:
+                return True
+            if deadline is not None and self._clock() + delay > deadline:
+                return False
+            self._sleep(delay)
+            waited += delay
+
+    def try_acquire(self, waited=0.0):
+        """Take a token if one is available, without waiting. Callers that
+        can't block, such as coroutines, wait and try again.
+
+        Args:
+            waited: seconds the caller already waited for this token
+
+        Returns:
+            ``0`` if the token has been taken, otherwise the seconds to
+            wait before trying again
+        """
+        with self._lock:
+            delay = self._delay()
+            if delay > 0:
+                return delay
+            self._tokens -= 1
+            if waited:
+                self._waits += 1
+                self._waited += waited
+            return 0.0
+
+    def observe(self, status, headers):
+        """Adapt to an API response.
+
+        Args:
+            status: HTTP status code
+            headers: response headers, with case insensitive lookup
+        """
+        limit = _number(headers.get(HEADER_LIMIT))
+        period = _number(headers.get(HEADER_PERIOD))
+        remaining = _number(headers.get(HEADER_REMAINING))
+        reset = _number(headers.get(HEADER_RESET))
+
+        with self._lock:
+            self._refill()
+            if limit and period:
+                rate = limit / period
+                if self.rate != rate:
+                    logging.info(
+                        "Datadog rate limit: %d requests every %ds", limit, period
+                    )
+                self.rate = rate
+                self.burst = min(self.burst, limit)
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+
+            if status == 429 or remaining == 0:
+                pause = reset if reset is not None else DEFAULT_PAUSE
+                self._paused_until = max(self._paused_until, self._clock() + pause)
+                self._tokens = min(self._tokens, 0)
+                if status == 429:
+                    self._throttled += 1
+                    logging.warning(
+                        "Datadog rate limit exceeded, pausing for %.1fs", pause
+                    )
+
+    def stats(self):
+        """Return the limiter state, meant to be used for monitoring."""
+        with self._lock:
+            self._refill()
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": self._tokens,
+                "paused_for": max(self._paused_until - self._clock(), 0.0),
+                "throttled": self._throttled,
+                "waits": self._waits,
+                "waited": self._waited,
+            }
+
+    def _refill(self):
+        now = self._clock()
+        if self._paused_until:
+            if now < self._paused_until:
+                self._updated = now
+                return
+            # The API quota has been reset
+            self._paused_until = 0.0
+            self._tokens = float(self.burst)
+        if self.rate is None:
+            self._tokens = float(self.burst)
+        else:
+            elapsed = now - self._updated
+            self._tokens = min(self._tokens + elapsed * self.rate, float(self.burst))
+        self._updated = now
+
+    def _delay(self):
+        """Return the seconds to wait for a token; must hold the lock."""
+        self._refill()
+        now = self._clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            return 0.0
+        return max((1 - self._tokens) / self.rate, MIN_DELAY)
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Submission(object):
+    __slots__ = ("series", "results", "lead", "done")
+
+    def __init__(self, series):
+        self.series = series
+        self.results = None
+        self.lead = False
+        self.done = threading.Event()
+
+
+class RateLimitedExporter(Exporter):
+    """Exporter that submits through a ``RateLimiter``. Series of concurrent
+    requests that wait for the limiter are merged, so that a throttled
+    exporter sends fewer and larger submissions instead of failing them.
+
+    Waiting requests are served in order: the first one submits its series
+    and the ones queued behind it as a single batch, then hands over to the
+    next waiting request.
+    """
+
+    def __init__(self, exporter, limiter, timeout=10.0):
+        """Initialize the exporter.
+
+        Args:
+            exporter: the wrapped exporter
+            limiter: a ``RateLimiter`` instance
+            timeout: seconds a request waits to be submitted before its
+                series are marked as failed
+        """
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.limiter = limiter
+        self._wait = timeout
+        self._lock = threading.Lock()
+        self._queue = []
+        self._busy = False
+        self._batches = 0
+        self._merged = 0
+
+    def send_many(self, series):
+        submission = _Submission(series)
+        with self._lock:
+            self._queue.append(submission)
+            if not self._busy:
+                self._busy = submission.lead = True
+
+        if not submission.lead:
+            submission.done.wait(self._wait)
+            with self._lock:
+                # Still queued: give up; otherwise it's being submitted
+                expired = not submission.lead and submission in self._queue
+                if expired:
+                    self._queue.remove(submission)
+            if expired:
+                logging.error("Exporter '%s' timed out waiting for quota", self.name)
+                return [False] * len(series)
+            if not submission.lead:
+                submission.done.wait()
+
+        while submission.results is None:
+            self._submit_batch()
+        return submission.results
+
+    def stats(self):
+        """Return the rate limiter state, including the wrapped exporter one."""
+        with self._lock:
+            stats = {
+                "queued": len(self._queue),
+                "batches": self._batches,
+                "merged": self._merged,
+            }
+        stats.update(self.limiter.stats())
+        if hasattr(self.exporter, "stats"):
+            stats.update(self.exporter.stats())
+        return stats
+
+    def close(self):
+        if hasattr(self.exporter, "close"):
+            self.exporter.close()
+
+    def _submit_batch(self):
+        # A failure must still hand over, or the queue would stall for good
+        batch, results = None, None
+        try:
+            # Requests that arrive while the leader waits are part of its batch
+            with span("datadog.throttle"):
+                allowed = self.limiter.acquire(self._wait)
+            batch = self._pop_batch()
+            results = self._send_batch(batch, allowed)
+        except Exception:
+            logging.exception("Exporter '%s' failed", self.name)
+        finally:
+            if batch is None:
+                batch = self._pop_batch()
+            self._complete(batch, results)
+
+    def _pop_batch(self):
+        with self._lock:
+            batch, size = [], 0
+            while self._queue and (not batch or size < MAX_BATCH_SERIES):
+                submission = self._queue.pop(0)
+                batch.append(submission)
+                size += len(submission.series)
+        return batch
+
+    def _send_batch(self, batch, allowed):
+        if not allowed:
+            logging.error("Exporter '%s' timed out waiting for quota", self.name)
+            return None
+        merged, groups = merge_series([s for b in batch for s in b.series])
+        try:
+            sent = self.exporter.send_many(merged)
+        except Exception:
+            logging.exception("Exporter '%s' failed", self.name)
+            return None
+        return [sent[group] for group in groups]
+
+    def _complete(self, batch, results):
+        offset = 0
+        for submission in batch:
+            count = len(submission.series)
+            if results is None:
+                submission.results = [False] * count
+            else:
+                submission.results = results[offset:][:count]
+            offset += count
+
+        with self._lock:
+            self._batches += 1
+            self._merged += max(len(batch) - 1, 0)
+            if self._queue:
+                self._queue[0].lead = True
+                self._queue[0].done.set()
+            else:
+                self._busy = False
+        for submission in batch:
+            submission.done.set()
+
+
+def merge_series(series):
+    """Merge series with the same metric, tags and host in a single series
+    with all their points. Only series with timestamped points are merged.
+
+    Returns:
+        A ``(merged, groups)`` pair, where ``groups`` has the index of the
+        merged series of each given series
+    """
+    merged = []
+    groups = []
+    index = {}
+    for s in series:
+        points = s.get("points")
+        key = None
+        if isinstance(points, list) and points and isinstance(points[0], (list, tuple)):
+            key = (s["metric"], tuple(s.get("tags") or ()), s.get("host"))
+
+        position = index.get(key) if key is not None else None
+        if position is None:
+            position = len(merged)
+            merged.append(dict(s, points=list(points)) if key is not None else s)
+            if key is not None:
+                index[key] = position
+        else:
+            merged[position]["points"].extend(points)
+        groups.append(position)
+    return merged, groups
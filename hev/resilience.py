@@ -0,0 +1,210 @@
+import time
+import random
+import logging
+import threading
+
+from .exporters import Exporter
+
+
+class RetryPolicy(object):
+    """Retry policy with exponential backoff and full jitter, bounded by an
+    overall deadline.
+    """
+
+    def __init__(self, retries=2, backoff=0.1, max_backoff=2.0, deadline=None):
+        """Initialize the retry policy.
+
+        Args:
+            retries: how many times a failed call is retried
+            backoff: base delay in seconds, doubled after each attempt
+            max_backoff: upper bound for a single delay
+            deadline: seconds after which no more attempts are made; ``None``
+                means attempts are bounded only by ``retries``
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+
+    def delay(self, attempt):
+        """Return how long to wait after the given (zero-based) attempt."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def attempts(self, breaker, name, count):
+        """Return the state of the attempts to send ``count`` series."""
+        return Attempts(self, breaker, name, count)
+
+
+class Attempts(object):
+    """Attempts to send series with a ``RetryPolicy`` and a
+    ``CircuitBreaker``. Only failed series are sent again. The state is
+    shared by the synchronous and the asyncio resilient exporters, that
+    only differ in how they send series and wait between attempts.
+    """
+
+    def __init__(self, retry, breaker, name, count):
+        self.retry = retry
+        self.breaker = breaker
+        self.name = name
+        self.results = [False] * count
+        self.pending = list(range(count))
+        self._attempt = 0
+        self._deadline = None
+        if retry.deadline is not None:
+            self._deadline = time.monotonic() + retry.deadline
+
+    def allow(self):
+        """Return if the pending series can be sent."""
+        if self.breaker.allow():
+            return True
+        logging.error("Exporter '%s' skipped: circuit is open", self.name)
+        return False
+
+    def pending_series(self, series):
+        """Return the given series that are still to be sent."""
+        return [series[i] for i in self.pending]
+
+    def record(self, sent):
+        """Record the results of an attempt.
+
+        Args:
+            sent: a boolean for each pending series
+
+        Returns:
+            Seconds to wait before the next attempt, or ``None`` when no
+            more attempts are made
+        """
+        for i, ok in zip(self.pending, sent):
+            self.results[i] = ok
+        self.pending = [i for i, ok in zip(self.pending, sent) if not ok]
+        if not self.pending:
+            self.breaker.record_success()
+            return None
+
+        self.breaker.record_failure()
+        delay = self.retry.delay(self._attempt)
+        if self._attempt == self.retry.retries or (
+            self._deadline is not None and time.monotonic() + delay >= self._deadline
+        ):
+            return None
+        self._attempt += 1
+        return delay
+
+
+class CircuitBreaker(object):
+    """Circuit breaker that fails fast when a backend keeps failing.
+
+    After ``threshold`` consecutive failures the circuit is opened and calls
+    are rejected. Once ``reset_timeout`` seconds are elapsed, the circuit is
+    half-opened and a single call is allowed to probe the backend: a success
+    closes the circuit, while a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._rejected = 0
+        self._trips = 0
+
+    @property
+    def state(self):
+        """Current circuit state."""
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        """Return if a call can be made to the backend."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.warning("Circuit breaker for '%s' is closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if self._state == self.CLOSED:
+                    self._trips += 1
+                    logging.warning("Circuit breaker for '%s' is open", self.name)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probing = False
+
+    def stats(self):
+        """Return the circuit breaker state, meant to be used for monitoring."""
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "trips": self._trips,
+            }
+
+    def _current_state(self):
+        if (
+            self._state == self.OPEN
+            and self._clock() - self._opened_at >= self.reset_timeout
+        ):
+            return self.HALF_OPEN
+        return self._state
+
+
+class ResilientExporter(Exporter):
+    """Exporter that wraps another exporter with retries and a circuit
+    breaker. Only failed series are retried.
+    """
+
+    def __init__(self, exporter, retry=None, breaker=None):
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(exporter.name)
+
+    def send_many(self, series):
+        attempts = self.retry.attempts(self.breaker, self.name, len(series))
+        while attempts.allow():
+            try:
+                sent = self.exporter.send_many(attempts.pending_series(series))
+            except Exception:
+                logging.exception("Exporter '%s' failed", self.name)
+                sent = [False] * len(attempts.pending)
+
+            delay = attempts.record(sent)
+            if delay is None:
+                break
+            time.sleep(delay)
+        return attempts.results
+
+    def stats(self):
+        """Return the exporter resilience state, including the wrapped
+        exporter one.
+        """
+        stats = self.breaker.stats()
+        if hasattr(self.exporter, "stats"):
+            stats.update(self.exporter.stats())
+        return stats
@@ -0,0 +1,209 @@
+import json
+
+# Webhook replies
+SUCCESS = "success"
+ACCEPTED = "accepted"
+FAILED = "failed"
+BAD_REQUEST = "bad-request"
+NOT_AUTHORIZED = "not-authorized"
+CONFIGURATION_ERROR = "configuration-error"
+TOO_LARGE = "too-large"
+METHOD_NOT_ALLOWED = "method-not-allowed"
+IN_PROGRESS = "in-progress"
+
+# Message, HTTP status and fulfillment text of each reply
+REPLIES = {
+    SUCCESS: ("Success", 201, "recorded"),
+    ACCEPTED: ("Accepted", 202, "queued"),
+    FAILED: ("Failed", 503, "failed"),
+    BAD_REQUEST: ("Bad Request", 400, "not-understood"),
+    NOT_AUTHORIZED: ("Not Authorized", 401, "not-authorized"),
+    CONFIGURATION_ERROR: ("Configuration error", 500, "unavailable"),
+    TOO_LARGE: ("Request Too Large", 413, "not-understood"),
+    METHOD_NOT_ALLOWED: ("Method Not Allowed", 405, "not-understood"),
+    IN_PROGRESS: ("Request in progress", 409, "in-progress"),
+}
+
+# Fulfillment texts spoken by the DialogFlow agent, by language code
+TEXTS = {
+    "en": {
+        "recorded": "Thanks, your parameters have been recorded.",
+        "queued": "Thanks, your parameters will be recorded shortly.",
+        "failed": "Sorry, I couldn't record your parameters. Please try again later.",
+        "not-understood": "Sorry, I didn't understand your parameters. "
+        "Could you repeat them?",
+        "not-authorized": "Sorry, you're not authorized to record parameters.",
+        "unavailable": "Sorry, the service is not available right now.",
+        "in-progress": "I'm still recording your parameters, just a moment.",
+    },
+    "it": {
+        "recorded": "Grazie, i tuoi parametri sono stati registrati.",
+        "queued": "Grazie, i tuoi parametri saranno registrati a breve.",
+        "failed": "Spiacente, non sono riuscito a registrare i tuoi parametri. "
+        "Riprova più tardi.",
+        "not-understood": "Spiacente, non ho capito i tuoi parametri. "
+        "Puoi ripeterli?",
+        "not-authorized": "Spiacente, non sei autorizzato a registrare parametri.",
+        "unavailable": "Spiacente, il servizio non è disponibile al momento.",
+        "in-progress": "Sto ancora registrando i tuoi parametri, un momento.",
+    },
+    "es": {
+        "recorded": "Gracias, tus parámetros han sido registrados.",
+        "queued": "Gracias, tus parámetros se registrarán en breve.",
+        "failed": "Lo siento, no he podido registrar tus parámetros. "
+        "Inténtalo de nuevo más tarde.",
+        "not-understood": "Lo siento, no he entendido tus parámetros. "
+        "¿Puedes repetirlos?",
+        "not-authorized": "Lo siento, no tienes autorización para registrar "
+        "parámetros.",
+        "unavailable": "Lo siento, el servicio no está disponible en este momento.",
+        "in-progress": "Todavía estoy registrando tus parámetros, un momento.",
+    },
+    "fr": {
+        "recorded": "Merci, vos paramètres ont été enregistrés.",
+        "queued": "Merci, vos paramètres seront enregistrés sous peu.",
+        "failed": "Désolé, je n'ai pas pu enregistrer vos paramètres. "
+        "Veuillez réessayer plus tard.",
+        "not-understood": "Désolé, je n'ai pas compris vos paramètres. "
+        "Pouvez-vous les répéter ?",
+        "not-authorized": "Désolé, vous n'êtes pas autorisé à enregistrer des "
+        "paramètres.",
+        "unavailable": "Désolé, le service n'est pas disponible pour le moment.",
+        "in-progress": "J'enregistre encore vos paramètres, un instant.",
+    },
+    "de": {
+        "recorded": "Danke, deine Werte wurden gespeichert.",
+        "queued": "Danke, deine Werte werden in Kürze gespeichert.",
+        "failed": "Entschuldigung, deine Werte konnten nicht gespeichert werden. "
+        "Bitte versuche es später erneut.",
+        "not-understood": "Entschuldigung, ich habe deine Werte nicht verstanden. "
+        "Kannst du sie wiederholen?",
+        "not-authorized": "Entschuldigung, du bist nicht berechtigt, Werte zu "
+        "speichern.",
+        "unavailable": "Entschuldigung, der Dienst ist gerade nicht verfügbar.",
+        "in-progress": "Ich speichere deine Werte noch, einen Moment bitte.",
+    },
+}
+
+# Language of the replies when the request has no supported language
+DEFAULT_LANGUAGE = "en"
+
+# Maximum number of remembered language codes
+MAX_LANGUAGES = 256
+
+# Placeholder of the dynamic field of a template
+_SLOT = "\0"
+
+
+class Template(object):
+    """Reply with a dynamic field. The JSON document is serialized once
+    around the field, so that rendering only encodes the field value.
+    """
+
+    __slots__ = ("status", "_prefix", "_suffix")
+
+    def __init__(self, document, field, status):
+        """Compile the template.
+
+        Args:
+            document: the reply JSON document
+            field: name of the field that is set when the reply is rendered
+            status: HTTP status of the reply
+        """
+        encoded = json.dumps(dict(document, **{field: _SLOT}))
+        self._prefix, self._suffix = encoded.split(json.dumps(_SLOT))
+        self.status = status
+
+    def render(self, value):
+        """Return the ``(response, status)`` pair with the given value."""
+        return (self._prefix + json.dumps(value) + self._suffix, self.status)
+
+
+class Responses(object):
+    """Webhook replies, serialized for each language when the catalog is
+    created. Replies are DialogFlow fulfillment responses: the
+    ``fulfillmentText`` is spoken by the agent in the language of the
+    request, while ``message`` is meant for other clients.
+    """
+
+    def __init__(self, texts=TEXTS, default=DEFAULT_LANGUAGE):
+        """Serialize all replies.
+
+        Args:
+            texts: dictionary that maps language codes to fulfillment texts
+            default: language used for requests in other languages
+        """
+        self.default = default
+        self._replies = {}
+        self._failed = {}
+        self._bad_request = {}
+        self._languages = {}
+
+        for language, text in texts.items():
+            replies = {}
+            for name, (message, status, key) in REPLIES.items():
+                document = {"message": message, "fulfillmentText": text[key]}
+                replies[name] = (json.dumps(document), status)
+            self._replies[language] = replies
+
+            message, status, key = REPLIES[FAILED]
+            document = {"message": message, "exporters": None}
+            document["fulfillmentText"] = text[key]
+            self._failed[language] = Template(document, "exporters", status)
+
+            _, status, key = REPLIES[BAD_REQUEST]
+            document = {"message": None, "fulfillmentText": text[key]}
+            self._bad_request[language] = Template(document, "message", status)
+
+    def reply(self, name, language=None):
+        """Return the reply with the given name.
+
+        Args:
+            name: one of the ``REPLIES`` names, such as ``SUCCESS``
+            language: DialogFlow language code, such as ``en-US``
+
+        Returns:
+            A ``(response, status)`` pair
+        """
+        return self._replies[self.language(language)][name]
+
+    def failed(self, exporters, language=None):
+        """Return the reply of a request whose exporters failed.
+
+        Args:
+            exporters: names of the failed exporters
+            language: DialogFlow language code
+        """
+        return self._failed[self.language(language)].render(exporters)
+
+    def bad_request(self, error, language=None):
+        """Return the reply of a request with invalid data.
+
+        Args:
+            error: description of the invalid data
+            language: DialogFlow language code
+        """
+        return self._bad_request[self.language(language)].render(error)
+
+    def language(self, code):
+        """Return the catalog language for a DialogFlow language code: the
+        code itself, its primary language (``en`` for ``en-US``) or the
+        default language.
+        """
+        if not isinstance(code, str):
+            return self.default
+
+        language = self._languages.get(code)
+        if language is None:
+            language = code.lower()
+            if language not in self._replies:
+                language = language.split("-")[0]
+            if language not in self._replies:
+                language = self.default
+            if len(self._languages) < MAX_LANGUAGES:
+                self._languages[code] = language
+        return language
+
+
+# Replies catalog, built once when the Cloud Function is loaded
+responses = Responses()
@@ -0,0 +1,138 @@
+from .exceptions import BadRequest
+
+# Types accepted for numeric fields (``bool`` is excluded on purpose)
+NUMBER_TYPES = (int, float)
+
+
+class Field(object):
+    """Declarative definition of a numeric parameter."""
+
+    __slots__ = ("name", "minimum", "maximum", "unit")
+
+    def __init__(self, name, minimum=None, maximum=None, unit=None):
+        """Initialize the field.
+
+        Args:
+            name: parameter name
+            minimum: minimum accepted value, if any
+            maximum: maximum accepted value, if any
+            unit: unit of measure, used in error messages
+        """
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+
+
+class Reading(object):
+    """HEV parameters extracted from a validated request."""
+
+    __slots__ = ("bpm", "min", "max")
+
+    def __init__(self, bpm, value_min, value_max):
+        self.bpm = bpm
+        self.min = value_min
+        self.max = value_max
+
+    def __repr__(self):
+        return "Reading(bpm={}, min={}, max={})".format(self.bpm, self.min, self.max)
+
+
+# HEV parameters, with physiologically plausible ranges
+PARAMETERS = (
+    Field("bpm", 20, 300, "bpm"),
+    Field("min", 20, 200, "mmHg"),
+    Field("max", 40, 300, "mmHg"),
+)
+
+
+def compile_schema(fields, factory):
+    """Compile the given fields in a single-pass extractor and validator.
+
+    The schema is translated once in the source code of a function that
+    checks all fields without loops or lookups in the schema. When the
+    payload is not valid, a second pass collects all errors so that they
+    are reported together.
+
+    Args:
+        fields: a sequence of ``Field`` instances
+        factory: callable that receives validated values, in the fields
+            order, and returns the extracted object
+
+    Returns:
+        A function that receives a dictionary of parameters and returns
+        the object built by ``factory``. All errors are collected and
+        reported with a single ``BadRequest`` exception.
+    """
+    checks = tuple(
+        (
+            field.name,
+            field.minimum if field.minimum is not None else float("-inf"),
+            field.maximum if field.maximum is not None else float("inf"),
+            "must be between {} and {}{}".format(
+                field.minimum,
+                field.maximum,
+                " " + field.unit if field.unit else "",
+            ),
+        )
+        for field in fields
+    )
+
+    def collect_errors(params):
+        if type(params) is not dict:
+            return _message([name for name, _, _, _ in checks], {})
+
+        missing = []
+        invalid = {}
+        for name, minimum, maximum, error in checks:
+            value = params.get(name)
+            if value is None:
+                missing.append(name)
+            elif type(value) not in NUMBER_TYPES:
+                invalid[name] = "must be a number"
+            elif not minimum <= value <= maximum:
+                invalid[name] = error
+        return _message(missing, invalid)
+
+    # Generate the happy path, e.g. for a single field:
+    #   v0 = params.get("bpm")
+    #   if type(v0) in NUMBER_TYPES and 20 <= v0 <= 300:
+    #       return factory(v0)
+    lines = ["def extract(params):", "    if type(params) is dict:"]
+    conditions = []
+    for i, (name, minimum, maximum, _) in enumerate(checks):
+        lines.append("        v{} = params.get({!r})".format(i, name))
+        conditions.append("type(v{0}) in NUMBER_TYPES".format(i))
+        if minimum != float("-inf"):
+            conditions.append("{!r} <= v{}".format(minimum, i))
+        if maximum != float("inf"):
+            conditions.append("v{} <= {!r}".format(i, maximum))
+    lines.append("        if {}:".format(" and ".join(conditions) or "True"))
+    lines.append(
+        "            return factory({})".format(
+            ", ".join("v{}".format(i) for i in range(len(checks)))
+        )
+    )
+    lines.append("    raise BadRequest(collect_errors(params))")
+
+    namespace = {
+        "NUMBER_TYPES": NUMBER_TYPES,
+        "BadRequest": BadRequest,
+        "collect_errors": collect_errors,
+        "factory": factory,
+    }
+    exec("\n".join(lines), namespace)
+    return namespace["extract"]
+
+
+def _message(missing, invalid):
+    errors = []
+    if missing:
+        errors.append("Missing mandatory fields: {}".format(missing))
+    if invalid:
+        errors.append("Invalid fields: {}".format(invalid))
+    return "; ".join(errors)
+
+
+# Validator for DialogFlow parameters, compiled at import time
+extract_reading = compile_schema(PARAMETERS, Reading)
@@ -0,0 +1,452 @@
+import os
+import sys
+import json
+import time
+import select
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import threading
+import socketserver
+
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import hev
+
+from .api import reset_clients, reset_session
+from .config import load_config
+from .exceptions import ConfigException
+from .exporters import reset_dispatcher
+from .store import reset_store
+from . import worker
+
+# Probe endpoints served by each worker
+LIVENESS_PATH = "/healthz"
+READINESS_PATH = "/readyz"
+
+# Pending connections kept by the listening socket
+BACKLOG = 2048
+
+
+class HealthMiddleware(object):
+    """WSGI middleware that answers liveness and readiness probes, so that
+    they never reach the application. A worker is alive while it answers;
+    it's ready until it starts draining.
+    """
+
+    def __init__(self, app, ready=None):
+        """Initialize the middleware.
+
+        Args:
+            app: the WSGI application
+            ready: function that returns if the process accepts requests
+        """
+        self.app = app
+        self._ready = ready or (lambda: True)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO")
+        if path == LIVENESS_PATH:
+            return self._reply(start_response, "200 OK", {"status": "alive"})
+        if path == READINESS_PATH:
+            if self._ready():
+                return self._reply(start_response, "200 OK", {"status": "ready"})
+            return self._reply(
+                start_response, "503 Service Unavailable", {"status": "draining"}
+            )
+        return self.app(environ, start_response)
+
+    def _reply(self, start_response, status, payload):
+        body = json.dumps(payload).encode()
+        start_response(
+            status,
+            [("Content-Type", "application/json"), ("Content-Length", str(len(body)))],
+        )
+        return [body]
+
+
+class _WSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    # Request threads are joined on close, so that draining workers
+    # complete in-flight requests
+    daemon_threads = False
+    block_on_close = True
+
+
+class _RequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug("%s %s", self.address_string(), format % args)
+
+
+def reset_after_fork():
+    """Drop clients, exporters and connections inherited from the parent
+    process, so that each worker opens its own Datadog connection pool.
+    """
+    reset_session()
+    reset_clients()
+    reset_dispatcher()
+    reset_store()
+
+
+class Worker(object):
+    """Worker process that serves requests accepted from the listening
+    socket shared with the other workers. On ``SIGTERM`` it stops
+    accepting connections, completes in-flight requests and flushes
+    queued exports before exiting.
+    """
+
+    def __init__(self, sock, app, graceful_timeout=30.0, drain_delay=0.0):
+        """Initialize the worker.
+
+        Args:
+            sock: the listening socket shared with the other workers
+            app: the WSGI application
+            graceful_timeout: seconds to flush queued exports
+            drain_delay: seconds the worker keeps serving requests after it
+                stops being ready, so that load balancers notice it before
+                it stops accepting connections
+        """
+        self.socket = sock
+        self.app = HealthMiddleware(app, ready=lambda: not self.draining)
+        self.graceful_timeout = graceful_timeout
+        self.drain_delay = drain_delay
+        self.draining = False
+        self._parent = os.getppid()
+        self._stopping = threading.Event()
+        self._terminated = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        # Ctrl+C and reloads are handled by the parent process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        reset_after_fork()
+        self.serve()
+
+    def serve(self):
+        """Serve requests until the worker is stopped, then drain it."""
+        server = _WSGIServer(
+            self.socket.getsockname(), _RequestHandler, bind_and_activate=False
+        )
+        server.socket.close()
+        server.socket = self.socket
+        server.server_name = socket.getfqdn(server.server_address[0])
+        server.server_port = server.server_address[1]
+        server.setup_environ()
+        server.set_app(self.app)
+
+        thread = threading.Thread(target=server.serve_forever, args=(0.5,))
+        thread.start()
+        logging.info("Worker %d started", os.getpid())
+
+        # Stop when asked to, or when the parent process is gone
+        while not self._stopping.wait(0.5) and os.getppid() == self._parent:
+            if self._terminated:
+                break
+
+        logging.info("Worker %d draining", os.getpid())
+        self.draining = True
+        # Readiness probes fail while requests are still accepted
+        time.sleep(self.drain_delay)
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        worker.shutdown(self.graceful_timeout)
+        reset_dispatcher()
+        logging.info("Worker %d stopped", os.getpid())
+
+    def stop(self):
+        """Ask the worker to drain and stop."""
+        self._stopping.set()
+
+    def _on_signal(self, signum, frame):
+        # Setting the event here could deadlock with the waiting loop, that
+        # polls the flag instead
+        self._terminated = True
+
+
+class Server(object):
+    """Pre-forking HTTP server. The configuration is loaded and validated
+    once in the parent process, and shared with the workers forked from
+    it; workers that exit unexpectedly are replaced.
+
+    Signals:
+        SIGTERM, SIGINT: drain workers and stop
+        SIGHUP: reload the configuration, start new workers and drain the
+            old ones; an invalid configuration is ignored
+    """
+
+    def __init__(
+        self,
+        app,
+        bind,
+        workers=2,
+        graceful_timeout=30.0,
+        conf=load_config,
+        drain_delay=0.0,
+    ):
+        """Initialize the server.
+
+        Args:
+            app: the WSGI application served by workers
+            bind: a ``(host, port)`` pair
+            workers: number of worker processes
+            graceful_timeout: seconds a draining worker is waited before
+                being killed, including the ``drain_delay``
+            conf: function that loads the configuration
+            drain_delay: seconds a draining worker keeps serving requests
+                while its readiness probe fails
+        """
+        self.app = app
+        self.bind = bind
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.drain_delay = drain_delay
+        self.socket = None
+        self._conf = conf
+        self._children = {}
+        self._retiring = {}
+        self._signals = []
+        self._wakeup = None
+
+    @property
+    def address(self):
+        return self.socket.getsockname()[:2]
+
+    def load_config(self):
+        """Load and validate the configuration shared with workers.
+
+        Raises:
+            ConfigException: the configuration is not valid
+        """
+        conf = self._conf()
+        conf.validate()
+        hev.conf = conf
+
+    def listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self.bind)
+        sock.listen(BACKLOG)
+        self.socket = sock
+
+    def run(self):
+        """Start workers and supervise them until the server is stopped.
+
+        Raises:
+            ConfigException: the configuration is not valid
+        """
+        self.load_config()
+        self.listen()
+        # Signal handlers wake up the loop with a self-pipe: unlike locks,
+        # a write never blocks if the signal interrupts the main thread
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        logging.info("Listening on %s:%d with %d workers", *self.address, self.workers)
+
+        try:
+            while True:
+                self._reap()
+                signals, self._signals = self._signals, []
+                if signal.SIGTERM in signals or signal.SIGINT in signals:
+                    break
+                if signal.SIGHUP in signals:
+                    self.reload()
+                self._spawn_missing()
+                if select.select([self._wakeup[0]], [], [], 1.0)[0]:
+                    self._drain_wakeup()
+        finally:
+            self.stop()
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def reload(self):
+        """Reload the configuration and replace workers."""
+        try:
+            self.load_config()
+        except ConfigException as e:
+            logging.error("Configuration not reloaded: %s", e)
+            return
+
+        logging.info("Configuration reloaded, replacing workers")
+        retiring, self._children = self._children, {}
+        self._spawn_missing()
+        self._retire(retiring)
+
+    def stop(self):
+        """Drain all workers, killing the ones that exceed the graceful
+        timeout.
+        """
+        retiring, self._children = self._children, {}
+        self._retire(retiring)
+        while self._retiring:
+            self._reap()
+            if self._retiring:
+                time.sleep(0.1)
+        if self.socket is not None:
+            self.socket.close()
+        logging.info("Server stopped")
+
+    def _on_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self._signals.append(signum)
+        if self._wakeup is None:
+            return
+        try:
+            os.write(self._wakeup[1], b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the loop wakes up anyway
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _spawn_missing(self):
+        while len(self._children) < self.workers:
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    Worker(
+                        self.socket, self.app, self.graceful_timeout, self.drain_delay
+                    ).run()
+                except BaseException:
+                    logging.exception("Worker %d failed", os.getpid())
+                    code = 1
+                finally:
+                    logging.shutdown()
+                    os._exit(code)
+            self._children[pid] = time.monotonic()
+
+    def _retire(self, children):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in children:
+            self._kill(pid, signal.SIGTERM)
+            self._retiring[pid] = deadline
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                # No children left
+                self._retiring.clear()
+                break
+            if pid == 0:
+                break
+            if self._children.pop(pid, None) is not None:
+                logging.warning("Worker %d exited unexpectedly (%d)", pid, status)
+            self._retiring.pop(pid, None)
+
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now >= deadline:
+                logging.warning("Worker %d killed after the graceful timeout", pid)
+                self._kill(pid, signal.SIGKILL)
+                self._retiring[pid] = float("inf")
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def parse_bind(value):
+    """Parse a ``host:port`` address; the host defaults to all interfaces."""
+    host, _, port = value.rpartition(":")
+    return (host or "0.0.0.0", int(port))
+
+
+def load_app(spec):
+    """Return the WSGI application built by a ``module:factory`` spec, such
+    as ``main:create_app``, importing modules from the current directory.
+    """
+    module_name, _, factory = spec.partition(":")
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    return getattr(module, factory or "create_app")()
+
+
+def parse_args(argv=None):
+    # The configuration is loaded without setting ``hev.conf``, which may
+    # start threads that must not run in the parent process before forking
+    conf = load_config()
+    parser = argparse.ArgumentParser(
+        description="Serve HEV webhooks with pre-forked worker processes"
+    )
+    parser.add_argument(
+        "--app",
+        default="main:create_app",
+        help="factory of the WSGI application (default: main:create_app)",
+    )
+    parser.add_argument(
+        "--bind",
+        type=parse_bind,
+        default=conf.server_bind,
+        help="listening address as host:port (default: SERVER_BIND)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=conf.server_workers,
+        help="number of worker processes (default: SERVER_WORKERS)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=conf.server_graceful_timeout,
+        help="seconds to drain a worker (default: SERVER_GRACEFUL_TIMEOUT)",
+    )
+    parser.add_argument(
+        "--drain-delay",
+        type=float,
+        default=conf.server_drain_delay,
+        help="seconds a draining worker is not ready but still serves requests "
+        "(default: SERVER_DRAIN_DELAY)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Production server entrypoint (``hev-server``).
+
+    Returns:
+        The process exit code
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s"
+    )
+    try:
+        args = parse_args(argv)
+    except ConfigException as e:
+        logging.critical("Unable to configure the server: %s", e)
+        return 2
+    server = Server(
+        load_app(args.app),
+        args.bind,
+        args.workers,
+        args.graceful_timeout,
+        drain_delay=args.drain_delay,
+    )
+    try:
+        server.run()
+    except ConfigException as e:
+        logging.critical("Unable to configure the server: %s", e)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
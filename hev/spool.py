@@ -0,0 +1,238 @@
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+
+from .exporters import Exporter
+
+
+class Spool(object):
+    """Write-ahead spool that stores points that couldn't be exported, so
+    that they can be replayed later. Points are stored in a SQLite database
+    and are deduplicated by metric, tags, host and timestamp.
+
+    When the spool exceeds ``max_points``, the oldest points are evicted.
+    """
+
+    def __init__(self, path, max_points=100000):
+        """Open (or create) the spool.
+
+        Args:
+            path: SQLite database path, such as ``/tmp/hev-spool.db``
+            max_points: maximum number of points kept in the spool
+        """
+        self.path = path
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS points ("
+            "id INTEGER PRIMARY KEY, "
+            "metric TEXT NOT NULL, "
+            "tags TEXT NOT NULL, "
+            "host TEXT NOT NULL DEFAULT '', "
+            "timestamp REAL NOT NULL, "
+            "value REAL NOT NULL, "
+            "UNIQUE (metric, tags, host, timestamp))"
+        )
+        self._conn.commit()
+        self.pending = len(self) > 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+    def append(self, series, now=None):
+        """Store the points of the given series.
+
+        Args:
+            series: a list of series; points without a timestamp are stored
+                with the current time
+            now: timestamp used for points without one
+
+        Returns:
+            The number of evicted points
+        """
+        now = time.time() if now is None else now
+        rows = [
+            (
+                s["metric"],
+                ",".join(s.get("tags") or []),
+                s.get("host") or "",
+                timestamp,
+                value,
+            )
+            for s in series
+            for timestamp, value in _as_points(s.get("points"), now)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO points (metric, tags, host, timestamp, value) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM points WHERE id <= ("
+                "SELECT id FROM points ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_points,),
+            ).rowcount
+            self.pending = True
+
+        if evicted:
+            logging.warning("Spool is full: evicted %d points", evicted)
+        return evicted
+
+    def replay(self, submit, batch_size=5000):
+        """Send spooled points in batches, from the oldest to the newest.
+        Points are removed from the spool only when accepted.
+
+        Args:
+            submit: a callable that receives a list of series and returns
+                ``True`` if they have been accepted
+            batch_size: maximum number of points sent with a single call
+
+        Returns:
+            The number of replayed points
+        """
+        replayed = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, metric, tags, host, timestamp, value FROM points "
+                    "ORDER BY id LIMIT ?",
+                    (batch_size,),
+                ).fetchall()
+            if not rows:
+                self.pending = False
+                break
+
+            groups = {}
+            for _, metric, tags, host, timestamp, value in rows:
+                points = groups.setdefault((metric, tags, host), [])
+                points.append((timestamp, value))
+            series = []
+            for (metric, tags, host), points in groups.items():
+                s = {"metric": metric, "points": points}
+                if tags:
+                    s["tags"] = tags.split(",")
+                if host:
+                    s["host"] = host
+                series.append(s)
+
+            if not submit(series):
+                logging.error("Unable to replay %d spooled points", len(rows))
+                break
+
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM points WHERE id <= ?", (rows[-1][0],))
+            replayed += len(rows)
+
+        return replayed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolingExporter(Exporter):
+    """Exporter that spools the series the wrapped exporter couldn't send,
+    once its last attempt failed or the call has been rejected (open
+    circuit, rate limit timeout). Spooled points are replayed after the
+    next successful submission, so that only points that were never
+    accepted are sent again.
+    """
+
+    def __init__(self, exporter, client):
+        """Initialize the exporter.
+
+        Args:
+            exporter: the wrapped exporter, such as a ``ResilientExporter``
+            client: the ``DatadogAPI`` instance that owns the spool
+        """
+        self.exporter = exporter
+        self.name = exporter.name
+        self.timeout = exporter.timeout
+        self.client = client
+
+    def send_many(self, series):
+        try:
+            results = self.exporter.send_many(series)
+        except Exception:
+            logging.exception("Exporter '%s' failed", self.name)
+            results = [False] * len(series)
+
+        spool = self.client.spool
+        failed = [
+            s
+            for s, ok in zip(series, results)
+            if not ok and s.get("points") is not None
+        ]
+        if failed:
+            spool.append(failed)
+        elif spool.pending and any(results):
+            # Replayed batches go through the wrapped retries and rate limits
+            self.client.replay_in_background(self.exporter.send_many)
+        return results
+
+    def stats(self):
+        if hasattr(self.exporter, "stats"):
+            return self.exporter.stats()
+        return {}
+
+    def close(self):
+        if hasattr(self.exporter, "close"):
+            self.exporter.close()
+
+
+def _as_points(points, now):
+    """Normalize Datadog points in a list of ``(timestamp, value)`` pairs."""
+    if points is None:
+        return []
+    if isinstance(points, (list, tuple)):
+        if points and isinstance(points[0], (list, tuple)):
+            return [(float(ts), float(value)) for ts, value in points]
+        if len(points) == 2:
+            return [(float(points[0]), float(points[1]))]
+        return []
+    return [(now, float(points))]
+
+
+def main(argv=None):
+    """Replay the spool using the environment configuration."""
+    import hev
+
+    from .api import DatadogAPI, watch_rate_limits
+    from .ratelimit import RateLimitedExporter, RateLimiter
+
+    parser = argparse.ArgumentParser(description="Replay spooled HEV metrics")
+    parser.add_argument("--path", default=hev.conf.spool_path)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+    if not args.path:
+        parser.error("SPOOL_PATH is not set and --path is missing")
+
+    hev.conf.validate()
+    api = DatadogAPI(
+        hev.conf.dd_api_key,
+        hev.conf.function_name,
+        hev.conf.dry_run,
+        api_host=hev.conf.dd_api_host,
+        spool_path=args.path,
+    )
+    # Replayed batches share the Datadog quota with running functions
+    limiter = RateLimiter(hev.conf.dd_rate_limit, hev.conf.dd_rate_burst)
+    watch_rate_limits(limiter)
+    exporter = RateLimitedExporter(api, limiter, hev.conf.export_timeout)
+    start = time.monotonic()
+    replayed = api.replay(args.batch_size, exporter.send_many)
+    logging.warning(
+        "Replayed %d points in %.2f seconds", replayed, time.monotonic() - start
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
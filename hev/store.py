@@ -0,0 +1,448 @@
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+
+from .aggregation import _as_points
+from .constants import EXPORTER_STORE, KIND_DIASTOLIC, KIND_SYSTOLIC
+from .exporters import Exporter
+
+# Columns of stored readings; each one is a contiguous array of float64
+COLUMNS = ("timestamp", "bpm", "systolic", "diastolic")
+
+# Values stored in each ring
+FIELDS = COLUMNS[1:]
+
+# Readings kept for each tenant: a year of readings sent every minute
+DEFAULT_CAPACITY = 525600
+
+# Ring of the anonymous tenant of single-token deployments
+DEFAULT_TENANT = "default"
+
+# File header: magic number, format version, capacity and total appended
+# readings, as int64 values
+MAGIC = 0x48455652494E4731
+VERSION = 1
+HEADER_SIZE = 64
+
+_METRICS = {
+    ("hev.parameters.bpm", None): "bpm",
+    ("hev.parameters.pressure", KIND_SYSTOLIC): "systolic",
+    ("hev.parameters.pressure", KIND_DIASTOLIC): "diastolic",
+}
+
+
+def _numpy():
+    # numpy is an optional dependency, required only by the local store
+    import numpy
+
+    return numpy
+
+
+class Ring(object):
+    """Append-only ring of readings, memory-mapped to a file. Columns are
+    stored one after the other, so that a time range is a contiguous slice
+    of each column and it's aggregated with vectorized operations. When the
+    ring is full, the oldest readings are overwritten.
+
+    Readings are kept sorted by time: a reading older than the latest one
+    is merged in place, so range queries are binary searches. The file is
+    locked while it's written, so that it can be shared by processes.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        """Open (or create) the ring. Existing files keep their capacity.
+
+        Args:
+            path: file of the ring
+            capacity: maximum number of readings of a new ring
+        """
+        np = _numpy()
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a+b")
+        with self._locked(fcntl.LOCK_EX):
+            created = os.fstat(self._file.fileno()).st_size == 0
+            if created:
+                # The file is sparse: disk space is used as readings arrive
+                self._file.truncate(HEADER_SIZE + 8 * len(COLUMNS) * capacity)
+            self._header = np.memmap(path, dtype=np.int64, mode="r+", shape=(8,))
+            if created:
+                self._header[:4] = [MAGIC, VERSION, capacity, 0]
+                self._header.flush()
+            elif self._header[0] != MAGIC or self._header[1] != VERSION:
+                self._file.close()
+                raise ValueError("'{}' is not a readings ring".format(path))
+
+        self.capacity = int(self._header[2])
+        self._data = np.memmap(
+            path,
+            dtype=np.float64,
+            mode="r+",
+            offset=HEADER_SIZE,
+            shape=(len(COLUMNS), self.capacity),
+        )
+
+    def __len__(self):
+        return min(int(self._header[3]), self.capacity)
+
+    def append(self, timestamps, bpm, systolic, diastolic):
+        """Store readings; missing values are ``NaN``.
+
+        Args:
+            timestamps: sequence of reading timestamps, in seconds
+            bpm, systolic, diastolic: sequences of values, one for each
+                timestamp
+        """
+        np = _numpy()
+        rows = np.array([timestamps, bpm, systolic, diastolic], dtype=np.float64)
+        if not rows.shape[1]:
+            return
+        rows = rows[:, np.argsort(rows[0], kind="stable")]
+
+        with self._locked(fcntl.LOCK_EX):
+            count = int(self._header[3])
+            size = min(count, self.capacity)
+            base = count - size
+
+            # Readings older than the latest stored one are merged with the
+            # stored readings that follow them
+            start = size
+            if size and rows[0, 0] < self._data[0, (count - 1) % self.capacity]:
+                start = self._search(self._logical(base, size, 0), rows[0, 0], "right")
+                tail = self._data[:, self._positions(base + start, size - start)]
+                rows = np.concatenate([tail, rows], axis=1)
+                rows = rows[:, np.argsort(rows[0], kind="stable")]
+
+            first = base + start
+            excess = rows.shape[1] - self.capacity
+            if excess > 0:
+                first += excess
+                rows = rows[:, excess:]
+            self._data[:, self._positions(first, rows.shape[1])] = rows
+            self._header[3] = first + rows.shape[1]
+
+    def range(self, start=None, end=None):
+        """Return readings with ``start <= timestamp < end``.
+
+        Returns:
+            An array with a row for each column of ``COLUMNS``
+        """
+        np = _numpy()
+        with self._locked(fcntl.LOCK_SH):
+            count = int(self._header[3])
+            size = min(count, self.capacity)
+            parts = []
+            for lo, hi in self._segments(count - size, size):
+                timestamps = self._data[0, lo:hi]
+                first = lo if start is None else lo + self._search(timestamps, start)
+                last = hi if end is None else lo + self._search(timestamps, end)
+                parts.append(self._data[:, first:last])
+            if not parts:
+                return np.empty((len(COLUMNS), 0))
+            return np.concatenate(parts, axis=1)
+
+    def downsample(self, start, end, interval):
+        """Aggregate readings in windows of ``interval`` seconds, aligned to
+        the epoch.
+
+        Returns:
+            A dictionary of arrays, one item for each window: ``timestamp``
+            (window start), ``count`` and ``<field>_min``, ``<field>_avg``
+            and ``<field>_max`` for each field of ``FIELDS``
+        """
+        return downsample(self.range(start, end), interval)
+
+    def close(self):
+        self._header.flush()
+        self._data.flush()
+        self._file.close()
+
+    def _positions(self, first, length):
+        return (first + _numpy().arange(length)) % self.capacity
+
+    def _logical(self, base, size, column):
+        return self._data[column, self._positions(base, size)]
+
+    def _segments(self, base, size):
+        """Return the physical slices of logical readings, oldest first."""
+        lo = base % self.capacity
+        if lo + size <= self.capacity:
+            return [(lo, lo + size)] if size else []
+        return [(lo, self.capacity), (0, lo + size - self.capacity)]
+
+    @staticmethod
+    def _search(timestamps, value, side="left"):
+        return int(_numpy().searchsorted(timestamps, value, side))
+
+    def _locked(self, operation):
+        return _FileLock(self._lock, self._file, operation)
+
+
+class _FileLock(object):
+    """Lock a file for threads of this process and for other processes."""
+
+    def __init__(self, lock, f, operation):
+        self._lock = lock
+        self._file = f
+        self._operation = operation
+
+    def __enter__(self):
+        self._lock.acquire()
+        fcntl.flock(self._file.fileno(), self._operation)
+
+    def __exit__(self, *args):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+
+def downsample(rows, interval):
+    """Aggregate sorted readings in windows of ``interval`` seconds.
+
+    Args:
+        rows: an array with a row for each column of ``COLUMNS``
+        interval: window length in seconds
+
+    Returns:
+        A dictionary of arrays, as ``Ring.downsample()``
+    """
+    np = _numpy()
+    timestamps = rows[0]
+    if not len(timestamps):
+        result = {"timestamp": np.empty(0), "count": np.empty(0, dtype=np.int64)}
+        for field in FIELDS:
+            for stat in ("min", "avg", "max"):
+                result["{}_{}".format(field, stat)] = np.empty(0)
+        return result
+
+    # Readings are sorted, so each window is a contiguous slice
+    windows = np.floor(timestamps / interval)
+    starts = np.flatnonzero(np.r_[True, windows[1:] != windows[:-1]])
+    result = {
+        "timestamp": windows[starts] * interval,
+        "count": np.diff(np.r_[starts, len(timestamps)]),
+    }
+    for i, field in enumerate(FIELDS, 1):
+        values = rows[i]
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid.astype(np.int64), starts)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[field + "_avg"] = np.where(counts > 0, sums / counts, np.nan)
+            result[field + "_min"] = np.fmin.reduceat(values, starts)
+            result[field + "_max"] = np.fmax.reduceat(values, starts)
+    return result
+
+
+def as_records(windows):
+    """Convert downsampled windows in a list of JSON serializable records,
+    such as ``{"timestamp": 0, "count": 60, "bpm": {"min": 58, "avg": 61.5,
+    "max": 70}, ...}``; missing values are ``None``.
+    """
+    records = []
+    for i in range(len(windows["timestamp"])):
+        record = {
+            "timestamp": int(windows["timestamp"][i]),
+            "count": int(windows["count"][i]),
+        }
+        for field in FIELDS:
+            record[field] = {
+                stat: _number(windows["{}_{}".format(field, stat)][i])
+                for stat in ("min", "avg", "max")
+            }
+        records.append(record)
+    return records
+
+
+def _number(value):
+    value = float(value)
+    return None if value != value else value
+
+
+class Store(object):
+    """Local store of recent readings, with a ring for each tenant in the
+    given directory.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        """Initialize the store. Rings are opened on first use.
+
+        Args:
+            path: directory of the rings; it's created if missing
+            capacity: maximum number of readings of each tenant
+        """
+        self.path = path
+        self.capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def ring(self, tenant, create=True):
+        """Return the ring of the given tenant; ``None`` is the anonymous
+        tenant. Without ``create``, missing rings are ``None``.
+        """
+        name = _filename(tenant)
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                path = os.path.join(self.path, name + ".ring")
+                if not create and not os.path.exists(path):
+                    return None
+                ring = self._rings[name] = Ring(path, self.capacity)
+            return ring
+
+    def tenants(self):
+        """Return the names of tenants with stored readings."""
+        return sorted(
+            os.path.splitext(name)[0]
+            for name in os.listdir(self.path)
+            if name.endswith(".ring")
+        )
+
+    def append(self, tenant, timestamps, bpm, systolic, diastolic):
+        self.ring(tenant).append(timestamps, bpm, systolic, diastolic)
+
+    def range(self, tenant, start=None, end=None):
+        ring = self.ring(tenant, create=False)
+        if ring is None:
+            return _numpy().empty((len(COLUMNS), 0))
+        return ring.range(start, end)
+
+    def downsample(self, tenant, start, end, interval):
+        return downsample(self.range(tenant, start, end), interval)
+
+    def close(self):
+        with self._lock:
+            rings, self._rings = self._rings, {}
+        for ring in rings.values():
+            ring.close()
+
+
+def _filename(tenant):
+    if tenant is None:
+        return DEFAULT_TENANT
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", tenant).lstrip(".") or DEFAULT_TENANT
+
+
+class StoreExporter(Exporter):
+    """Exporter that keeps HEV readings in the local ``Store``. Readings are
+    rebuilt from the series of the same tenant and timestamp; series of
+    other metrics are ignored.
+    """
+
+    name = EXPORTER_STORE
+
+    def __init__(self, store):
+        self.store = store
+
+    def send_many(self, series):
+        now = time.time()
+        results = []
+        readings = {}
+        for s in series:
+            tags = s.get("tags") or []
+            kind = next((t for t in tags if t in (KIND_SYSTOLIC, KIND_DIASTOLIC)), None)
+            field = _METRICS.get((s["metric"], kind))
+            if field is None:
+                results.append(True)
+                continue
+
+            points = _as_points(s.get("points"), now)
+            if points is None:
+                results.append(False)
+                continue
+            tenant = next((t[7:] for t in tags if t.startswith("tenant:")), None)
+            for timestamp, value in points:
+                reading = readings.setdefault((tenant, timestamp), {})
+                reading[field] = value
+            results.append(True)
+
+        by_tenant = {}
+        for (tenant, timestamp), reading in readings.items():
+            row = [timestamp] + [reading.get(f, float("nan")) for f in FIELDS]
+            by_tenant.setdefault(tenant, []).append(row)
+        try:
+            for tenant, rows in by_tenant.items():
+                self.store.append(tenant, *zip(*rows))
+        except (OSError, ValueError):
+            logging.exception("Unable to store readings in '%s'", self.store.path)
+            return [False] * len(series)
+        return results
+
+
+# Store cache, shared by the exporter and the readings API
+_store = None
+_store_key = None
+_store_lock = threading.Lock()
+
+
+def get_store(conf):
+    """Return the local store for the given configuration.
+
+    Returns:
+        A ``Store`` instance
+    """
+    global _store, _store_key
+    key = (conf.store_path, conf.store_capacity)
+    with _store_lock:
+        if _store is None or _store_key != key:
+            if _store is not None:
+                _store.close()
+            _store = Store(conf.store_path, conf.store_capacity)
+            _store_key = key
+        return _store
+
+
+def reset_store():
+    """Close and drop the cached store."""
+    global _store, _store_key
+    with _store_lock:
+        store, _store, _store_key = _store, None, None
+    if store is not None:
+        store.close()
+
+
+def _timestamp(value):
+    """Parse an epoch timestamp, or a relative one such as ``-24h``."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value[-1:] in units:
+        return time.time() + float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def main(argv=None):
+    """Print downsampled readings of a tenant as JSON lines."""
+    import hev
+
+    parser = argparse.ArgumentParser(description="Query recent HEV readings")
+    parser.add_argument("--path", default=hev.conf.store_path)
+    parser.add_argument("--tenant", help="tenant name (default: anonymous tenant)")
+    parser.add_argument(
+        "--start", type=_timestamp, default="-1d", help="epoch or relative (-1d)"
+    )
+    parser.add_argument("--end", type=_timestamp, help="epoch or relative (-1h)")
+    parser.add_argument(
+        "--interval", type=float, default=3600, help="window length in seconds"
+    )
+    parser.add_argument("--tenants", action="store_true", help="list tenants")
+    args = parser.parse_args(argv)
+
+    store = Store(args.path)
+    if args.tenants:
+        for tenant in store.tenants():
+            print(tenant)
+        return 0
+
+    end = time.time() if args.end is None else args.end
+    windows = store.downsample(args.tenant, args.start, end, args.interval)
+    for record in as_records(windows):
+        print(json.dumps(record))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,232 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from .exceptions import ConfigException
+
+
+class Tenant(object):
+    """Caller identity resolved from a bearer token. Series sent on behalf
+    of a tenant are tagged with ``tenant:<name>`` and its own tags, and are
+    reported with its own host, if any.
+    """
+
+    __slots__ = ("name", "host", "tags")
+
+    def __init__(self, name=None, host=None, tags=()):
+        """Initialize the tenant.
+
+        Args:
+            name: tenant name; ``None`` is the anonymous tenant of the
+                single ``BEARER_TOKEN`` deployment, which adds no tags
+            host: host reported for the tenant metrics, instead of the
+                function name
+            tags: additional tags of the tenant metrics
+        """
+        self.name = name
+        self.host = host
+        self.tags = tuple(tags)
+        if name is not None:
+            self.tags = ("tenant:{}".format(name),) + self.tags
+
+    def __repr__(self):
+        return "Tenant(name={!r})".format(self.name)
+
+    def apply(self, series):
+        """Return the given series with the tenant tags and host."""
+        if not self.tags and self.host is None:
+            return series
+
+        tagged = []
+        for s in series:
+            s = dict(s, tags=list(s.get("tags") or []) + list(self.tags))
+            if self.host is not None:
+                s["host"] = self.host
+            tagged.append(s)
+        return tagged
+
+
+def hash_token(token):
+    """Return the SHA-256 digest of a bearer token."""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenRegistry(object):
+    """Index of bearer tokens. Only token digests are kept in memory, and a
+    token is resolved with a single dictionary lookup of its digest. The
+    stored digest is then compared in constant time, so that response
+    times don't reveal how much of a token is right.
+    """
+
+    def __init__(self, tenants=None):
+        """Initialize the registry.
+
+        Args:
+            tenants: a list of ``(digest, Tenant)`` pairs
+        """
+        self._index = {}
+        for digest, tenant in tenants or []:
+            self._index[digest] = (digest, tenant)
+
+    def __len__(self):
+        return len(self._index)
+
+    def resolve(self, token):
+        """Return the ``Tenant`` of the given token, or ``None`` if the
+        token is not registered.
+        """
+        digest = hash_token(token)
+        entry = self._index.get(digest)
+        if entry is None or not hmac.compare_digest(entry[0], digest):
+            return None
+        return entry[1]
+
+    @classmethod
+    def from_token(cls, token):
+        """Build a registry with the single token of the anonymous tenant."""
+        return cls([(hash_token(token), Tenant())])
+
+    @classmethod
+    def from_env(cls, value):
+        """Build a registry from a ``name=token,name=token`` string."""
+        tenants = []
+        for item in value.split(","):
+            name, sep, token = item.strip().partition("=")
+            if not sep or not name or not token:
+                raise ConfigException("BEARER_TOKENS entries must be 'name=token'")
+            tenants.append((hash_token(token), Tenant(name)))
+        return cls(tenants)
+
+    @classmethod
+    def from_file(cls, path):
+        """Build a registry from a JSON file such as::
+
+            {"tenants": [
+                {"name": "smith", "token_sha256": "<hex digest>",
+                 "host": "hev-smith", "tags": ["family:smith"]}
+            ]}
+
+        Each tenant has either a ``token`` or its ``token_sha256`` digest,
+        so that plain tokens don't need to be stored in the file.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            tenants = []
+            for item in data["tenants"]:
+                if "token_sha256" in item:
+                    digest = bytes.fromhex(item["token_sha256"])
+                else:
+                    digest = hash_token(item["token"])
+                tenant = Tenant(item["name"], item.get("host"), item.get("tags", ()))
+                tenants.append((digest, tenant))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ConfigException("Unable to load tokens from '{}': {}".format(path, e))
+        return cls(tenants)
+
+
+class FileTokenRegistry(object):
+    """Token registry loaded from a file and reloaded when the file changes.
+    The file modification time is checked at most once every
+    ``check_interval`` seconds; if the new file can't be loaded, the
+    previous tokens are kept.
+    """
+
+    def __init__(self, path, check_interval=5.0, clock=time.monotonic):
+        """Load the registry.
+
+        Args:
+            path: JSON file with tenants and tokens
+            check_interval: seconds between file modification checks
+            clock: function that returns the current time in seconds
+
+        Raises:
+            ConfigException: the file can't be loaded
+        """
+        self.path = path
+        self._check_interval = check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        self._registry = TokenRegistry.from_file(path)
+        self._checked = clock()
+
+    def __len__(self):
+        return len(self._registry)
+
+    def resolve(self, token):
+        self._maybe_reload()
+        return self._registry.resolve(token)
+
+    def _maybe_reload(self):
+        now = self._clock()
+        if now - self._checked < self._check_interval:
+            return
+
+        with self._lock:
+            if now - self._checked < self._check_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                logging.error("Unable to check tokens file: %s", e)
+                return
+            if mtime == self._mtime:
+                return
+
+            try:
+                self._registry = TokenRegistry.from_file(self.path)
+                logging.info("Reloaded %d tokens", len(self._registry))
+            except ConfigException as e:
+                logging.error("%s; previous tokens are kept", e)
+            self._mtime = mtime
+
+
+# Registry cache, reused across warm Cloud Function invocations; it's a
+# ``(key, registry)`` pair, so that both are read at once without the lock
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(conf):
+    """Return the token registry for the given configuration. Tokens are
+    loaded from ``TOKENS_PATH``, ``BEARER_TOKENS`` or ``BEARER_TOKEN``, in
+    this order.
+
+    Returns:
+        A registry that resolves tokens with ``resolve()``, or ``None`` if
+        no token is configured
+
+    Raises:
+        ConfigException: tokens can't be loaded
+    """
+    global _registry
+    key = (conf.tokens_path, conf.bearer_tokens, conf.bearer_token)
+    cached = _registry
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with _registry_lock:
+        if _registry is None or _registry[0] != key:
+            if conf.tokens_path:
+                registry = FileTokenRegistry(conf.tokens_path, conf.tokens_reload)
+            elif conf.bearer_tokens:
+                registry = TokenRegistry.from_env(conf.bearer_tokens)
+            elif conf.bearer_token is not None:
+                registry = TokenRegistry.from_token(conf.bearer_token)
+            else:
+                registry = None
+            _registry = (key, registry)
+        return _registry[1]
+
+
+def reset_registry():
+    """Drop the cached token registry."""
+    global _registry
+    with _registry_lock:
+        _registry = None
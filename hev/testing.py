@@ -0,0 +1,196 @@
+import io
+import json
+import time
+import random
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .handlers import Request
+
+
+class FakeDatadog(object):
+    """Local HTTP server that emulates the Datadog metrics API. It's meant
+    to be used in tests and benchmarks, setting its ``url`` as Datadog
+    API host.
+
+    Received series are stored in the ``series`` attribute.
+    """
+
+    def __init__(self, latency=0, error_rate=0.0, quota=None, host="127.0.0.1", port=0):
+        """Initialize the fake Datadog server. The server is not started.
+
+        Args:
+            latency: seconds to wait before replying to each request
+            error_rate: probability (0..1) to reply with a server error
+            quota: optional ``(limit, period)`` pair: only ``limit`` requests
+                are accepted every ``period`` seconds, the others get a
+                ``429`` reply; all replies have rate limit headers
+            host: interface where the server listens
+            port: port where the server listens; ``0`` picks a free port
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.series = []
+        self.requests = 0
+        self.throttled = 0
+        self._failures = []
+        self._window = (0.0, 0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def fail_next(self, count, status=500):
+        """Reply to the next ``count`` requests with the given status."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            args=(0.05,),
+            name="fake-datadog",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _reply(self, body):
+        """Return the status code and the extra headers for the received
+        body, storing series when the request is accepted.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+            headers = {}
+            if self.quota is not None:
+                limit, period = self.quota
+                now = time.monotonic()
+                start, used = self._window
+                if now - start >= period:
+                    start, used = now, 0
+                throttled = used >= limit
+                self._window = (start, used if throttled else used + 1)
+                headers = {
+                    "X-RateLimit-Limit": str(limit),
+                    "X-RateLimit-Period": str(period),
+                    "X-RateLimit-Remaining": str(max(limit - used - 1, 0)),
+                    "X-RateLimit-Reset": "{:.3f}".format(start + period - now),
+                }
+                if throttled:
+                    self.throttled += 1
+                    return 429, headers
+
+            if self._failures:
+                return self._failures.pop(0), headers
+            if self.error_rate and random.random() < self.error_rate:
+                return 500, headers
+            self.series.extend(body.get("series", []))
+            return 202, headers
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately: without TCP_NODELAY
+            # keep-alive replies are delayed by the client delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+
+                status, headers = fake._reply(body)
+                if status < 300:
+                    payload = {"status": "ok"}
+                else:
+                    payload = {"errors": ["Fake Datadog error"]}
+                data = json.dumps(payload).encode()
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class HandlerClient(object):
+    """Client that calls core handlers in process, with the same requests
+    built by the runtime adapters, without a web framework nor a server.
+    It's meant to test webhooks as plain functions.
+    """
+
+    def __init__(self, routes, token=None):
+        """Initialize the client.
+
+        Args:
+            routes: a dictionary that maps paths to core handlers, such as
+                ``functions.ROUTES``
+            token: optional Bearer token sent with every request
+        """
+        self.routes = routes
+        self.token = token
+
+    def request(self, method, path, payload=None, data=b"", headers=None, query=None):
+        """Call the handler of the given path.
+
+        Args:
+            method: the HTTP method
+            path: the handler path, such as ``/webhook``
+            payload: optional document sent as JSON body
+            data: the request body, if ``payload`` is not set
+            headers: a dictionary with additional headers
+            query: a dictionary with the query parameters
+
+        Returns:
+            The ``hev.handlers.Response`` of the handler
+        """
+        headers = dict(headers or {})
+        if payload is not None:
+            data = json.dumps(payload).encode()
+            headers.setdefault("Content-Type", "application/json")
+        if self.token is not None:
+            headers.setdefault("Authorization", "Bearer " + self.token)
+        headers["Content-Length"] = str(len(data))
+
+        request = Request(
+            method, headers, path=path, args=dict(query or {}), stream=io.BytesIO(data)
+        )
+        return self.routes[path](request)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, payload=None, **kwargs):
+        return self.request("POST", path, payload, **kwargs)
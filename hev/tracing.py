@@ -0,0 +1,163 @@
+import json
+import time
+import random
+import inspect
+import logging
+import functools
+import contextvars
+
+# Metric used to report spans duration, in milliseconds
+LATENCY_METRIC = "hev.internal.latency"
+
+# Trace of the current request; ``None`` when the request is not traced
+_current = contextvars.ContextVar("hev_trace", default=None)
+
+
+class Trace(object):
+    """Timings collected while serving a request."""
+
+    __slots__ = ("name", "start", "spans")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def as_dict(self, duration, error=None):
+        return {
+            "trace": self.name,
+            "duration_ms": round(duration * 1000, 3),
+            "error": error,
+            "spans": [
+                {"stage": stage, "duration_ms": round(elapsed * 1000, 3), "error": e}
+                for stage, elapsed, e in self.spans
+            ],
+        }
+
+    def series(self, duration, timestamp):
+        """Return spans as ``hev.internal.latency`` series tagged by stage."""
+        stages = [(self.name, duration)] + [
+            (s, elapsed) for s, elapsed, _ in self.spans
+        ]
+        return [
+            {
+                "metric": LATENCY_METRIC,
+                "points": [(timestamp, elapsed * 1000)],
+                "tags": ["stage:{}".format(stage)],
+            }
+            for stage, elapsed in stages
+        ]
+
+
+class Span(object):
+    """Time a stage of the current trace. It's used either as a context
+    manager or as a decorator::
+
+        with span("dialogflow.parse"):
+            ...
+
+        @span("auth")
+        def is_authorized(request, token):
+            ...
+
+    Outside of a sampled trace, a span only costs a context variable
+    lookup.
+    """
+
+    __slots__ = ("stage", "_trace", "_start")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._trace = None
+        self._start = None
+
+    def __enter__(self):
+        self._trace = _current.get()
+        if self._trace is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._trace is not None:
+            elapsed = time.perf_counter() - self._start
+            error = exc_type.__name__ if exc_type is not None else None
+            # list.append() is atomic, so spans of concurrent exporters can
+            # be recorded in the same trace without locks
+            self._trace.spans.append((self.stage, elapsed, error))
+            self._trace = None
+
+    def __call__(self, func):
+        stage = self.stage
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def coroutine_wrapper(*args, **kwargs):
+                with Span(stage):
+                    return await func(*args, **kwargs)
+
+            return coroutine_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def span(stage):
+    """Return a ``Span`` for the given stage."""
+    return Span(stage)
+
+
+def trace(name, sample_rate=1.0, sink=None):
+    """Return a ``RequestTrace`` for the given operation."""
+    return RequestTrace(name, sample_rate, sink)
+
+
+class RequestTrace(object):
+    """Context manager that starts the trace of a request. Only a fraction
+    of requests is traced, according to the sample rate; spans of requests
+    that are not traced are not timed at all.
+
+    When the trace ends, timings are logged as a JSON document and, if a
+    sink is given, sent to it as ``hev.internal.latency`` series.
+    """
+
+    def __init__(self, name, sample_rate=1.0, sink=None):
+        """Initialize the trace.
+
+        Args:
+            name: name of the traced operation, reported as the root stage
+            sample_rate: probability (0..1) that the request is traced
+            sink: optional callable that receives the list of latency series
+        """
+        self._name = name
+        self._sample_rate = sample_rate
+        self._sink = sink
+        self._trace = None
+        self._token = None
+
+    def __enter__(self):
+        if self._sample_rate > 0 and (
+            self._sample_rate >= 1 or random.random() < self._sample_rate
+        ):
+            self._trace = Trace(self._name)
+            self._token = _current.set(self._trace)
+        return self._trace
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._trace is None:
+            return
+
+        duration = time.perf_counter() - self._trace.start
+        _current.reset(self._token)
+        error = exc_type.__name__ if exc_type is not None else None
+        logging.info("Trace: %s", json.dumps(self._trace.as_dict(duration, error)))
+
+        if self._sink is not None:
+            try:
+                self._sink(self._trace.series(duration, time.time()))
+            except Exception:
+                logging.exception("Unable to report trace '%s'", self._name)
@@ -8,3 +8,27 @@ def as_bool(v):
         The boolean converted value for the given string
     """
     return str(v).lower() in ("true", "1")
+
+
+def as_list(v):
+    """Convert the given comma separated string in a list of values.
+
+    Args:
+        string: the string that should be converted in a list
+
+    Returns:
+        A list of stripped, non empty values
+    """
+    return [item.strip() for item in str(v).split(",") if item.strip()]
+
+
+def as_float(v):
+    """Convert the given string in a float value.
+
+    Args:
+        string: the string that should be converted in float
+
+    Returns:
+        The float converted value, or ``None`` if the string is not set
+    """
+    return float(v) if v not in (None, "") else None
@@ -0,0 +1,210 @@
+import atexit
+import logging
+import threading
+import time
+
+from collections import deque
+
+from .constants import QUEUE_BLOCK, QUEUE_DROP_OLDEST, QUEUE_REJECT
+
+
+class ExportQueue(object):
+    """Bounded in-process queue that decouples the webhook response from
+    the Datadog submission. Items are flushed by a background worker thread
+    that merges queued series in a single submission and retries failures.
+
+    Each item is a ``(api, series)`` pair, where ``api`` is the client used
+    to submit the series with ``send_many()``. That way a configuration
+    change never mixes series that belong to different clients.
+    """
+
+    def __init__(
+        self,
+        maxsize=1000,
+        policy=QUEUE_DROP_OLDEST,
+        batch_size=100,
+        retries=3,
+        backoff=0.5,
+        block_timeout=1.0,
+    ):
+        """Initialize the queue and start the background worker.
+
+        Args:
+            maxsize: maximum number of queued items
+            policy: behavior when the queue is full; one of ``drop-oldest``,
+                ``block`` or ``reject``
+            batch_size: maximum number of items flushed together
+            retries: how many times a failed submission is retried
+            backoff: base delay in seconds between retries, doubled after
+                each attempt
+            block_timeout: how long ``put()`` waits when the policy is
+                ``block`` and the queue is full
+        """
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._maxsize = maxsize
+        self._policy = policy
+        self._batch_size = batch_size
+        self._retries = retries
+        self._backoff = backoff
+        self._block_timeout = block_timeout
+        self._inflight = 0
+        self._closed = False
+        self.dropped = 0
+        self._thread = threading.Thread(
+            target=self._run, name="hev-export-queue", daemon=True
+        )
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, api, series):
+        """Enqueue series that must be submitted with the given client.
+
+        Returns:
+            A boolean where ``True`` means the series have been queued
+        """
+        with self._cond:
+            if self._closed:
+                return False
+
+            if len(self._items) >= self._maxsize:
+                if self._policy == QUEUE_REJECT:
+                    logging.warning("Export queue is full: rejecting series")
+                    return False
+                elif self._policy == QUEUE_BLOCK:
+                    if not self._cond.wait_for(
+                        lambda: len(self._items) < self._maxsize,
+                        timeout=self._block_timeout,
+                    ):
+                        logging.warning("Export queue is full: timed out")
+                        return False
+                else:
+                    self._items.popleft()
+                    self.dropped += 1
+                    logging.warning("Export queue is full: dropped oldest series")
+
+            self._items.append((api, series))
+            self._cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until all queued items have been processed.
+
+        Returns:
+            A boolean where ``True`` means the queue has been drained
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._items and not self._inflight, timeout=timeout
+            )
+
+    def close(self, timeout=10.0):
+        """Stop accepting items, flush what is queued and stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._items or self._closed)
+                if not self._items and self._closed:
+                    return
+
+                batch = []
+                while self._items and len(batch) < self._batch_size:
+                    batch.append(self._items.popleft())
+                self._inflight = len(batch)
+                self._cond.notify_all()
+
+            try:
+                self._submit(batch)
+            except Exception:
+                logging.exception("Unexpected error while flushing export queue")
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    def _submit(self, batch):
+        # Group series by client, preserving the enqueue order
+        groups = {}
+        for api, series in batch:
+            groups.setdefault(id(api), (api, []))[1].extend(series)
+
+        for api, series in groups.values():
+            delay = self._backoff
+            for attempt in range(self._retries + 1):
+                results = api.send_many(series)
+                series = [s for s, ok in zip(series, results) if not ok]
+                if not series:
+                    break
+                if attempt < self._retries:
+                    time.sleep(delay)
+                    delay *= 2
+            else:
+                logging.error("Export queue dropped %d series", len(series))
+
+
+# Process-wide queues, created on first use
+_queue = None
+_metrics_queue = None
+_queue_lock = threading.Lock()
+
+# Maximum number of queued self-metrics submissions
+METRICS_QUEUE_SIZE = 100
+
+
+def get_queue(maxsize=1000, policy=QUEUE_DROP_OLDEST):
+    """Return the process-wide ``ExportQueue`` with the given size and
+    policy, creating it on first use. The queue is replaced when they
+    change, such as after a configuration reload: the previous queue stops
+    accepting series and flushes the queued ones in the background. Queues
+    are flushed when the interpreter shuts down.
+    """
+    global _queue
+    queue = _queue
+    if queue is not None and (queue._maxsize, queue._policy) == (maxsize, policy):
+        return queue
+
+    with _queue_lock:
+        queue = _queue
+        if queue is None or (queue._maxsize, queue._policy) != (maxsize, policy):
+            if queue is not None:
+                # Still registered at exit, to wait for its queued series
+                queue.close(timeout=0)
+            _queue = ExportQueue(maxsize=maxsize, policy=policy)
+            atexit.register(_queue.close)
+        return _queue
+
+
+def get_metrics_queue():
+    """Return the process-wide ``ExportQueue`` of self-metrics, creating it
+    on first use. It's separate from the queue of readings and it rejects
+    series when full, so that self-metrics never evict readings nor block
+    the request that is measured.
+    """
+    global _metrics_queue
+    if _metrics_queue is None:
+        with _queue_lock:
+            if _metrics_queue is None:
+                _metrics_queue = ExportQueue(
+                    maxsize=METRICS_QUEUE_SIZE, policy=QUEUE_REJECT, retries=0
+                )
+                atexit.register(_metrics_queue.close)
+    return _metrics_queue
+
+
+def shutdown(timeout=10.0):
+    """Flush and stop the process-wide queues, if any."""
+    global _queue, _metrics_queue
+    with _queue_lock:
+        queues = (_queue, _metrics_queue)
+        _queue = _metrics_queue = None
+    for queue in queues:
+        if queue is not None:
+            atexit.unregister(queue.close)
+            queue.close(timeout)
@@ -1,12 +1,15 @@
 import logging
 
-from flask import Flask, request
+from flask import Flask
 
-from functions import entrypoint
+from hev.adapters import register
+
+from functions import ROUTES
 
 
 def create_app():
-    """Create a development Flask application.
+    """Create a development Flask application, with an endpoint generated
+    for each Cloud Function.
 
     Returns:
         A Flask application that is used only for Debug and Integration
@@ -15,10 +18,7 @@ def create_app():
     """
     app = Flask(__name__)
 
-    @app.route("/webhook", methods=["POST"])
-    def webhook():
-        return entrypoint(request)
-
+    register(app, ROUTES)
     return app
 
 
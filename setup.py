@@ -1,3 +1,12 @@
 from setuptools import setup, find_packages
 
-setup(name="hev", packages=find_packages())
+setup(
+    name="hev",
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
+    extras_require={
+        "anomaly": ["numpy>=1.20"],
+        "json": ["orjson"],
+        "store": ["numpy>=1.20"],
+    },
+    entry_points={"console_scripts": ["hev-server = hev.server:main"]},
+)
@@ -1,8 +1,17 @@
 import hev
 import pytest
 
+from datadog.api.api_client import APIClient
+
+from functions import ROUTES
 from main import create_app
+from hev.api import reset_clients
 from hev.config import Config
+from hev.exporters import reset_dispatcher
+from hev.idempotency import MemoryStore, reset_idempotency, set_store
+from hev.store import reset_store
+from hev.tenants import reset_registry
+from hev.testing import FakeDatadog, HandlerClient
 
 
 @pytest.fixture
@@ -22,5 +31,43 @@ def config():
     hev.conf = conf
     yield conf
 
-    # Restore bootstrap Config
+    # Restore bootstrap Config and drop clients built with the test one
     hev.conf = original
+    reset_clients()
+    reset_dispatcher()
+    reset_idempotency()
+    reset_registry()
+    reset_store()
+
+
+@pytest.fixture
+def webhooks(config):
+    """Fixture: client that calls the core handlers of the Cloud Functions,
+    authorized by the configured Bearer token
+    """
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    return HandlerClient(ROUTES, token="good_token")
+
+
+@pytest.fixture
+def shared_store():
+    """Fixture: store that stands in for a store shared across instances"""
+    store = MemoryStore()
+    set_store(store)
+    yield store
+    set_store(None)
+
+
+@pytest.fixture
+def fake_datadog():
+    """Fixture: local fake Datadog API server"""
+    with FakeDatadog() as server:
+        yield server
+
+    # Datadog client stops sending metrics after consecutive timeouts
+    APIClient._timeout_counter = 0
+    APIClient._backoff_timestamp = None
+    reset_clients()
@@ -0,0 +1,130 @@
+import io
+import json
+
+from flask import url_for
+from werkzeug.test import Client, EnvironBuilder
+
+from benchmarks.bench_adapters import ADAPTERS, run
+from functions import ROUTES, entrypoint
+from functions.webhooks import webhook
+from hev.adapters import from_wsgi
+from hev.handlers import Request, parse_query
+from hev.responses import TEXTS
+from wsgi import create_wsgi_app
+
+READING = {"bpm": 60, "min": 80, "max": 120}
+
+PAYLOAD = {"queryResult": {"parameters": READING, "languageCode": "it"}}
+
+
+def test_request_headers():
+    # ensure headers of core requests are case insensitive
+    request = Request("POST", {"Content-Type": "application/json; charset=utf-8"})
+    assert request.headers.get("content-type").startswith("application/json")
+    assert request.mimetype == "application/json"
+    assert request.data == b""
+
+    request = Request("POST", stream=io.BytesIO(b'{"a": 1}'))
+    assert request.get_json() == {"a": 1}
+    assert request.data == b'{"a": 1}'
+
+
+def test_parse_query():
+    # ensure the first value of repeated query parameters is kept
+    assert parse_query("start=1&end=2&start=3&empty=") == {
+        "start": "1",
+        "end": "2",
+        "empty": "",
+    }
+
+
+def test_webhooks_fixture(webhooks):
+    # ensure core handlers are called without a web framework
+    response = webhooks.post("/webhook", PAYLOAD)
+    assert response.status == 201
+    assert response.get_json()["fulfillmentText"] == TEXTS["it"]["recorded"]
+
+    response = webhooks.get("/webhook")
+    assert response.status == 405
+    assert response.get_json()["message"] == "Method Not Allowed"
+
+    response = webhooks.post("/webhook", PAYLOAD, headers={"Authorization": "none"})
+    assert response.status == 401
+
+    response = webhooks.post("/bulk", [dict(READING, timestamp=1546300800)])
+    assert response.status == 201
+    assert response.get_json()["accepted"] == 1
+
+    response = webhooks.get("/readings", query={"interval": 60})
+    assert response.status == 404
+
+
+def test_flask_endpoints(client, config):
+    # ensure a Flask endpoint is generated for each core handler
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=PAYLOAD,
+    )
+    assert resp.status_code == 201
+    assert resp.json["message"] == "Success"
+
+    resp = client.put(url_for("bulk"))
+    assert resp.status_code == 405
+    assert resp.json["message"] == "Method Not Allowed"
+
+
+def test_cloud_function_entrypoint():
+    # ensure the Cloud Function entrypoint wraps the core handler
+    assert entrypoint.handler is webhook
+    assert entrypoint.__name__ == "webhook"
+    assert ROUTES["/webhook"] is webhook
+
+
+def test_wsgi_app(webhooks):
+    # ensure the raw WSGI application routes requests to core handlers
+    client = Client(create_wsgi_app())
+    resp = client.post(
+        "/webhook", headers=[("Authorization", "Bearer good_token")], json=PAYLOAD
+    )
+    assert resp.status == "201 Created"
+    assert resp.headers["Content-Type"] == "application/json"
+    assert resp.headers["Content-Length"] == str(len(resp.data))
+    assert json.loads(resp.data)["message"] == "Success"
+
+    resp = client.get("/readings?interval=hourly")
+    assert resp.status_code == 401
+
+    resp = client.get("/unknown")
+    assert resp.status_code == 404
+    assert json.loads(resp.data) == {"message": "Not Found"}
+
+
+def test_wsgi_bounded_body():
+    # ensure the WSGI input is read only up to the Content-Length
+    body = json.dumps(PAYLOAD).encode()
+    environ = EnvironBuilder(method="POST", data=body).get_environ()
+    environ["wsgi.input"] = io.BytesIO(body + b"next request")
+    request = from_wsgi(environ)
+    assert request.data == body
+    assert request.headers.get("Content-Length") == str(len(body))
+
+    # Without Content-Length, only terminated inputs are read
+    del environ["CONTENT_LENGTH"]
+    environ["wsgi.input"] = io.BytesIO(body)
+    assert from_wsgi(environ).data == b""
+    environ["wsgi.input"] = io.BytesIO(body)
+    environ["wsgi.input_terminated"] = True
+    assert from_wsgi(environ).data == body
+
+
+def test_bench_adapters(config):
+    # ensure the benchmark serves the webhook with every adapter
+    results = run(number=2)
+    assert [r["adapter"] for r in results] == ADAPTERS
+    assert all(r["status"] == 201 for r in results)
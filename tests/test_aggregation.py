@@ -0,0 +1,141 @@
+import threading
+
+from flask import url_for
+
+from hev.aggregation import AggregatingExporter
+from hev.exporters import Exporter, MemoryExporter, get_dispatcher, reset_dispatcher
+
+
+class FakeClock(object):
+    """Clock that moves only when asked"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def summary(series):
+    return {(s["metric"], tuple(s.get("tags", []))): s["points"][0][1] for s in series}
+
+
+def test_aggregated_summary():
+    # ensure windows are summarized with count, min, max, avg and percentiles
+    memory = MemoryExporter()
+    clock = FakeClock(1000)
+    aggregator = AggregatingExporter(memory, window=10, clock=clock)
+
+    for bpm in range(60, 80):
+        assert (
+            aggregator.send_many(Exporter.build_parameters(bpm, 80, 120)) == [True] * 3
+        )
+
+    clock.now = 1010
+    aggregator.flush()
+    values = summary(memory.series)
+
+    assert values[("hev.parameters.bpm.count", ())] == 20
+    assert values[("hev.parameters.bpm.min", ())] == 60
+    assert values[("hev.parameters.bpm.max", ())] == 79
+    assert values[("hev.parameters.bpm.avg", ())] == 69.5
+    assert values[("hev.parameters.bpm.p50", ())] == 69
+    assert values[("hev.parameters.bpm.p95", ())] == 78
+    assert values[("hev.parameters.bpm.p99", ())] == 79
+    assert values[("hev.parameters.pressure.avg", ("min",))] == 80
+    assert values[("hev.parameters.pressure.avg", ("max",))] == 120
+    assert {s["points"][0][0] for s in memory.series} == {1000}
+    aggregator.close()
+
+
+def test_aggregated_windows():
+    # ensure only windows that are over are flushed
+    memory = MemoryExporter()
+    clock = FakeClock(1005)
+    aggregator = AggregatingExporter(memory, window=10, clock=clock)
+
+    aggregator.send_many([{"metric": "hev.bpm", "points": [(990, 60), (1001, 70)]}])
+    aggregator.flush()
+    assert summary(memory.series)[("hev.bpm.count", ())] == 1
+    assert {s["points"][0][0] for s in memory.series} == {990}
+
+    memory.clear()
+    aggregator.flush()
+    assert memory.series == []
+
+    aggregator.flush(force=True)
+    assert summary(memory.series)[("hev.bpm.avg", ())] == 70
+    assert {s["points"][0][0] for s in memory.series} == {1000}
+    aggregator.close()
+
+
+def test_aggregation_rejects_empty_series():
+    # ensure series without values are not aggregated
+    aggregator = AggregatingExporter(MemoryExporter())
+    assert aggregator.send_many(Exporter.build_parameters(60, None, 120)) == [
+        True,
+        False,
+        True,
+    ]
+    aggregator.close()
+
+
+def test_aggregation_close():
+    # ensure pending windows are flushed when the aggregator is closed
+    memory = MemoryExporter()
+    aggregator = AggregatingExporter(memory, window=60)
+    aggregator.send_parameters(60, 80, 120)
+
+    aggregator.close()
+    assert len(memory.series) == 3 * 7
+    assert aggregator.send_parameters(60, 80, 120) == [False] * 3
+
+
+def test_aggregation_thread_safety():
+    # ensure concurrent submissions are all aggregated
+    memory = MemoryExporter()
+    aggregator = AggregatingExporter(memory, window=60)
+
+    def report():
+        for _ in range(200):
+            aggregator.send_parameters(60, 80, 120)
+
+    threads = [threading.Thread(target=report) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    aggregator.close()
+    assert summary(memory.series)[("hev.parameters.bpm.count", ())] == 1600
+
+
+def test_webhook_aggregation(client, config):
+    # ensure the Cloud Function aggregates readings when a window is set
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["memory"]
+    config.aggregation_window = 60
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    for _ in range(3):
+        resp = client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer good_token")],
+            json=payload,
+        )
+        assert resp.status_code == 201
+
+    aggregator = get_dispatcher(config).exporters[0]
+    memory = aggregator.exporter.exporter
+    assert isinstance(aggregator, AggregatingExporter)
+
+    # Pending windows are flushed when the dispatcher is dropped
+    reset_dispatcher()
+    counts = [
+        s["points"][0][1]
+        for s in memory.series
+        if s["metric"] == "hev.parameters.bpm.count"
+    ]
+    assert sum(counts) == 3
@@ -0,0 +1,194 @@
+import json
+
+import pytest
+
+from hev import anomaly
+from hev.anomaly import (
+    OUTLIER,
+    PULSE,
+    RANGE,
+    AnomalyExporter,
+    Detector,
+    main,
+    reasons,
+    rescore,
+    score,
+)
+from hev.exceptions import ConfigException
+from hev.exporters import MemoryExporter, get_dispatcher
+from hev.store import Store
+from hev.tenants import Tenant
+
+np = pytest.importorskip("numpy")
+
+
+def vitals(count, seed=42):
+    """Plausible readings with some noise, as bpm, systolic, diastolic rows"""
+    rng = np.random.default_rng(seed)
+    return np.vstack(
+        [
+            rng.normal(70, 3, count).round(),
+            rng.normal(120, 4, count).round(),
+            rng.normal(80, 3, count).round(),
+        ]
+    )
+
+
+def test_score_ranges():
+    # ensure implausible values and pulse pressures are flagged
+    values = [[70, 200, 70, 70], [120, 120, 230, 90], [80, 80, 80, 85]]
+    flags = score(values)
+    assert list(flags) == [0, RANGE, RANGE | PULSE, PULSE]
+    assert reasons(RANGE | PULSE) == ["range", "pulse-pressure"]
+
+
+def test_score_outlier():
+    # ensure a recognition slip is an outlier of the previous readings
+    values = vitals(30)
+    values[0, 20] = 120
+    flags = score(values)
+    assert flags[20] == OUTLIER
+    assert not flags[:20].any()
+
+    # Without enough history, outliers are not detected
+    values = vitals(30)
+    values[0, 5] = 120
+    assert score(values)[5] == 0
+
+
+def test_score_missing_fields():
+    # ensure a missing field doesn't disable outlier checks of its window
+    values = np.vstack([np.full(40, 60.0), np.full(40, 120.0), np.full(40, 80.0)])
+    values[0, 10] = np.nan
+    values[0, 20] = 150
+    flags = score(values)
+    assert flags[20] == OUTLIER
+    assert not flags[:20].any()
+
+    # A field is checked only with enough values in its history
+    values[0, :18] = np.nan
+    assert score(values)[20] == 0
+
+
+def test_batch_matches_online(monkeypatch):
+    # ensure batch scoring of a history gives the same flags of the online detector
+    monkeypatch.setattr(anomaly, "CHUNK_SIZE", 7)
+    values = vitals(300)
+    values[0, [50, 120, 250]] = [130, 30, 110]
+    values[1, 180] = 75
+
+    detector = Detector(window=20)
+    online = [detector.score(None, values[:, i, None])[0] for i in range(300)]
+    batch = score(values, window=20)
+
+    assert list(batch) == online
+    assert {50, 120, 180, 250} <= set(np.nonzero(batch)[0])
+
+
+def test_detector_tenants():
+    # ensure each tenant has its own bounded rolling window
+    detector = Detector(window=10)
+    detector.score("smith", vitals(25))
+    detector.score("jones", [[60], [110], [70]])
+
+    assert detector._history["smith"].shape == (3, 10)
+    assert detector._history["jones"].shape == (3, 1)
+
+
+def test_exporter_tag():
+    # ensure anomalous readings are tagged and split from normal points
+    memory = MemoryExporter()
+    exporter = AnomalyExporter(memory, Detector())
+    series = Tenant("smith").apply(
+        MemoryExporter.build_parameters(70, 80, 120, timestamp=1)
+        + MemoryExporter.build_parameters(200, 80, 120, timestamp=2)
+    )
+    series.append({"metric": "hev.internal.latency", "points": 5})
+
+    assert exporter.send_many(series) == [True] * 7
+    # All series of an anomalous reading are tagged
+    tagged = [s for s in memory.series if "anomaly:range" in s.get("tags", [])]
+    assert len(tagged) == 3
+    assert tagged[0]["metric"] == "hev.parameters.bpm"
+    assert tagged[0]["points"] == [(2, 200)]
+    assert "tenant:smith" in tagged[0]["tags"]
+    assert exporter.stats() == {"scored": 2, "anomalies": 1}
+
+
+def test_exporter_quarantine():
+    # ensure quarantined readings are sent under their own metrics
+    memory = MemoryExporter()
+    exporter = AnomalyExporter(memory, Detector(), policy="quarantine")
+    points = [(1, 70), (2, 200)]
+    series = [
+        {"metric": "hev.parameters.bpm", "points": points},
+        {
+            "metric": "hev.parameters.pressure",
+            "points": [(1, 80), (2, 80)],
+            "tags": ["min"],
+        },
+        {
+            "metric": "hev.parameters.pressure",
+            "points": [(1, 120), (2, 120)],
+            "tags": ["max"],
+        },
+    ]
+
+    assert exporter.send_many(series) == [True, True, True]
+    metrics = sorted({s["metric"] for s in memory.series})
+    assert metrics == [
+        "hev.parameters.bpm",
+        "hev.parameters.pressure",
+        "hev.quarantine.parameters.bpm",
+        "hev.quarantine.parameters.pressure",
+    ]
+    quarantined = memory.series[1]
+    assert quarantined["points"] == [(2, 200)]
+    assert quarantined["tags"] == ["anomaly:range"]
+
+
+def test_dispatcher_anomalies(config):
+    # ensure the Datadog exporter scores readings when detection is enabled
+    config.dd_api_key = "api_key"
+    config.dry_run = True
+    config.exporters = ["datadog", "memory"]
+    config.anomaly_policy = "tag"
+
+    dispatcher = get_dispatcher(config)
+    series = dispatcher.build_parameters(70, 80, 120, timestamp=1)
+    assert dispatcher.dispatch(series) == {
+        "datadog": [True, True, True],
+        "memory": [True, True, True],
+    }
+    assert dispatcher.stats()["datadog"]["scored"] == 1
+    assert "scored" not in dispatcher.stats().get("memory", {})
+
+
+def test_invalid_policy(config):
+    # ensure only known anomaly policies are accepted
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "token"
+    config.anomaly_policy = "drop"
+    with pytest.raises(ConfigException):
+        config.validate()
+
+
+def test_rescore_store(tmpdir, capsys):
+    # ensure stored readings are scored in batch mode
+    store = Store(str(tmpdir))
+    values = vitals(100)
+    values[0, 70] = 150
+    store.append("smith", np.arange(100.0), *values)
+
+    rows, flags = rescore(store, "smith")
+    assert rows.shape == (4, 100)
+    assert list(np.nonzero(flags)[0]) == [70]
+
+    assert main(["--path", str(tmpdir)]) == 0
+    (line,) = capsys.readouterr().out.splitlines()
+    record = json.loads(line)
+    assert record["tenant"] == "smith"
+    assert record["timestamp"] == 70
+    assert record["bpm"] == 150
+    assert record["anomalies"] == ["outlier"]
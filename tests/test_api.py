@@ -4,7 +4,7 @@ import datadog
 
 from flask import request
 
-from hev.api import DatadogAPI, DialogFlowRequest
+from hev.api import DatadogAPI, DialogFlowRequest, get_client, reset_clients
 from hev.constants import KIND_DIASTOLIC, KIND_SYSTOLIC
 from hev.exceptions import BadRequest
 
@@ -17,6 +17,42 @@ def test_datadog_api_init():
     assert api._function_name == "test_config"
 
 
+def test_datadog_api_pooled_session():
+    # ensure the Datadog HTTP client uses a persistent pooled session
+    from datadog.api.http_client import RequestClient
+
+    DatadogAPI("api_key", "test_config")
+    session = RequestClient._session
+    DatadogAPI("api_key", "test_config")
+    assert session is not None
+    assert RequestClient._session is session
+
+
+def test_get_client_cached():
+    # ensure the same client is returned for the same configuration
+    reset_clients()
+    api = get_client("api_key", "test_config")
+    assert get_client("api_key", "test_config") is api
+    assert get_client("api_key", "test_config", True) is not api
+
+
+def test_get_client_evicts_other_configurations():
+    # ensure a configuration change re-initializes Datadog with the new key
+    reset_clients()
+    get_client("api_key", "test_config")
+    api = get_client("other_key", "test_config")
+    assert api._api._api_key == "other_key"
+    api = get_client("api_key", "test_config")
+    assert api._api._api_key == "api_key"
+
+
+def test_reset_clients():
+    # ensure cached clients can be invalidated
+    api = get_client("api_key", "test_config")
+    reset_clients()
+    assert get_client("api_key", "test_config") is not api
+
+
 def test_send_bpm(monkeypatch):
     # ensure the API sends the right BPM values
     def mock_return(*args, **kwargs):
@@ -90,6 +126,77 @@ def test_send_pressure_failure(monkeypatch, caplog):
     assert status is False
 
 
+def test_send_parameters(monkeypatch):
+    # ensure the API sends all HEV parameters in a single submission
+    calls = []
+
+    def mock_return(*args, **kwargs):
+        calls.append(kwargs)
+        return {"status": "ok"}
+
+    api = DatadogAPI("api_key", "test_config")
+    monkeypatch.setattr(api._api.Metric, "send", mock_return)
+    results = api.send_parameters(80, 70, 120)
+
+    assert results == [True, True, True]
+    assert len(calls) == 1
+    assert calls[0]["metrics"] == [
+        {"metric": "hev.parameters.bpm", "points": 80, "host": "test_config"},
+        {
+            "metric": "hev.parameters.pressure",
+            "points": 70,
+            "tags": ["min"],
+            "host": "test_config",
+        },
+        {
+            "metric": "hev.parameters.pressure",
+            "points": 120,
+            "tags": ["max"],
+            "host": "test_config",
+        },
+    ]
+
+
+def test_send_many_failure(monkeypatch, caplog):
+    # ensure a rejected submission marks all series as failed
+    def mock_return(*args, **kwargs):
+        return {"status": "failure"}
+
+    api = DatadogAPI("api_key", "test_config")
+    monkeypatch.setattr(api._api.Metric, "send", mock_return)
+    results = api.send_parameters(80, 70, 120)
+
+    assert results == [False, False, False]
+    assert caplog.record_tuples[0] == ("root", logging.ERROR, "{'status': 'failure'}")
+
+
+def test_send_many_missing_points(monkeypatch):
+    # ensure series without points are reported as failed and not sent
+    calls = []
+
+    def mock_return(*args, **kwargs):
+        calls.append(kwargs)
+        return {"status": "ok"}
+
+    api = DatadogAPI("api_key", "test_config")
+    monkeypatch.setattr(api._api.Metric, "send", mock_return)
+    results = api.send_parameters(80, None, 120)
+
+    assert results == [True, False, True]
+    assert len(calls[0]["metrics"]) == 2
+
+
+def test_send_many_dry_run(monkeypatch):
+    # ensure dry-run never calls Datadog
+    def mock_return(*args, **kwargs):
+        raise AssertionError("Datadog must not be called")
+
+    api = DatadogAPI("api_key", "test_config", dry_run=True)
+    monkeypatch.setattr(api._api.Metric, "send", mock_return)
+
+    assert api.send_parameters(80, 70, 120) == [True, True, True]
+
+
 def test_dialog_flow_init(app):
     # ensure a DialogFlow class can parse Flask Request instance
     with app.test_request_context(json={"key": "value"}):
@@ -140,6 +247,33 @@ def test_dialog_flow_validation_empty(app):
             DialogFlowRequest(request).validate()
 
 
+def test_dialog_flow_read(app):
+    # ensure HEV parameters are extracted in a Reading
+    with app.test_request_context(
+        json={"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+    ):
+        reading = DialogFlowRequest(request).read()
+        assert (reading.bpm, reading.min, reading.max) == (60, 80, 120)
+
+
+def test_dialog_flow_validation_types(app):
+    # ensure values are checked for type and range
+    with app.test_request_context(
+        json={"queryResult": {"parameters": {"bpm": "60", "min": 80, "max": 999}}}
+    ):
+        with pytest.raises(BadRequest) as e:
+            DialogFlowRequest(request).validate()
+        assert "'bpm': 'must be a number'" in str(e.value)
+        assert "'max': 'must be between 40 and 300 mmHg'" in str(e.value)
+
+
+def test_dialog_flow_validation_not_object(app):
+    # ensure a payload that is not an object raises a BadRequest exception
+    with app.test_request_context(json=[1, 2, 3]):
+        with pytest.raises(BadRequest):
+            DialogFlowRequest(request).validate()
+
+
 def test_dialog_flow_get_parameter(app):
     # ensure a deserialized payload is considered valid
     with app.test_request_context(
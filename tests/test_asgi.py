@@ -0,0 +1,264 @@
+import json
+import asyncio
+
+import hev
+import pytest
+
+from asgi import create_asgi_app
+from hev.aio import (
+    AsyncDatadogAPI,
+    ConnectionPool,
+    close_async_dispatcher,
+    get_async_dispatcher,
+)
+from hev.asgi import Request
+from hev.exporters import get_dispatcher
+from hev.ratelimit import RateLimiter
+
+PAYLOAD = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+
+async def _post(app, body, path="/webhook", method="POST", token="good_token"):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"authorization", "Bearer {}".format(token).encode()),
+        ],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def post(*requests):
+    """Serve requests concurrently in a new event loop."""
+
+    async def run():
+        app = create_asgi_app()
+        responses = await asyncio.gather(*[_post(app, *r) for r in requests])
+        await close_async_dispatcher()
+        return responses
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def asgi_config(config, fake_datadog):
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.retry_backoff = 0
+    return config
+
+
+def test_request_headers():
+    # ensure ASGI requests expose case insensitive headers and JSON data
+    scope = {
+        "method": "POST",
+        "path": "/webhook",
+        "headers": [(b"Content-Type", b"application/json; charset=utf-8")],
+    }
+    request = Request(scope, b'{"a": 1}')
+    assert request.headers.get("content-type").startswith("application/json")
+    assert request.mimetype == "application/json"
+    assert request.get_json() == {"a": 1}
+    assert Request(scope, b"{").get_json(silent=True) is None
+
+
+def test_asgi_only_post(asgi_config):
+    # ensure the asyncio runtime accepts only POST requests
+    ((status, _),) = post((b"", "/webhook", "GET"))
+    assert status == 405
+
+
+def test_asgi_not_found(asgi_config):
+    # ensure unknown paths are rejected
+    ((status, _),) = post((b"", "/unknown"))
+    assert status == 404
+
+
+def test_asgi_missing_authorization(asgi_config):
+    # ensure the asyncio runtime shares the webhook authorization
+    ((status, data),) = post((json.dumps(PAYLOAD).encode(), "/webhook", "POST", "bad"))
+    assert status == 401
+    assert data["message"] == "Not Authorized"
+
+
+def test_asgi_bad_request(asgi_config):
+    # ensure the asyncio runtime shares the webhook validation
+    ((status, _),) = post((b'{"queryResult": {}}',))
+    assert status == 400
+
+
+def test_asgi_payload_too_large(asgi_config):
+    # ensure oversized bodies are rejected before being parsed
+    ((status, _),) = post((b" " * (1024 * 1024 + 1),))
+    assert status == 413
+
+
+def test_asgi_success(asgi_config, fake_datadog):
+    # ensure concurrent requests are submitted to Datadog
+    body = json.dumps(PAYLOAD).encode()
+    responses = post(*[(body,)] * 5)
+    assert [status for status, _ in responses] == [201] * 5
+
+    assert len(fake_datadog.series) == 15
+    metrics = {s["metric"] for s in fake_datadog.series}
+    assert metrics == {"hev.parameters.bpm", "hev.parameters.pressure"}
+    assert {s["host"] for s in fake_datadog.series} == {"test_config"}
+
+
+def test_asgi_dry_run(asgi_config, fake_datadog):
+    # ensure the dry run mode never reaches Datadog
+    asgi_config.dry_run = True
+    ((status, _),) = post((json.dumps(PAYLOAD).encode(),))
+    assert status == 201
+    assert fake_datadog.requests == 0
+
+
+def test_asgi_datadog_failure(asgi_config, fake_datadog):
+    # ensure failed submissions are retried and reported
+    fake_datadog.fail_next(1)
+    ((status, _),) = post((json.dumps(PAYLOAD).encode(),))
+    assert status == 201
+    assert fake_datadog.requests == 2
+
+    fake_datadog.fail_next(10)
+    ((status, data),) = post((json.dumps(PAYLOAD).encode(),))
+    assert status == 503
+    assert data["exporters"] == ["datadog"]
+
+
+def test_asgi_idempotency(asgi_config, fake_datadog):
+    # ensure retried requests are not exported twice
+    asgi_config.idempotency_ttl = 60
+    body = json.dumps(dict(PAYLOAD, responseId="r1")).encode()
+    first, second = post((body,)), post((body,))
+    assert first == second
+    assert fake_datadog.requests == 1
+
+
+def test_async_dispatcher_pool(asgi_config, fake_datadog):
+    # ensure Datadog connections are pooled and reused across requests
+    async def run():
+        dispatcher = get_async_dispatcher(asgi_config)
+        assert get_async_dispatcher(asgi_config) is dispatcher
+        (exporter,) = dispatcher.exporters
+        api = exporter.exporter
+        assert isinstance(api, AsyncDatadogAPI)
+        assert api._limiter is get_dispatcher(asgi_config).exporters[0].exporter.limiter
+
+        series = dispatcher.build_parameters(60, 80, 120, 0)
+        for _ in range(3):
+            assert await dispatcher.dispatch(series) == {"datadog": [True] * 3}
+        idle = len(api._pool._idle)
+        await close_async_dispatcher()
+        return idle
+
+    assert asyncio.run(run()) == 1
+    assert fake_datadog.requests == 3
+
+
+def test_pool_stale_connection():
+    # ensure a failed retry of a stale connection closes the new connection
+    async def serve(reader, writer):
+        connections.append(writer)
+        if len(connections) == 1:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool("http://127.0.0.1:{}".format(port), timeout=5)
+        opened = []
+        connect = pool._connect
+
+        async def track():
+            conn = await connect()
+            opened.append(conn[1])
+            return conn
+
+        pool._connect = track
+        status, data, headers = await pool.request("GET", "/")
+        assert (status, data) == (200, b"ok")
+        assert headers.get("Content-Length") == "2"
+        with pytest.raises(OSError):
+            await pool.request("GET", "/")
+        server.close()
+        return opened
+
+    connections = []
+    opened = asyncio.run(run())
+    assert len(opened) == 2
+    assert all(writer.is_closing() for writer in opened)
+
+
+def test_pool_host_header():
+    # ensure the Host header has the port, unless it's the default one
+    async def serve(reader, writer):
+        hosts.extend(
+            line
+            for line in (await reader.readuntil(b"\r\n\r\n")).split(b"\r\n")
+            if line.startswith(b"Host:")
+        )
+        writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool("http://127.0.0.1:{}".format(port), timeout=5)
+        assert (await pool.request("GET", "/"))[0] == 204
+        server.close()
+        return port
+
+    hosts = []
+    port = asyncio.run(run())
+    assert hosts == ["Host: 127.0.0.1:{}".format(port).encode()]
+    assert ConnectionPool("https://api.datadoghq.com:443").authority == (
+        "api.datadoghq.com"
+    )
+
+
+def test_async_datadog_quota(fake_datadog):
+    # ensure asyncio submissions wait for the quota reported by Datadog
+    fake_datadog.quota = (1, 1)
+    limiter = RateLimiter(rate=None, burst=10)
+    api = AsyncDatadogAPI(
+        "api_key", "test_config", api_host=fake_datadog.url, limiter=limiter
+    )
+
+    async def run():
+        series = [{"metric": "a", "points": [(0, 1)]}]
+        results = [await api.send_many(series) for _ in range(2)]
+        await api.close()
+        return results
+
+    assert asyncio.run(run()) == [[True], [True]]
+    assert fake_datadog.throttled == 0
+    assert limiter.stats()["waits"] == 1
+
+
+def test_asgi_invalid_environment(monkeypatch):
+    # ensure a configuration that can't be loaded is a configuration error
+    monkeypatch.delattr(hev, "conf", raising=False)
+    monkeypatch.setenv("EXPORT_RETRIES", "many")
+    ((status, data),) = post((json.dumps(PAYLOAD).encode(),))
+    assert status == 500
+    assert data["message"] == "Configuration error"
@@ -0,0 +1,157 @@
+import io
+import hev
+import gzip
+import json
+import time
+import pytest
+import threading
+
+from backfill import detect_format, main
+from hev.backfill import Backfill
+from hev.exporters import Exporter, MemoryExporter
+from hev.ingest import iter_ndjson
+
+
+class ConcurrencyExporter(Exporter):
+    """Exporter that tracks the number of concurrent submissions"""
+
+    name = "concurrency"
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def send_many(self, series):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        time.sleep(0.01)
+        with self.lock:
+            self.current -= 1
+        return [True] * len(series)
+
+
+def ndjson(readings):
+    lines = "\n".join(json.dumps(r) for r in readings)
+    return io.BytesIO(lines.encode("utf-8"))
+
+
+def readings(count):
+    return [{"timestamp": i, "bpm": 60, "min": 80, "max": 120} for i in range(count)]
+
+
+def test_backfill_batches():
+    # ensure readings are sent in batches
+    memory = MemoryExporter()
+    stats = Backfill(memory, batch_size=4).run(iter_ndjson(ndjson(readings(10))))
+
+    assert stats["rows"] == 10
+    assert stats["accepted"] == 10
+    assert stats["rejected"] == 0
+    assert stats["failed"] == 0
+    # 3 batches with 3 series each
+    assert len(memory.series) == 9
+    assert len(memory.series[0]["points"]) == 4
+
+
+def test_backfill_rejected_rows():
+    # ensure invalid rows are counted and skipped
+    rows = readings(3) + [{"timestamp": 3, "bpm": 60}]
+    stats = Backfill(MemoryExporter()).run(iter_ndjson(ndjson(rows)))
+
+    assert stats["accepted"] == 3
+    assert stats["rejected"] == 1
+
+
+def test_backfill_failures():
+    # ensure failed submissions are counted
+    memory = MemoryExporter()
+    memory.send_many = lambda series: [False] * len(series)
+    stats = Backfill(memory, batch_size=2).run(iter_ndjson(ndjson(readings(5))))
+
+    assert stats["failed"] == 5
+    assert stats["accepted"] == 0
+
+
+def test_backfill_max_inflight():
+    # ensure concurrent submissions are bounded
+    exporter = ConcurrencyExporter()
+    pipeline = Backfill(exporter, batch_size=1, max_inflight=3)
+    stats = pipeline.run(iter_ndjson(ndjson(readings(30))))
+
+    assert stats["accepted"] == 30
+    assert 1 < exporter.peak <= 3
+
+
+def test_detect_format():
+    # ensure the format is detected from the file extension
+    assert detect_format("export.csv") == "csv"
+    assert detect_format("export.csv.gz") == "csv"
+    assert detect_format("export.json") == "json"
+    assert detect_format("export.ndjson") == "ndjson"
+
+
+def test_backfill_command_dry_run(tmpdir, config):
+    # ensure dry-run validates a file without a Datadog configuration
+    path = tmpdir.join("export.csv")
+    path.write("timestamp,bpm,min,max\n1,60,80,120\n2,61,81,121\n")
+
+    assert main([str(path), "--dry-run"]) == 0
+
+
+def test_backfill_command_config_dry_run(tmpdir, config):
+    # ensure the DRY_RUN configuration is honored
+    path = tmpdir.join("export.ndjson")
+    path.write(json.dumps(readings(1)[0]))
+    config.dry_run = True
+
+    assert main([str(path)]) == 0
+
+
+def test_backfill_command_no_dry_run(tmpdir, config, fake_datadog):
+    # ensure --no-dry-run sends readings even when DRY_RUN is set
+    path = tmpdir.join("export.ndjson")
+    path.write(json.dumps(readings(1)[0]))
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.dry_run = True
+
+    assert main([str(path), "--no-dry-run"]) == 0
+    assert fake_datadog.requests == 1
+
+
+def test_backfill_command_invalid_environment(tmpdir, monkeypatch, capsys):
+    # ensure the help is shown and errors are reported on a bad environment
+    monkeypatch.delattr(hev, "conf", raising=False)
+    monkeypatch.setenv("EXPORT_RETRIES", "many")
+    with pytest.raises(SystemExit):
+        main(["--help"])
+    assert "--no-dry-run" in capsys.readouterr().out
+
+    path = tmpdir.join("export.ndjson")
+    path.write(json.dumps(readings(1)[0]))
+    assert main([str(path)]) == 2
+
+
+def test_backfill_command_missing_config(tmpdir, config):
+    # ensure Datadog configuration is required without dry-run
+    path = tmpdir.join("export.ndjson")
+    path.write(json.dumps(readings(1)[0]))
+
+    assert main([str(path)]) == 2
+
+
+def test_backfill_command(tmpdir, config, fake_datadog):
+    # ensure readings are sent to Datadog from a compressed file
+    path = str(tmpdir.join("export.ndjson.gz"))
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join(json.dumps(r) for r in readings(10)))
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+
+    assert main([path, "--batch-size", "3"]) == 0
+    assert fake_datadog.requests == 4
+    assert sum(len(s["points"]) for s in fake_datadog.series) == 30
@@ -0,0 +1,35 @@
+from benchmarks.bench_load import percentile, run_scenario
+
+
+def test_percentile():
+    # ensure percentiles use the nearest rank
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1], 95) == 1
+    assert percentile([], 50) is None
+
+
+def test_webhook_scenario(config):
+    # ensure the load generator reports latencies of webhook requests
+    results = run_scenario("concurrent", 8, [1, 2], 0, 0.0, 10)
+    assert [r["concurrency"] for r in results] == [1, 2]
+    for result in results:
+        assert result["statuses"] == {"201": 8}
+        assert result["points"] == 8 * 3
+        assert 0 < result["p50"] <= result["p95"] <= result["p99"] <= result["max"]
+
+
+def test_batched_scenario(config):
+    # ensure batched readings are sent to the bulk endpoint
+    (result,) = run_scenario("batched", 2, [1], 0, 0.0, 10)
+    assert result["statuses"] == {"201": 2}
+    assert result["points"] == 2 * 10 * 3
+    assert result["readings_per_second"] > 0
+
+
+def test_dry_run_scenario(config):
+    # ensure dry run requests don't reach Datadog
+    (result,) = run_scenario("dry_run", 4, [2], 0, 0.0, 10)
+    assert result["statuses"] == {"201": 4}
+    assert result["submissions"] == 0
@@ -0,0 +1,124 @@
+import json
+
+from flask import url_for
+
+from functions import bulk as bulk_module
+from hev.exporters import get_dispatcher
+from hev.responses import TEXTS
+
+
+def configure(config):
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["memory"]
+
+
+def test_bulk_only_post(client):
+    # ensure the bulk Cloud Function accepts only POST requests
+    resp = client.get(url_for("bulk"))
+    assert resp.status_code == 405
+
+
+def test_bulk_missing_authorization(client, config):
+    # ensure the bulk Cloud Function requires the Authorization header
+    configure(config)
+    resp = client.post(url_for("bulk"), json=[])
+
+    assert resp.status_code == 401
+    assert json.loads(resp.data) == {
+        "message": "Not Authorized",
+        "fulfillmentText": TEXTS["en"]["not-authorized"],
+    }
+
+
+def test_bulk_json_array(client, config, monkeypatch):
+    # ensure readings are sent in chunks of multi-point submissions
+    monkeypatch.setattr(bulk_module, "BATCH_SIZE", 2)
+    configure(config)
+    readings = [{"timestamp": i, "bpm": 60, "min": 80, "max": 120} for i in range(5)]
+
+    resp = client.post(
+        url_for("bulk"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=readings,
+    )
+    data = json.loads(resp.data)
+    memory = get_dispatcher(config).exporters[0].exporter
+
+    assert resp.status_code == 201
+    assert data == {
+        "message": "Success",
+        "accepted": 5,
+        "rejected": 0,
+        "failed": 0,
+        "errors": [],
+    }
+    # 3 chunks with 3 series each
+    assert len(memory.series) == 9
+    assert memory.series[0]["points"] == [(0, 60), (1, 60)]
+
+
+def test_bulk_ndjson(client, config):
+    # ensure NDJSON streams are accepted, reporting invalid rows
+    configure(config)
+    body = "\n".join(
+        [
+            json.dumps({"timestamp": 1, "bpm": 60, "min": 80, "max": 120}),
+            "not json",
+            json.dumps({"timestamp": 2, "bpm": 60}),
+            json.dumps({"timestamp": 3, "bpm": 60, "min": 80, "max": 120}),
+        ]
+    )
+
+    resp = client.post(
+        url_for("bulk"),
+        headers=[("Authorization", "Bearer good_token")],
+        data=body,
+        content_type="application/x-ndjson",
+    )
+    data = json.loads(resp.data)
+    memory = get_dispatcher(config).exporters[0].exporter
+
+    assert resp.status_code == 400
+    assert data["accepted"] == 2
+    assert data["rejected"] == 2
+    assert data["errors"] == [
+        {"row": 2, "error": "Malformed JSON"},
+        {"row": 3, "error": "Missing mandatory fields: ['min', 'max']"},
+    ]
+    assert memory.series[0]["points"] == [(1, 60), (3, 60)]
+
+
+def test_bulk_errors_limit(client, config, monkeypatch):
+    # ensure the number of reported errors is bounded
+    monkeypatch.setattr(bulk_module, "MAX_ERRORS", 2)
+    configure(config)
+
+    resp = client.post(
+        url_for("bulk"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=[{}, {}, {}],
+    )
+    data = json.loads(resp.data)
+
+    assert data["rejected"] == 3
+    assert len(data["errors"]) == 2
+
+
+def test_bulk_export_failure(client, config, monkeypatch):
+    # ensure failed submissions are reported
+    configure(config)
+    config.export_retries = 0
+    memory = get_dispatcher(config).exporters[0].exporter
+    monkeypatch.setattr(memory, "send_many", lambda series: [False] * len(series))
+
+    resp = client.post(
+        url_for("bulk"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=[{"timestamp": 1, "bpm": 60, "min": 80, "max": 120}],
+    )
+    data = json.loads(resp.data)
+
+    assert resp.status_code == 503
+    assert data["failed"] == 1
@@ -1,7 +1,12 @@
 import json
+import hev
+import datadog
 
 from flask import url_for
+from hev import worker
 from hev.api import DatadogAPI
+from hev.exporters import get_dispatcher
+from hev.responses import TEXTS
 
 
 def test_webhook_only_post(client):
@@ -56,7 +61,7 @@ def test_webhook_success(client, config):
     config.function_name = "test_config"
     config.bearer_token = "good_token"
     config.dry_run = True
-    payload = {"queryResult": {"parameters": {"bpm": 1, "min": 2, "max": 3}}}
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
     resp = client.post(
         url_for("webhook"),
         headers=[("Authorization", "Bearer good_token")],
@@ -88,15 +93,15 @@ def test_webhook_failure_bpm(client, config, monkeypatch):
     # ensure the Cloud Function returns a Service Unavailable if Datadog
     # dependency doesn't work because of some backend issues
     def mock_response(*args, **kwargs):
-        return False
+        return [False, True, True]
 
-    monkeypatch.setattr(DatadogAPI, "send_bpm", mock_response)
+    monkeypatch.setattr(DatadogAPI, "send_many", mock_response)
 
     config.dd_api_key = "api_key"
     config.function_name = "test_config"
     config.bearer_token = "good_token"
     config.dry_run = True
-    payload = {"queryResult": {"parameters": {"bpm": 1, "min": 2, "max": 3}}}
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
 
     resp = client.post(
         url_for("webhook"),
@@ -107,3 +112,172 @@ def test_webhook_failure_bpm(client, config, monkeypatch):
 
     assert data["message"] == "Failed"
     assert resp.status_code == 503
+
+
+def test_webhook_single_submission(client, config, monkeypatch):
+    # ensure the Cloud Function sends all HEV parameters with one
+    # Datadog submission
+    calls = []
+
+    def mock_send(*args, **kwargs):
+        calls.append(kwargs)
+        return {"status": "ok"}
+
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    monkeypatch.setattr(datadog.api.Metric, "send", mock_send)
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+
+    assert resp.status_code == 201
+    assert len(calls) == 1
+    assert len(calls[0]["metrics"]) == 3
+
+
+def test_webhook_initialize_once(client, config, monkeypatch):
+    # ensure Datadog is initialized only once across many invocations
+    calls = []
+    initialize = datadog.initialize
+
+    def mock_initialize(*args, **kwargs):
+        calls.append(kwargs)
+        return initialize(*args, **kwargs)
+
+    monkeypatch.setattr(datadog, "initialize", mock_initialize)
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    for _ in range(10):
+        resp = client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer good_token")],
+            json=payload,
+        )
+        assert resp.status_code == 201
+
+    assert len(calls) == 1
+
+
+def test_webhook_async_export(client, config, monkeypatch):
+    # ensure the Cloud Function replies before the Datadog submission
+    # when the asynchronous export is enabled
+    calls = []
+
+    def mock_send(*args, **kwargs):
+        calls.append(kwargs)
+        return {"status": "ok"}
+
+    monkeypatch.setattr(datadog.api.Metric, "send", mock_send)
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.async_export = True
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+    data = json.loads(resp.data)
+    worker.shutdown()
+
+    assert data["message"] == "Accepted"
+    assert resp.status_code == 202
+    assert len(calls) == 1
+    assert len(calls[0]["metrics"]) == 3
+
+
+def test_webhook_async_export_rejected(client, config, monkeypatch):
+    # ensure the Cloud Function fails when the queue doesn't accept data
+    monkeypatch.setattr(worker.ExportQueue, "put", lambda *args: False)
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.async_export = True
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+    data = json.loads(resp.data)
+    worker.shutdown()
+
+    assert data["message"] == "Failed"
+    assert resp.status_code == 503
+
+
+def test_webhook_multiple_exporters(client, config, tmpdir):
+    # ensure the Cloud Function sends HEV parameters to all exporters
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    config.exporters = ["datadog", "jsonl", "memory"]
+    config.jsonl_path = str(tmpdir.join("hev.jsonl"))
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+    memory = get_dispatcher(config).exporters[2].exporter
+
+    assert resp.status_code == 201
+    assert [s["points"][0][1] for s in memory.series] == [60, 80, 120]
+    assert len(tmpdir.join("hev.jsonl").readlines()) == 3
+
+
+def test_webhook_partial_failure(client, config, monkeypatch):
+    # ensure failed exporters are reported in the response
+    def mock_response(*args, **kwargs):
+        return [False, False, False]
+
+    monkeypatch.setattr(DatadogAPI, "send_many", mock_response)
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["datadog", "memory"]
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+    data = json.loads(resp.data)
+
+    assert resp.status_code == 503
+    assert data == {
+        "message": "Failed",
+        "exporters": ["datadog"],
+        "fulfillmentText": TEXTS["en"]["failed"],
+    }
+    assert len(get_dispatcher(config).exporters[1].exporter.series) == 3
+
+
+def test_webhook_invalid_environment(client, monkeypatch):
+    # ensure a configuration that can't be loaded is a configuration error
+    monkeypatch.delattr(hev, "conf", raising=False)
+    monkeypatch.setenv("EXPORT_RETRIES", "many")
+
+    for resp in (
+        client.post(url_for("webhook")),
+        client.post(url_for("bulk")),
+        client.get(url_for("readings")),
+    ):
+        assert resp.status_code == 500
+        assert json.loads(resp.data)["message"] == "Configuration error"
+    assert "conf" not in vars(hev)
@@ -1,7 +1,18 @@
 import os
+import json
+import logging
 import pytest
 
-from hev.config import Config
+import hev
+
+from hev.config import (
+    Config,
+    ConfigSnapshot,
+    ConfigWatcher,
+    load_config,
+    read_secrets,
+    reload_config,
+)
 from hev.exceptions import ConfigException
 
 
@@ -12,7 +23,37 @@ def test_config_init():
     assert config.dd_api_key is None
     assert config.function_name is None
     assert config.bearer_token is None
+    assert config.max_body_size == 262144
     assert config.dry_run is False
+    assert config.async_export is False
+    assert config.queue_size == 1000
+    assert config.queue_policy == "drop-oldest"
+    assert config.exporters == ["datadog"]
+    assert config.jsonl_path == "/tmp/hev.jsonl"
+    assert config.export_timeout == 10.0
+    assert config.export_retries == 2
+    assert config.export_deadline is None
+    assert config.retry_backoff == 0.1
+    assert config.breaker_threshold == 5
+    assert config.breaker_reset == 30.0
+    assert config.dd_api_host is None
+    assert config.spool_path is None
+    assert config.spool_max_points == 100000
+    assert config.aggregation_window is None
+    assert config.anomaly_policy is None
+    assert config.anomaly_window == 60
+    assert config.anomaly_threshold == 3.5
+    assert config.dd_transport == "http"
+    assert config.dd_agent_host == "127.0.0.1"
+    assert config.dd_dogstatsd_port == 8125
+    assert config.dd_rate_limit is None
+    assert config.dd_rate_burst == 10
+    assert config.server_bind == "0.0.0.0:8080"
+    assert config.server_workers == 2
+    assert config.server_graceful_timeout == 30.0
+    assert config.server_drain_delay == 5.0
+    assert config.store_path == "/tmp/hev-store"
+    assert config.store_capacity == 525600
 
 
 def test_mandatory_attributes():
@@ -31,11 +72,29 @@ def test_config_init_with_envs(monkeypatch):
     monkeypatch.setitem(os.environ, "FUNCTION_NAME", "test_config")
     monkeypatch.setitem(os.environ, "BEARER_TOKEN", "bearer_token")
     monkeypatch.setitem(os.environ, "DRY_RUN", "True")
+    monkeypatch.setitem(os.environ, "ASYNC_EXPORT", "True")
+    monkeypatch.setitem(os.environ, "QUEUE_SIZE", "10")
+    monkeypatch.setitem(os.environ, "QUEUE_POLICY", "reject")
+    monkeypatch.setitem(os.environ, "EXPORTERS", "datadog, jsonl")
+    monkeypatch.setitem(os.environ, "JSONL_PATH", "/tmp/test.jsonl")
+    monkeypatch.setitem(os.environ, "EXPORT_TIMEOUT", "2.5")
+    monkeypatch.setitem(os.environ, "EXPORT_RETRIES", "4")
+    monkeypatch.setitem(os.environ, "EXPORT_DEADLINE", "5")
+    monkeypatch.setitem(os.environ, "DD_API_HOST", "http://localhost:8080")
     config = Config()
     assert config.dd_api_key == "api_key"
     assert config.function_name == "test_config"
     assert config.bearer_token == "bearer_token"
     assert config.dry_run is True
+    assert config.async_export is True
+    assert config.queue_size == 10
+    assert config.queue_policy == "reject"
+    assert config.exporters == ["datadog", "jsonl"]
+    assert config.jsonl_path == "/tmp/test.jsonl"
+    assert config.export_timeout == 2.5
+    assert config.export_retries == 4
+    assert config.export_deadline == 5.0
+    assert config.dd_api_host == "http://localhost:8080"
 
 
 def test_config_validate_exception():
@@ -44,3 +103,178 @@ def test_config_validate_exception():
 
     with pytest.raises(ConfigException):
         config.validate()
+
+
+def test_config_validate_queue_policy():
+    # ensure an unknown queue policy doesn't pass Config validation
+    config = Config()
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "bearer_token"
+    config.queue_policy = "unknown"
+
+    with pytest.raises(ConfigException):
+        config.validate()
+
+
+def test_config_validate_exporters():
+    # ensure an unknown exporter doesn't pass Config validation
+    config = Config()
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "bearer_token"
+    config.exporters = ["datadog", "unknown"]
+
+    with pytest.raises(ConfigException):
+        config.validate()
+
+
+def test_config_validate_transport():
+    # ensure an unknown Datadog transport doesn't pass Config validation
+    config = Config()
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "bearer_token"
+    config.dd_transport = "unknown"
+
+    with pytest.raises(ConfigException):
+        config.validate()
+
+
+def test_config_validate_rate_limit():
+    # ensure a rate limit that can't refill tokens doesn't pass Config validation
+    config = Config()
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "bearer_token"
+    config.dd_rate_limit = 0.0
+
+    with pytest.raises(ConfigException):
+        config.validate()
+
+    config.dd_rate_limit = 1.0
+    config.dd_rate_burst = 0
+    with pytest.raises(ConfigException):
+        config.validate()
+
+
+def test_config_validate_anomaly():
+    # ensure anomaly settings that can't detect outliers don't pass validation
+    config = Config()
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "bearer_token"
+    config.anomaly_window = 5
+
+    with pytest.raises(ConfigException):
+        config.validate()
+
+    config.anomaly_window = 10
+    config.anomaly_threshold = 0
+    with pytest.raises(ConfigException):
+        config.validate()
+
+    config.anomaly_threshold = 3.5
+    assert config.validate() is None
+
+
+ENVIRON = {"DD_API_KEY": "api_key", "FUNCTION_NAME": "test", "BEARER_TOKEN": "token"}
+
+
+def test_config_snapshot():
+    # ensure snapshots are validated copies that can't be changed
+    snapshot = Config(dict(ENVIRON, EXPORTERS="datadog,jsonl")).snapshot()
+    assert isinstance(snapshot, ConfigSnapshot)
+    assert snapshot.dd_api_key == "api_key"
+    assert snapshot.exporters == ("datadog", "jsonl")
+    assert snapshot.validate() is None
+
+    with pytest.raises(AttributeError):
+        snapshot.dd_api_key = "other"
+    with pytest.raises(AttributeError):
+        snapshot.unknown = True
+
+
+def test_config_snapshot_invalid(caplog):
+    # ensure invalid snapshots are validated only once
+    snapshot = Config({}).snapshot()
+    errors = len(caplog.records)
+    for _ in range(2):
+        with pytest.raises(ConfigException):
+            snapshot.validate()
+    assert len(caplog.records) == errors
+
+
+def test_read_secrets(tmpdir):
+    # ensure secrets are read from env files, JSON files and directories
+    env = tmpdir.join("secrets.env")
+    env.write("# rotated daily\nDD_API_KEY=from_env_file\n\nBEARER_TOKEN = token\n")
+    assert read_secrets(str(env)) == {
+        "DD_API_KEY": "from_env_file",
+        "BEARER_TOKEN": "token",
+    }
+
+    path = tmpdir.join("secrets.json")
+    path.write(json.dumps({"DD_API_KEY": "from_json", "QUEUE_SIZE": 5}))
+    assert read_secrets(str(path)) == {"DD_API_KEY": "from_json", "QUEUE_SIZE": "5"}
+
+    volume = tmpdir.mkdir("volume")
+    volume.join("DD_API_KEY").write("from_volume\n")
+    assert read_secrets(str(volume)) == {"DD_API_KEY": "from_volume"}
+
+    with pytest.raises(ConfigException):
+        read_secrets(str(tmpdir.join("missing")))
+
+
+def test_load_config_secrets(tmpdir):
+    # ensure secrets override environment variables
+    path = tmpdir.join("secrets.env")
+    path.write("DD_API_KEY=secret_key\n")
+    conf = load_config(dict(ENVIRON, SECRETS_PATH=str(path)))
+    assert conf.dd_api_key == "secret_key"
+    assert conf.function_name == "test"
+
+    with pytest.raises(ConfigException):
+        load_config(dict(ENVIRON, QUEUE_SIZE="many"))
+
+
+def test_reload_config(config, caplog):
+    # ensure reloads swap the global configuration, unless it's invalid
+    caplog.set_level(logging.INFO)
+    conf = reload_config(ENVIRON)
+    assert hev.conf is conf
+    assert reload_config(ENVIRON) is conf
+
+    rotated = reload_config(dict(ENVIRON, DD_API_KEY="rotated"))
+    assert hev.conf is rotated
+    assert rotated.dd_api_key == "rotated"
+    assert "changed: dd_api_key" in caplog.text
+    assert conf.dd_api_key == "api_key"
+
+    assert reload_config(dict(ENVIRON, DD_TRANSPORT="unknown")) is None
+    assert hev.conf is rotated
+
+
+def test_config_watcher(tmpdir):
+    # ensure secrets changes trigger a reload
+    path = tmpdir.join("secrets.env")
+    path.write("DD_API_KEY=first\n")
+    reloads = []
+    watcher = ConfigWatcher(str(path), reload=lambda: reloads.append(True))
+    assert watcher.check() is False
+
+    path.write("DD_API_KEY=second\n")
+    os.utime(str(path), ns=(0, os.stat(str(path)).st_mtime_ns + 10**9))
+    assert watcher.check() is True
+    assert watcher.check() is False
+    assert reloads == [True]
+
+
+def test_webhook_config_snapshot(client, config):
+    # ensure requests are served with a configuration snapshot
+    hev.conf = load_config(dict(ENVIRON, DRY_RUN="true"))
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+    resp = client.post(
+        "/webhook", headers=[("Authorization", "Bearer token")], json=payload
+    )
+    assert resp.status_code == 201
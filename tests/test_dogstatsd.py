@@ -0,0 +1,126 @@
+import socket
+import pytest
+
+from flask import url_for
+
+from hev.api import DatadogAPI, DogStatsdTransport
+from hev.constants import KIND_DIASTOLIC, KIND_SYSTOLIC
+from hev.exporters import Exporter
+
+
+@pytest.fixture
+def listener():
+    """Fixture: local UDP socket that acts as a DogStatsD agent"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1)
+    yield sock
+    sock.close()
+
+
+def receive(sock):
+    """Return all datagrams received by the listener"""
+    packets = []
+    sock.settimeout(0.2)
+    try:
+        while True:
+            packets.append(sock.recv(65535).decode())
+    except socket.timeout:
+        pass
+    return packets
+
+
+def test_dogstatsd_send_parameters(listener):
+    # ensure HEV parameters are sent as gauges in a single datagram
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        transport="dogstatsd",
+        statsd_port=listener.getsockname()[1],
+    )
+    series = Exporter.build_parameters(60, 80, 120, 1546300800)
+    assert api.send_many(series) == [True, True, True]
+
+    packets = receive(listener)
+    assert packets == [
+        "hev.parameters.bpm:60|g|#host:test_config|T1546300800\n"
+        "hev.parameters.pressure:80|g|#{},host:test_config|T1546300800\n"
+        "hev.parameters.pressure:120|g|#{},host:test_config|T1546300800".format(
+            KIND_DIASTOLIC, KIND_SYSTOLIC
+        )
+    ]
+
+
+def test_dogstatsd_without_timestamp(listener):
+    # ensure points without a timestamp are sent as current values
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        transport="dogstatsd",
+        statsd_port=listener.getsockname()[1],
+    )
+    assert api.send_pressure(80, KIND_DIASTOLIC) is True
+    assert api.send_bpm(60) is True
+
+    assert receive(listener) == [
+        "hev.parameters.pressure:80|g|#min,host:test_config",
+        "hev.parameters.bpm:60|g|#host:test_config",
+    ]
+
+
+def test_dogstatsd_packet_size(listener):
+    # ensure metrics are split in datagrams that fit the maximum size
+    transport = DogStatsdTransport("127.0.0.1", listener.getsockname()[1], 200)
+    metrics = [
+        {"metric": "hev.parameters.bpm", "points": [(1546300800 + i, 60)]}
+        for i in range(20)
+    ]
+    assert transport.submit(metrics) is True
+
+    packets = receive(listener)
+    lines = [line for packet in packets for line in packet.split("\n")]
+    assert len(packets) == 4
+    assert all(len(packet) <= 200 for packet in packets)
+    assert len(lines) == 20
+    transport.close()
+
+
+def test_dogstatsd_dry_run(listener):
+    # ensure nothing is sent in dry-run mode
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        dry_run=True,
+        transport="dogstatsd",
+        statsd_port=listener.getsockname()[1],
+    )
+    assert api.send_parameters(60, 80, 120) == [True, True, True]
+    assert receive(listener) == []
+
+
+def test_dogstatsd_unreachable(caplog):
+    # ensure socket errors are reported as failed submissions
+    transport = DogStatsdTransport("256.0.0.1", 8125)
+    assert transport.submit([{"metric": "hev.parameters.bpm", "points": 60}]) is False
+    assert "Unable to reach DogStatsD" in caplog.text
+
+
+def test_webhook_dogstatsd(client, config, listener):
+    # ensure the Cloud Function sends HEV parameters through DogStatsD
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dd_transport = "dogstatsd"
+    config.dd_dogstatsd_port = listener.getsockname()[1]
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+
+    assert resp.status_code == 201
+    packets = receive(listener)
+    assert len(packets) == 1
+    assert packets[0].count("\n") == 2
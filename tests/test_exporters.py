@@ -0,0 +1,140 @@
+import json
+import time
+import pytest
+
+from hev.api import DatadogAPI
+from hev.exporters import (
+    Dispatcher,
+    Exporter,
+    JSONLExporter,
+    MemoryExporter,
+    get_dispatcher,
+    reset_dispatcher,
+)
+
+
+class SlowExporter(Exporter):
+    """Exporter that sleeps before accepting series"""
+
+    def __init__(self, name, delay, timeout=None):
+        self.name = name
+        self.delay = delay
+        self.timeout = timeout
+
+    def send_many(self, series):
+        time.sleep(self.delay)
+        return [True] * len(series)
+
+
+class BrokenExporter(Exporter):
+    """Exporter that always raises"""
+
+    name = "broken"
+
+    def send_many(self, series):
+        raise RuntimeError("boom")
+
+
+def test_exporter_interface():
+    # ensure the base interface must be implemented
+    with pytest.raises(NotImplementedError):
+        Exporter().send_parameters(1, 2, 3)
+
+
+def test_datadog_is_exporter():
+    # ensure Datadog API honors the exporter interface
+    assert issubclass(DatadogAPI, Exporter)
+    assert DatadogAPI.name == "datadog"
+
+
+def test_memory_exporter():
+    # ensure the in-memory exporter stores received series
+    exporter = MemoryExporter()
+    assert exporter.send_parameters(1, 2, 3) == [True, True, True]
+    assert exporter.series == Exporter.build_parameters(1, 2, 3)
+    exporter.clear()
+    assert exporter.series == []
+
+
+def test_jsonl_exporter(tmpdir):
+    # ensure the JSONL exporter appends a line for each series
+    path = str(tmpdir.join("hev.jsonl"))
+    exporter = JSONLExporter(path, "test_config")
+    assert exporter.send_parameters(1, 2, 3) == [True, True, True]
+    assert exporter.send_parameters(4, 5, 6) == [True, True, True]
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 6
+    assert lines[0]["metric"] == "hev.parameters.bpm"
+    assert lines[0]["host"] == "test_config"
+    assert lines[2]["tags"] == ["max"]
+    assert lines[5]["points"] == 6
+    assert "timestamp" in lines[0]
+
+
+def test_jsonl_exporter_failure(tmpdir):
+    # ensure write errors are reported as failed series
+    exporter = JSONLExporter(str(tmpdir.join("missing", "hev.jsonl")))
+    assert exporter.send_parameters(1, 2, 3) == [False, False, False]
+
+
+def test_dispatcher_fan_out():
+    # ensure all exporters receive the same series
+    first, second = MemoryExporter(), MemoryExporter()
+    second.name = "other"
+    dispatcher = Dispatcher([first, second])
+    report = dispatcher.dispatch(dispatcher.build_parameters(1, 2, 3))
+
+    assert report == {"memory": [True] * 3, "other": [True] * 3}
+    assert first.series == second.series
+
+
+def test_dispatcher_concurrent():
+    # ensure the total latency is bounded by the slowest exporter
+    exporters = [SlowExporter("slow_{}".format(i), 0.2) for i in range(4)]
+    dispatcher = Dispatcher(exporters)
+    start = time.monotonic()
+    assert dispatcher.send_parameters(1, 2, 3) == [True, True, True]
+
+    assert time.monotonic() - start < 0.6
+
+
+def test_dispatcher_timeout(caplog):
+    # ensure a slow exporter is reported as failed after its own timeout
+    fast = SlowExporter("fast", 0)
+    slow = SlowExporter("slow", 0.5, timeout=0.05)
+    dispatcher = Dispatcher([fast, slow], timeout=5)
+    start = time.monotonic()
+    report = dispatcher.dispatch([{"metric": "a", "points": 1}])
+
+    assert time.monotonic() - start < 0.4
+    assert report == {"fast": [True], "slow": [False]}
+    assert "Exporter 'slow' timed out" in caplog.text
+
+
+def test_dispatcher_partial_failure():
+    # ensure an exporter error doesn't affect other exporters
+    memory = MemoryExporter()
+    dispatcher = Dispatcher([memory, BrokenExporter()])
+    report = dispatcher.dispatch([{"metric": "a", "points": 1}])
+
+    assert report == {"memory": [True], "broken": [False]}
+    assert dispatcher.send_many([{"metric": "a", "points": 1}]) == [False]
+    assert len(memory.series) == 2
+
+
+def test_get_dispatcher(config, tmpdir):
+    # ensure the dispatcher is built from the configuration and cached
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.exporters = ["datadog", "jsonl", "memory"]
+    config.jsonl_path = str(tmpdir.join("hev.jsonl"))
+    dispatcher = get_dispatcher(config)
+
+    assert get_dispatcher(config) is dispatcher
+    assert [e.name for e in dispatcher.exporters] == ["datadog", "jsonl", "memory"]
+
+    config.exporters = ["memory"]
+    assert get_dispatcher(config) is not dispatcher
+    reset_dispatcher()
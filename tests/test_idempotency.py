@@ -0,0 +1,194 @@
+import json
+import pytest
+
+from flask import url_for
+
+from hev.exporters import get_dispatcher
+from hev.idempotency import (
+    IN_PROGRESS,
+    Idempotency,
+    MemoryStore,
+    get_idempotency,
+    request_key,
+)
+from hev.responses import TEXTS
+
+
+class FakeClock(object):
+    """Clock that moves only when asked"""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+PAYLOAD = {
+    "responseId": "response-1",
+    "session": "projects/hev/agent/sessions/1",
+    "queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}},
+}
+
+
+def test_memory_store_ttl():
+    # ensure entries expire after their TTL
+    clock = FakeClock()
+    store = MemoryStore(clock=clock)
+    store.set("key", "value", 10)
+    assert store.get("key") == "value"
+    clock.now = 10
+    assert store.get("key") is None
+    assert len(store) == 0
+
+
+def test_memory_store_lru():
+    # ensure the least recently used entry is evicted first
+    store = MemoryStore(max_entries=2)
+    store.set("a", 1, 10)
+    store.set("b", 2, 10)
+    store.get("a")
+    store.set("c", 3, 10)
+    assert store.get("a") == 1
+    assert store.get("b") is None
+    assert store.get("c") == 3
+    assert len(store) == 2
+
+
+def test_memory_store_add():
+    # ensure values are added only if the key is missing or expired
+    clock = FakeClock()
+    store = MemoryStore(clock=clock)
+    assert store.add("key", 1, 10) is True
+    assert store.add("key", 2, 10) is False
+    clock.now = 10
+    assert store.add("key", 3, 10) is True
+    assert store.get("key") == 3
+
+
+def test_request_key():
+    # ensure DialogFlow ids are used, or the content hash when missing
+    assert request_key(PAYLOAD) == "dialogflow:projects/hev/agent/sessions/1:response-1"
+
+    content = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+    reordered = {"queryResult": {"parameters": {"max": 120, "min": 80, "bpm": 60}}}
+    assert request_key(content).startswith("sha256:")
+    assert request_key(content) == request_key(reordered)
+    assert request_key(content) != request_key(
+        {"queryResult": {"parameters": {"bpm": 61, "min": 80, "max": 120}}}
+    )
+
+
+def test_idempotency_success():
+    # ensure successful responses are returned without executing retries
+    calls = []
+
+    def handler():
+        calls.append(1)
+        return ("created", 201)
+
+    idempotency = Idempotency(MemoryStore(), ttl=60)
+    assert idempotency.run("key", handler) == ("created", 201)
+    assert idempotency.run("key", handler) == ("created", 201)
+    assert len(calls) == 1
+
+
+def test_idempotency_failure():
+    # ensure failed requests are executed again when retried
+    responses = [("failed", 503), ("created", 201)]
+    idempotency = Idempotency(MemoryStore(), ttl=60)
+    assert idempotency.run("key", lambda: responses.pop(0)) == ("failed", 503)
+    assert idempotency.run("key", lambda: responses.pop(0)) == ("created", 201)
+
+
+def test_idempotency_exception():
+    # ensure requests that raise are forgotten
+    store = MemoryStore()
+
+    def handler():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        Idempotency(store).run("key", handler)
+    assert store.get("key") is None
+
+
+def test_idempotency_in_progress():
+    # ensure retries of a request that is being served are rejected
+    store = MemoryStore()
+    store.set("key", IN_PROGRESS, 30)
+    response, status = Idempotency(store).run("key", lambda: ("created", 201))
+    assert status == 409
+    assert json.loads(response)["message"] == "Request in progress"
+
+    # The reply is spoken in the language of the request
+    response, _ = Idempotency(store).run("key", lambda: ("created", 201), "it-IT")
+    assert json.loads(response)["fulfillmentText"] == TEXTS["it"]["in-progress"]
+
+
+def test_idempotency_disabled(config):
+    # ensure the idempotency layer is disabled by default
+    assert get_idempotency(config) is None
+    config.idempotency_ttl = 60
+    assert get_idempotency(config) is get_idempotency(config)
+
+
+def test_webhook_retry(client, config):
+    # ensure retried DialogFlow requests are exported only once
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["memory"]
+    config.idempotency_ttl = 60
+
+    responses = [
+        client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer good_token")],
+            json=PAYLOAD,
+        )
+        for _ in range(3)
+    ]
+    memory = get_dispatcher(config).exporters[0].exporter
+
+    assert [resp.status_code for resp in responses] == [201, 201, 201]
+    assert len({resp.data for resp in responses}) == 1
+    assert len(memory.series) == 3
+
+
+def test_webhook_new_request(client, config):
+    # ensure different DialogFlow requests are all exported
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["memory"]
+    config.idempotency_ttl = 60
+
+    for response_id in ("response-1", "response-2"):
+        resp = client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer good_token")],
+            json=dict(PAYLOAD, responseId=response_id),
+        )
+        assert resp.status_code == 201
+
+    memory = get_dispatcher(config).exporters[0].exporter
+    assert len(memory.series) == 6
+
+
+def test_webhook_shared_store(client, config, shared_store):
+    # ensure served requests are remembered in the configured store
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    config.idempotency_ttl = 60
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=PAYLOAD,
+    )
+
+    assert resp.status_code == 201
+    assert shared_store.get(request_key(PAYLOAD)) == [resp.data.decode(), 201]
@@ -0,0 +1,138 @@
+import io
+import json
+import pytest
+
+from hev.exceptions import BadRequest
+from hev.ingest import (
+    batched,
+    build_series,
+    iter_csv,
+    iter_json_array,
+    iter_ndjson,
+    validate_reading,
+)
+
+
+def stream(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+
+def test_iter_ndjson():
+    # ensure each line is parsed, reporting malformed ones
+    rows = list(iter_ndjson(stream('{"a": 1}\n\nnot json\n{"b": 2}'), chunk_size=3))
+
+    assert rows == [
+        (1, {"a": 1}, None),
+        (3, None, "Malformed JSON"),
+        (4, {"b": 2}, None),
+    ]
+
+
+def test_iter_ndjson_line_size(monkeypatch):
+    # ensure oversized lines are reported and skipped without buffering them
+    monkeypatch.setattr("hev.ingest.MAX_ITEM_SIZE", 10)
+    text = '{"a": 1}\n' + "x" * 50 + '\n{"b": 2}\n' + "y" * 50
+    rows = list(iter_ndjson(stream(text), chunk_size=4))
+
+    assert rows == [
+        (1, {"a": 1}, None),
+        (2, None, "Line too large"),
+        (3, {"b": 2}, None),
+        (4, None, "Line too large"),
+    ]
+
+    rows = list(iter_ndjson(stream(text), chunk_size=100))
+    assert [row for row, _, _ in rows] == [1, 2, 3, 4]
+    assert rows[1] == (2, None, "Line too large")
+
+
+def test_iter_json_array():
+    # ensure array items are parsed across chunk boundaries
+    items = [{"timestamp": i, "bpm": 123456} for i in range(50)]
+    rows = list(iter_json_array(stream(json.dumps(items)), chunk_size=7))
+
+    assert [data for _, data, _ in rows] == items
+    assert [row for row, _, _ in rows] == list(range(1, 51))
+
+
+def test_iter_json_array_numbers():
+    # ensure numbers split across chunks are not truncated
+    rows = list(iter_json_array(stream("[12345, 67890]"), chunk_size=3))
+
+    assert [data for _, data, _ in rows] == [12345, 67890]
+
+
+def test_iter_json_array_empty():
+    # ensure an empty array has no rows
+    assert list(iter_json_array(stream(" [ ] "))) == []
+
+
+def test_iter_json_array_not_array():
+    # ensure a document that is not an array is reported
+    assert list(iter_json_array(stream('{"a": 1}'))) == [
+        (1, None, "Expected a JSON array")
+    ]
+
+
+def test_iter_json_array_malformed():
+    # ensure parsing stops at the first malformed item
+    rows = list(iter_json_array(stream('[{"a": 1}, {"a": oops}, {"a": 3}]')))
+
+    assert rows == [(1, {"a": 1}, None), (2, None, "Malformed JSON")]
+
+
+def test_iter_json_array_unterminated():
+    # ensure a truncated array is reported
+    rows = list(iter_json_array(stream('[{"a": 1}, ')))
+
+    assert rows == [(1, {"a": 1}, None), (2, None, "Unterminated JSON array")]
+
+
+def test_validate_reading():
+    # ensure a valid reading is converted in a tuple
+    data = {"timestamp": 10, "bpm": 60, "min": 80, "max": 120.5}
+    assert validate_reading(data) == (10, 60, 80, 120.5)
+
+
+def test_validate_reading_missing():
+    # ensure mandatory fields are checked
+    with pytest.raises(BadRequest) as e:
+        validate_reading({"bpm": 60})
+    assert str(e.value) == "Missing mandatory fields: ['timestamp', 'min', 'max']"
+
+
+def test_validate_reading_types():
+    # ensure fields must be numbers
+    with pytest.raises(BadRequest):
+        validate_reading({"timestamp": 10, "bpm": "60", "min": 80, "max": 120})
+    with pytest.raises(BadRequest):
+        validate_reading({"timestamp": 10, "bpm": True, "min": 80, "max": 120})
+    with pytest.raises(BadRequest):
+        validate_reading([10, 60, 80, 120])
+
+
+def test_batched():
+    # ensure items are grouped in batches
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_build_series():
+    # ensure readings are converted in multi-point series
+    series = build_series([(1, 60, 80, 120), (2, 61, 81, 121)])
+
+    assert series[0] == {"metric": "hev.parameters.bpm", "points": [(1, 60), (2, 61)]}
+    assert series[1]["points"] == [(1, 80), (2, 81)]
+    assert series[1]["tags"] == ["min"]
+    assert series[2]["points"] == [(1, 120), (2, 121)]
+    assert series[2]["tags"] == ["max"]
+
+
+def test_iter_csv():
+    # ensure CSV rows are parsed and numbers are converted
+    text = "timestamp,bpm,min,max\n1,60,80,120\n2,,80,abc\n"
+    rows = list(iter_csv(stream(text)))
+
+    assert rows == [
+        (1, {"timestamp": 1.0, "bpm": 60.0, "min": 80.0, "max": 120.0}, None),
+        (2, {"timestamp": 2.0, "bpm": None, "min": 80.0, "max": "abc"}, None),
+    ]
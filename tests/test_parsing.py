@@ -0,0 +1,137 @@
+import io
+import json
+import pytest
+
+from flask import request, url_for
+
+from benchmarks.bench_parse import dialogflow_payload, run
+from hev import parsing
+from hev.asgi import Request
+from hev.exceptions import BadRequest, RequestTooLarge
+from hev.parsing import is_json, loads, parse_request, read_body
+
+PAYLOAD = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+
+class UnreadableStream(object):
+    """Stream that must never be read"""
+
+    def read(self, size=-1):
+        raise AssertionError("The body must not be read")
+
+
+def asgi_request(body, headers=None):
+    headers = [(b"content-type", b"application/json")] + (headers or [])
+    return Request({"method": "POST", "path": "/", "headers": headers}, body)
+
+
+def test_loads_backends(monkeypatch):
+    # ensure the stdlib parser is used when the fast one is not installed
+    data = json.dumps(PAYLOAD).encode()
+    assert loads(data) == PAYLOAD
+    monkeypatch.setattr(parsing, "orjson", None)
+    assert loads(data) == PAYLOAD
+    with pytest.raises(ValueError):
+        loads(b"not_json")
+
+
+def test_is_json():
+    # ensure JSON bodies are recognized by their mimetype
+    assert is_json("application/json") is True
+    assert is_json("application/vnd.api+json") is True
+    assert is_json("text/plain") is False
+
+
+def test_parse_flask_request(app):
+    # ensure a Flask request body is parsed
+    with app.test_request_context(json=PAYLOAD):
+        assert parse_request(request) == PAYLOAD
+
+
+def test_parse_not_json(app):
+    # ensure bodies that are not JSON are ignored
+    with app.test_request_context(data="some_value"):
+        assert parse_request(request) is None
+    with app.test_request_context(data="not_json", content_type="application/json"):
+        assert parse_request(request) is None
+
+
+def test_reject_content_length(app):
+    # ensure a large Content-Length is rejected before reading the body
+    with app.test_request_context(json=PAYLOAD):
+        request.environ["wsgi.input"] = UnreadableStream()
+        with pytest.raises(RequestTooLarge) as e:
+            parse_request(request, max_size=10)
+        assert e.value.max_size == 10
+        assert e.value.size == len(json.dumps(PAYLOAD))
+
+
+def test_reject_invalid_content_length():
+    # ensure an invalid Content-Length is a bad request
+    body = json.dumps(PAYLOAD).encode()
+    with pytest.raises(BadRequest):
+        read_body(asgi_request(body, [(b"content-length", b"many")]))
+
+
+def test_reject_chunked_body(app):
+    # ensure a body without Content-Length is read only up to the limit
+    body = json.dumps(dialogflow_payload(padding=10000)).encode()
+    stream = io.BytesIO(body)
+    environ = {"wsgi.input": stream, "wsgi.input_terminated": True}
+    with app.test_request_context(
+        method="POST", content_type="application/json", environ_overrides=environ
+    ):
+        assert request.headers.get("Content-Length") is None
+        with pytest.raises(RequestTooLarge):
+            parse_request(request, max_size=1000)
+        assert stream.tell() <= 1001
+
+    with app.test_request_context(
+        method="POST",
+        content_type="application/json",
+        environ_overrides={
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.input_terminated": True,
+        },
+    ):
+        assert parse_request(request, max_size=len(body)) == json.loads(body)
+
+
+def test_parse_asgi_request():
+    # ensure ASGI requests are parsed from their buffered body
+    body = json.dumps(PAYLOAD).encode()
+    assert parse_request(asgi_request(body)) == PAYLOAD
+    with pytest.raises(RequestTooLarge):
+        parse_request(asgi_request(body), max_size=10)
+
+
+def test_webhook_too_large(client, config):
+    # ensure the Cloud Function replies 413 to large requests
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    config.max_body_size = 4096
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=dialogflow_payload(padding=4096),
+    )
+    assert resp.status_code == 413
+    assert json.loads(resp.data)["message"] == "Request Too Large"
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=dialogflow_payload(),
+    )
+    assert resp.status_code == 201
+
+
+def test_bench_parse():
+    # ensure the benchmark parses realistic payloads and rejects oversized ones
+    realistic, oversized = run(number=2, oversized_mb=0.5)
+    assert all(r["parsed"] for r in realistic["results"])
+    assert [r["parsed"] for r in oversized["results"]][:2] == [True, False]
+    assert oversized["bytes"] > parsing.MAX_BODY_SIZE
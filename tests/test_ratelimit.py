@@ -0,0 +1,225 @@
+import threading
+
+from hev.api import DatadogAPI, watch_rate_limits
+from hev.exporters import Exporter, get_dispatcher
+from hev.ratelimit import RateLimitedExporter, RateLimiter, merge_series
+from hev.resilience import ResilientExporter, RetryPolicy
+
+
+class Clock(object):
+    """Manual clock that advances when the limiter sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class BlockingExporter(Exporter):
+    """Exporter that blocks its first submission until released"""
+
+    name = "blocking"
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def send_many(self, series):
+        self.calls.append(list(series))
+        self.started.set()
+        self.release.wait(5)
+        return [True] * len(series)
+
+
+def test_token_bucket():
+    # ensure submissions over the burst wait for tokens at the given rate
+    clock = Clock()
+    limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+    assert limiter.acquire() is True
+    assert limiter.acquire() is True
+    assert clock.now == 0
+    assert limiter.acquire() is True
+    assert clock.now == 0.5
+    assert limiter.acquire(timeout=0.1) is False
+
+    stats = limiter.stats()
+    assert stats["waits"] == 1
+    assert stats["waited"] == 0.5
+
+
+def test_unlimited():
+    # ensure a limiter without a rate never waits
+    clock = Clock()
+    limiter = RateLimiter(burst=1, clock=clock, sleep=clock.sleep)
+
+    for _ in range(100):
+        assert limiter.acquire() is True
+    assert clock.now == 0
+
+
+def test_observe_headers():
+    # ensure the limiter adapts to the rate limit headers
+    clock = Clock()
+    limiter = RateLimiter(burst=10, clock=clock, sleep=clock.sleep)
+    headers = {
+        "X-RateLimit-Limit": "5",
+        "X-RateLimit-Period": "10",
+        "X-RateLimit-Remaining": "1",
+        "X-RateLimit-Reset": "4",
+    }
+
+    limiter.observe(202, headers)
+    stats = limiter.stats()
+    assert stats["rate"] == 0.5
+    assert stats["burst"] == 5
+    assert stats["tokens"] == 1
+
+    assert limiter.acquire() is True
+    assert limiter.acquire() is True
+    assert clock.now == 2
+
+
+def test_observe_throttled():
+    # ensure a 429 reply pauses submissions until the quota is reset
+    clock = Clock()
+    limiter = RateLimiter(rate=100, clock=clock, sleep=clock.sleep)
+
+    limiter.observe(429, {"X-RateLimit-Reset": "3"})
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.stats()["paused_for"] == 3
+    assert limiter.acquire() is True
+    assert clock.now == 3
+
+    # Without headers submissions are paused for a default time
+    limiter.observe(429, {"X-RateLimit-Reset": "soon"})
+    assert limiter.stats()["paused_for"] == 1.0
+
+
+def test_merge_series():
+    # ensure series with the same metric, tags and host are merged
+    series = [
+        {"metric": "hev.bpm", "points": [(1, 60)], "tags": ["a"]},
+        {"metric": "hev.bpm", "points": [(2, 61)], "tags": ["a"]},
+        {"metric": "hev.bpm", "points": [(3, 62)], "tags": ["b"]},
+        {"metric": "hev.bpm", "points": 63, "tags": ["a"]},
+        {"metric": "hev.bpm", "points": None, "tags": ["a"]},
+    ]
+
+    merged, groups = merge_series(series)
+
+    assert groups == [0, 0, 1, 2, 3]
+    assert merged[0]["points"] == [(1, 60), (2, 61)]
+    assert merged[2] is series[3]
+    assert series[0]["points"] == [(1, 60)]
+
+
+def test_merge_waiting_submissions():
+    # ensure submissions queued behind a throttled one are sent together
+    inner = BlockingExporter()
+    exporter = RateLimitedExporter(inner, RateLimiter())
+    results = {}
+
+    def send(i):
+        series = [{"metric": "hev.bpm", "points": [(i, 60 + i)], "tags": ["a"]}]
+        results[i] = exporter.send_many(series)
+
+    first = threading.Thread(target=send, args=(0,))
+    first.start()
+    inner.started.wait(5)
+    waiting = [threading.Thread(target=send, args=(i,)) for i in range(1, 6)]
+    for thread in waiting:
+        thread.start()
+    while exporter.stats()["queued"] < 5:
+        threading.Event().wait(0.001)
+    inner.release.set()
+    for thread in [first] + waiting:
+        thread.join(5)
+
+    assert results == {i: [True] for i in range(6)}
+    assert len(inner.calls) == 2
+    assert len(inner.calls[1]) == 1
+    assert len(inner.calls[1][0]["points"]) == 5
+    stats = exporter.stats()
+    assert stats["batches"] == 2
+    assert stats["merged"] == 4
+    assert stats["queued"] == 0
+
+
+def test_wait_timeout():
+    # ensure submissions fail when the quota is not available in time
+    clock = Clock()
+    limiter = RateLimiter(rate=0.1, burst=1, clock=clock, sleep=clock.sleep)
+    exporter = RateLimitedExporter(BlockingExporter(), limiter, timeout=1)
+    exporter.exporter.release.set()
+
+    assert exporter.send_parameters(1, 2, 3) == [True, True, True]
+    assert exporter.send_parameters(1, 2, 3) == [False, False, False]
+
+
+def test_limiter_failure(caplog):
+    # ensure a failing limiter fails its batch and hands over to later requests
+    limiter = RateLimiter(rate=1, burst=1)
+    exporter = RateLimitedExporter(BlockingExporter(), limiter, timeout=1)
+    exporter.exporter.release.set()
+    limiter.acquire = lambda timeout: 1 / 0
+
+    assert exporter.send_parameters(1, 2, 3) == [False, False, False]
+    assert "Exporter 'blocking' failed" in caplog.text
+    assert exporter.stats()["queued"] == 0
+
+    del limiter.acquire
+    assert exporter.send_parameters(1, 2, 3) == [True, True, True]
+
+
+def test_datadog_quota(fake_datadog):
+    # ensure concurrent submissions respect the Datadog quota without failures
+    fake_datadog.quota = (5, 0.5)
+    limiter = RateLimiter()
+    watch_rate_limits(limiter)
+    api = DatadogAPI("api_key", "test_config", api_host=fake_datadog.url)
+    exporter = ResilientExporter(
+        RateLimitedExporter(api, limiter), RetryPolicy(retries=5, backoff=0.01)
+    )
+    results = []
+
+    def send(i):
+        results.append(exporter.send_parameters(60, 80, i))
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == [[True, True, True]] * 30
+    assert len(fake_datadog.series) == 90
+    assert fake_datadog.requests - fake_datadog.throttled < 30
+    stats = exporter.stats()
+    assert stats["rate"] == 10
+    assert stats["merged"] > 0
+
+
+def test_dispatcher_stats(config, fake_datadog):
+    # ensure the rate limiter state is exposed by the dispatcher
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.dd_rate_limit = 50.0
+    config.dd_rate_burst = 5
+    fake_datadog.quota = (100, 10)
+
+    dispatcher = get_dispatcher(config)
+    report = dispatcher.dispatch(dispatcher.build_parameters(60, 80, 120))
+
+    assert report == {"datadog": [True, True, True]}
+    stats = dispatcher.stats()["datadog"]
+    assert stats["state"] == "closed"
+    assert stats["rate"] == 10
+    assert stats["burst"] == 5
+    assert stats["batches"] == 1
+    assert stats["throttled"] == 0
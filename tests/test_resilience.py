@@ -0,0 +1,208 @@
+import json
+import time
+
+from flask import url_for
+
+from hev.api import DatadogAPI
+from hev.exporters import Exporter, get_dispatcher
+from hev.resilience import CircuitBreaker, ResilientExporter, RetryPolicy
+
+
+class FlakyExporter(Exporter):
+    """Exporter that fails a given number of times"""
+
+    name = "flaky"
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def send_many(self, series):
+        self.calls.append(list(series))
+        if self.failures > 0:
+            self.failures -= 1
+            return [False] * len(series)
+        return [True] * len(series)
+
+
+class Clock(object):
+    """Manual clock used to control the circuit breaker timeouts"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_retry_policy_delay():
+    # ensure backoff grows exponentially with jitter, bounded by max_backoff
+    policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+    for attempt in range(5):
+        assert 0 <= policy.delay(attempt) <= min(0.3, 0.1 * 2**attempt)
+
+
+def test_circuit_breaker_opens():
+    # ensure the circuit opens after the threshold is reached
+    breaker = CircuitBreaker("test", threshold=2)
+    breaker.record_failure()
+    assert breaker.allow() is True
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() is False
+    assert breaker.stats() == {
+        "state": "open",
+        "failures": 2,
+        "rejected": 1,
+        "trips": 1,
+    }
+
+
+def test_circuit_breaker_half_open():
+    # ensure the circuit allows a single probe after the reset timeout
+    clock = Clock()
+    breaker = CircuitBreaker("test", threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_probe_failure():
+    # ensure a failed probe opens the circuit again
+    clock = Clock()
+    breaker = CircuitBreaker("test", threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow() is True
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 19
+    assert breaker.allow() is False
+
+
+def test_resilient_exporter_retries():
+    # ensure only failed series are retried until they succeed
+    exporter = FlakyExporter(failures=2)
+    resilient = ResilientExporter(exporter, RetryPolicy(retries=3, backoff=0.001))
+
+    assert resilient.send_parameters(1, 2, 3) == [True, True, True]
+    assert len(exporter.calls) == 3
+    assert resilient.stats()["state"] == "closed"
+
+
+def test_resilient_exporter_retries_exhausted():
+    # ensure series fail once retries are exhausted
+    exporter = FlakyExporter(failures=10)
+    resilient = ResilientExporter(exporter, RetryPolicy(retries=2, backoff=0.001))
+
+    assert resilient.send_parameters(1, 2, 3) == [False, False, False]
+    assert len(exporter.calls) == 3
+
+
+def test_resilient_exporter_deadline():
+    # ensure no more attempts are made after the deadline
+    exporter = FlakyExporter(failures=10)
+    retry = RetryPolicy(retries=100, backoff=0.05, max_backoff=0.05, deadline=0.2)
+    resilient = ResilientExporter(exporter, retry)
+    start = time.monotonic()
+
+    assert resilient.send_parameters(1, 2, 3) == [False, False, False]
+    assert time.monotonic() - start < 0.3
+    assert len(exporter.calls) < 100
+
+
+def test_resilient_exporter_fail_fast():
+    # ensure calls are skipped while the circuit is open
+    exporter = FlakyExporter(failures=10)
+    breaker = CircuitBreaker("flaky", threshold=2)
+    resilient = ResilientExporter(exporter, RetryPolicy(retries=0), breaker)
+
+    resilient.send_parameters(1, 2, 3)
+    resilient.send_parameters(1, 2, 3)
+    assert resilient.send_parameters(1, 2, 3) == [False, False, False]
+    assert len(exporter.calls) == 2
+    assert resilient.stats()["rejected"] == 1
+
+
+def test_resilient_datadog(fake_datadog):
+    # ensure failed submissions are retried against a Datadog endpoint
+    api = DatadogAPI("api_key", "test_config", api_host=fake_datadog.url)
+    resilient = ResilientExporter(api, RetryPolicy(retries=2, backoff=0.001))
+    fake_datadog.fail_next(2)
+
+    assert resilient.send_parameters(1, 2, 3) == [True, True, True]
+    assert fake_datadog.requests == 3
+    assert len(fake_datadog.series) == 3
+    assert fake_datadog.series[0]["host"] == "test_config"
+
+
+def test_resilient_datadog_circuit_open(fake_datadog):
+    # ensure a failing Datadog endpoint opens the circuit
+    api = DatadogAPI("api_key", "test_config", api_host=fake_datadog.url)
+    breaker = CircuitBreaker("datadog", threshold=3)
+    resilient = ResilientExporter(api, RetryPolicy(retries=1, backoff=0.001), breaker)
+    fake_datadog.error_rate = 1.0
+
+    for _ in range(5):
+        assert resilient.send_parameters(1, 2, 3) == [False, False, False]
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert fake_datadog.requests == 3
+
+
+def test_webhook_retries(client, config, fake_datadog):
+    # ensure the Cloud Function retries Datadog submissions
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.retry_backoff = 0.001
+    fake_datadog.fail_next(1)
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+
+    assert resp.status_code == 201
+    assert fake_datadog.requests == 2
+    stats = get_dispatcher(config).stats()["datadog"]
+    assert {key: stats[key] for key in ("state", "failures", "rejected", "trips")} == {
+        "state": "closed",
+        "failures": 0,
+        "rejected": 0,
+        "trips": 0,
+    }
+
+
+def test_webhook_circuit_open(client, config, fake_datadog):
+    # ensure the Cloud Function fails fast when Datadog keeps failing
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.export_retries = 0
+    config.breaker_threshold = 2
+    fake_datadog.error_rate = 1.0
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    for _ in range(3):
+        resp = client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer good_token")],
+            json=payload,
+        )
+        assert resp.status_code == 503
+        assert json.loads(resp.data)["exporters"] == ["datadog"]
+
+    assert fake_datadog.requests == 2
+    assert get_dispatcher(config).stats()["datadog"]["state"] == "open"
@@ -0,0 +1,102 @@
+import json
+
+from flask import url_for
+
+from hev.responses import (
+    FAILED,
+    NOT_AUTHORIZED,
+    REPLIES,
+    SUCCESS,
+    TEXTS,
+    Responses,
+    Template,
+)
+
+
+def test_catalog_complete():
+    # ensure every language has the fulfillment text of every reply
+    keys = {key for _, _, key in REPLIES.values()}
+    for language, texts in TEXTS.items():
+        assert set(texts) == keys, language
+
+
+def test_reply_cached():
+    # ensure constant replies are serialized once
+    responses = Responses()
+    response, status = responses.reply(SUCCESS)
+    assert status == 201
+    assert json.loads(response) == {
+        "message": "Success",
+        "fulfillmentText": TEXTS["en"]["recorded"],
+    }
+    assert responses.reply(SUCCESS) is responses.reply(SUCCESS)
+    assert responses.reply(NOT_AUTHORIZED)[1] == 401
+
+
+def test_reply_language():
+    # ensure replies are localized with the DialogFlow language code
+    responses = Responses()
+    assert responses.language("it") == "it"
+    assert responses.language("it-IT") == "it"
+    assert responses.language("PT-br") == "en"
+    assert responses.language(None) == "en"
+    assert responses.language(["it"]) == "en"
+
+    response, _ = responses.reply(FAILED, "fr-CA")
+    assert json.loads(response)["fulfillmentText"] == TEXTS["fr"]["failed"]
+
+
+def test_template():
+    # ensure templates render valid JSON documents around their field
+    template = Template({"message": "Failed", "exporters": None}, "exporters", 503)
+    response, status = template.render(["datadog", 'quoted "name"'])
+    assert status == 503
+    assert json.loads(response) == {
+        "message": "Failed",
+        "exporters": ["datadog", 'quoted "name"'],
+    }
+
+
+def test_dynamic_replies():
+    # ensure failed exporters and validation errors are part of the reply
+    responses = Responses()
+    response, status = responses.failed(["datadog"], "de")
+    assert status == 503
+    assert json.loads(response) == {
+        "message": "Failed",
+        "exporters": ["datadog"],
+        "fulfillmentText": TEXTS["de"]["failed"],
+    }
+
+    response, status = responses.bad_request("Missing mandatory fields", "es")
+    assert status == 400
+    assert json.loads(response) == {
+        "message": "Missing mandatory fields",
+        "fulfillmentText": TEXTS["es"]["not-understood"],
+    }
+
+
+def test_webhook_localized(client, config):
+    # ensure the Cloud Function replies in the language of the request
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    query = {"parameters": {"bpm": 60, "min": 80, "max": 120}, "languageCode": "it"}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json={"queryResult": query},
+    )
+    assert resp.status_code == 201
+    assert json.loads(resp.data)["fulfillmentText"] == TEXTS["it"]["recorded"]
+
+    query["parameters"] = {}
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json={"queryResult": query},
+    )
+    assert resp.status_code == 400
+    assert json.loads(resp.data)["fulfillmentText"] == TEXTS["it"]["not-understood"]
@@ -0,0 +1,73 @@
+import pytest
+
+from benchmarks.bench_schema import PAYLOAD, compiled, legacy
+from hev.exceptions import BadRequest
+from hev.schema import PARAMETERS, Field, Reading, compile_schema, extract_reading
+
+
+def test_parameters_schema():
+    # ensure the schema defines all HEV parameters
+    assert [field.name for field in PARAMETERS] == ["bpm", "min", "max"]
+
+
+def test_extract_reading():
+    # ensure a valid payload is extracted in a Reading instance
+    reading = extract_reading({"bpm": 60, "min": 80.5, "max": 120, "other": "x"})
+
+    assert isinstance(reading, Reading)
+    assert (reading.bpm, reading.min, reading.max) == (60, 80.5, 120)
+
+
+def test_reading_slots():
+    # ensure readings don't allocate a __dict__
+    reading = Reading(60, 80, 120)
+    with pytest.raises(AttributeError):
+        reading.other = 1
+
+
+def test_extract_reading_missing():
+    # ensure missing fields are reported with the legacy message
+    with pytest.raises(BadRequest) as e:
+        extract_reading({"bpm": 60})
+    assert str(e.value) == "Missing mandatory fields: ['min', 'max']"
+
+
+def test_extract_reading_not_dict():
+    # ensure malformed parameters are reported as missing fields
+    with pytest.raises(BadRequest) as e:
+        extract_reading(None)
+    assert str(e.value) == "Missing mandatory fields: ['bpm', 'min', 'max']"
+
+
+def test_extract_reading_all_errors():
+    # ensure all errors are collected in a single pass
+    with pytest.raises(BadRequest) as e:
+        extract_reading({"bpm": "60", "max": 1000})
+    assert str(e.value) == (
+        "Missing mandatory fields: ['min']; "
+        "Invalid fields: {'bpm': 'must be a number', "
+        "'max': 'must be between 40 and 300 mmHg'}"
+    )
+
+
+def test_extract_reading_bool():
+    # ensure booleans are not considered numbers
+    with pytest.raises(BadRequest):
+        extract_reading({"bpm": True, "min": 80, "max": 120})
+
+
+def test_compile_schema_factory():
+    # ensure custom schemas and factories can be compiled
+    extract = compile_schema([Field("a", 0, 10), Field("b")], lambda *v: v)
+
+    assert extract({"a": 1, "b": -100}) == (1, -100)
+    with pytest.raises(BadRequest) as e:
+        extract({"a": 11, "b": 1})
+    assert str(e.value) == "Invalid fields: {'a': 'must be between 0 and 10'}"
+
+
+def test_bench_schema():
+    # ensure the benchmark compares validators on the same parsed payload
+    assert compiled(PAYLOAD) == legacy(PAYLOAD) == (60, 80, 120)
+    with pytest.raises(BadRequest):
+        compiled({"queryResult": {}})
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+import hev
+import pytest
+
+from werkzeug.test import Client
+
+from hev.server import HealthMiddleware, Server, Worker, parse_args, parse_bind
+
+PAYLOAD = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"app"]
+
+
+def test_health_probes():
+    # ensure probes are answered by the middleware
+    ready = [True]
+    client = Client(HealthMiddleware(app, ready=lambda: ready[0]))
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/readyz").status_code == 200
+    assert client.get("/webhook").get_data() == b"app"
+
+    ready[0] = False
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert json.loads(response.get_data()) == {"status": "draining"}
+    assert client.get("/healthz").status_code == 200
+
+
+def test_parse_bind():
+    # ensure listening addresses default to all interfaces
+    assert parse_bind("127.0.0.1:8080") == ("127.0.0.1", 8080)
+    assert parse_bind(":9000") == ("0.0.0.0", 9000)
+
+
+def test_worker_drain_delay():
+    # ensure a draining worker fails readiness probes while still serving
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    url = "http://127.0.0.1:{}".format(sock.getsockname()[1])
+    worker = Worker(sock, app, graceful_timeout=1, drain_delay=1.0)
+    thread = threading.Thread(target=worker.serve)
+    thread.start()
+    try:
+        assert wait_ready(url)
+        worker.stop()
+        deadline = time.monotonic() + 5
+        while not worker.draining and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert request(url + "/readyz") == 503
+        assert request(url + "/webhook") == 200
+    finally:
+        worker.stop()
+        thread.join(10)
+        sock.close()
+    assert not thread.is_alive()
+
+
+def test_signal_handlers():
+    # ensure signal handlers only record signals, without taking locks
+    server = Server(app, ("127.0.0.1", 0))
+    server._on_signal(signal.SIGHUP, None)
+    assert server._signals == [signal.SIGHUP]
+
+    server._wakeup = os.pipe()
+    for fd in server._wakeup:
+        os.set_blocking(fd, False)
+    try:
+        # a full pipe still wakes up the loop
+        for _ in range(100000):
+            server._on_signal(signal.SIGCHLD, None)
+        server._drain_wakeup()
+        with pytest.raises(BlockingIOError):
+            os.read(server._wakeup[0], 1)
+    finally:
+        for fd in server._wakeup:
+            os.close(fd)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    worker = Worker(sock, app, graceful_timeout=1)
+    thread = threading.Thread(target=worker.serve)
+    thread.start()
+    try:
+        worker._on_signal(signal.SIGTERM, None)
+        thread.join(5)
+    finally:
+        worker.stop()
+        thread.join(10)
+        sock.close()
+    assert not thread.is_alive()
+
+
+def test_parse_args_defaults(monkeypatch):
+    # ensure defaults are read without loading the global configuration
+    monkeypatch.delattr(hev, "conf", raising=False)
+    monkeypatch.setenv("SERVER_WORKERS", "4")
+    monkeypatch.setenv("SERVER_DRAIN_DELAY", "2")
+    args = parse_args([])
+    assert args.workers == 4
+    assert args.drain_delay == 2.0
+    assert "conf" not in vars(hev)
+
+
+def start_server(**env):
+    environ = dict(os.environ, DRY_RUN="true", SERVER_DRAIN_DELAY="0.2", **env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "hev.server", "--bind", "127.0.0.1:0", "--workers", "2"],
+        env=environ,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    for line in process.stderr:
+        if "Listening on" in line:
+            address = line.split("Listening on ")[1].split()[0]
+            return process, "http://" + address
+    process.wait()
+    return process, None
+
+
+def request(url, data=None):
+    headers = {"Authorization": "Bearer token", "Content-Type": "application/json"}
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_ready(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if request(url + "/readyz") == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def worker_pids(server):
+    output = subprocess.run(
+        ["ps", "-o", "pid=", "--ppid", str(server.pid)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return sorted(int(pid) for pid in output.split())
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="workers are forked")
+def test_server_lifecycle():
+    # ensure workers serve requests, are replaced on reload or crash, and
+    # the server stops gracefully
+    server, url = start_server(
+        DD_API_KEY="key", FUNCTION_NAME="hev", BEARER_TOKEN="token"
+    )
+    try:
+        assert url is not None
+        assert wait_ready(url)
+        assert request(url + "/webhook", json.dumps(PAYLOAD).encode()) == 201
+        assert request(url + "/healthz") == 200
+
+        # a crashed worker is replaced
+        workers = worker_pids(server)
+        assert len(workers) == 2
+        os.kill(workers[0], signal.SIGKILL)
+        time.sleep(1.5)
+        assert workers[0] not in worker_pids(server)
+        assert len(worker_pids(server)) == 2
+
+        # reloads replace all workers
+        workers = worker_pids(server)
+        server.send_signal(signal.SIGHUP)
+        time.sleep(1.5)
+        assert wait_ready(url)
+        assert not set(workers) & set(worker_pids(server))
+        assert request(url + "/webhook", json.dumps(PAYLOAD).encode()) == 201
+
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=10) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+        server.stderr.close()
+
+
+def test_server_invalid_config():
+    # ensure the configuration is validated before starting workers
+    server, url = start_server(DD_TRANSPORT="unknown")
+    server.stderr.close()
+    assert url is None
+    assert server.wait(timeout=10) == 2
@@ -0,0 +1,261 @@
+import time
+
+from hev.api import DatadogAPI
+from hev.exporters import get_dispatcher
+from hev.ratelimit import RateLimitedExporter, RateLimiter
+from hev.resilience import CircuitBreaker, ResilientExporter, RetryPolicy
+from hev.spool import Spool, SpoolingExporter, main
+from hev.tenants import Tenant
+
+
+def test_spool_append(tmpdir):
+    # ensure points are stored with a timestamp
+    spool = Spool(str(tmpdir.join("spool.db")))
+    spool.append([{"metric": "a", "points": 1}, {"metric": "b", "points": [(10, 2)]}])
+
+    assert len(spool) == 2
+    assert spool.pending is True
+
+
+def test_spool_deduplicate(tmpdir):
+    # ensure the same metric and timestamp is stored only once
+    spool = Spool(str(tmpdir.join("spool.db")))
+    series = [
+        {"metric": "a", "points": [(10, 1)], "tags": ["min"]},
+        {"metric": "a", "points": [(10, 1)], "tags": ["max"]},
+    ]
+    spool.append(series)
+    spool.append(series)
+
+    assert len(spool) == 2
+
+
+def test_spool_eviction(tmpdir, caplog):
+    # ensure the oldest points are evicted when the spool is full
+    spool = Spool(str(tmpdir.join("spool.db")), max_points=3)
+    spool.append([{"metric": "a", "points": [(i, i) for i in range(5)]}])
+    replayed = []
+    spool.replay(lambda series: replayed.extend(series) or True)
+
+    assert replayed == [{"metric": "a", "points": [(2, 2), (3, 3), (4, 4)]}]
+    assert "Spool is full: evicted 2 points" in caplog.text
+
+
+def test_spool_persistence(tmpdir):
+    # ensure points survive a process restart
+    path = str(tmpdir.join("spool.db"))
+    Spool(path).append([{"metric": "a", "points": 1}])
+    spool = Spool(path)
+
+    assert len(spool) == 1
+    assert spool.pending is True
+
+
+def test_spool_replay(tmpdir):
+    # ensure points are replayed in batches, grouped by series
+    spool = Spool(str(tmpdir.join("spool.db")))
+    spool.append(
+        [
+            {"metric": "a", "points": [(1, 1), (2, 2)], "tags": ["min"]},
+            {"metric": "a", "points": [(1, 3)], "tags": ["max"]},
+        ]
+    )
+    batches = []
+    replayed = spool.replay(lambda series: batches.append(series) or True, 2)
+
+    assert replayed == 3
+    assert batches == [
+        [{"metric": "a", "points": [(1.0, 1.0), (2.0, 2.0)], "tags": ["min"]}],
+        [{"metric": "a", "points": [(1.0, 3.0)], "tags": ["max"]}],
+    ]
+    assert len(spool) == 0
+    assert spool.pending is False
+
+
+def test_spool_replay_failure(tmpdir):
+    # ensure points are kept when the replay fails
+    spool = Spool(str(tmpdir.join("spool.db")))
+    spool.append([{"metric": "a", "points": 1}])
+
+    assert spool.replay(lambda series: False) == 0
+    assert len(spool) == 1
+
+
+def test_spool_replay_throughput(tmpdir):
+    # ensure 100k points are spooled and drained in seconds
+    spool = Spool(str(tmpdir.join("spool.db")), max_points=200000)
+    start = time.monotonic()
+    for chunk in range(10):
+        points = [(chunk * 10000 + i, i) for i in range(10000)]
+        spool.append([{"metric": "a", "points": points}])
+    replayed = spool.replay(lambda series: True)
+
+    assert replayed == 100000
+    assert time.monotonic() - start < 5
+
+
+def spooling_client(tmpdir, fake_datadog, retries=0, breaker=None):
+    """Datadog client spooled above its retries, as the dispatcher does"""
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        api_host=fake_datadog.url,
+        spool_path=str(tmpdir.join("spool.db")),
+    )
+    retry = RetryPolicy(retries=retries, backoff=0)
+    exporter = ResilientExporter(api, retry, breaker or CircuitBreaker("datadog"))
+    return api, SpoolingExporter(exporter, api)
+
+
+def send_parameters(exporter, bpm, min, max, timestamp=10):
+    return exporter.send_many(DatadogAPI.build_parameters(bpm, min, max, timestamp))
+
+
+def test_datadog_spool_failures(tmpdir, fake_datadog):
+    # ensure failed points are spooled and replayed after a success
+    api, exporter = spooling_client(tmpdir, fake_datadog)
+    fake_datadog.fail_next(1)
+    assert send_parameters(exporter, 1, 2, 3) == [False, False, False]
+    assert len(api.spool) == 3
+
+    assert send_parameters(exporter, 4, 5, 6) == [True, True, True]
+    with api._replaying:
+        pass
+    assert len(api.spool) == 0
+    assert len(fake_datadog.series) == 3 + 3
+    assert fake_datadog.series[3]["host"] == "test_config"
+
+
+def test_datadog_spool_tenant_host(tmpdir, fake_datadog):
+    # ensure replayed points keep the host of their tenant
+    api, exporter = spooling_client(tmpdir, fake_datadog)
+    series = Tenant("smith", host="hev-smith").apply(
+        DatadogAPI.build_parameters(60, 80, 120, 10)
+    )
+    fake_datadog.fail_next(1)
+    assert exporter.send_many(series) == [False] * 3
+
+    assert api.replay() == 3
+    assert [s["host"] for s in fake_datadog.series] == ["hev-smith"] * 3
+
+
+def test_datadog_spool_retry_success(tmpdir, fake_datadog):
+    # ensure points are not spooled nor replayed when a retry succeeds
+    api, exporter = spooling_client(tmpdir, fake_datadog, retries=1)
+    fake_datadog.fail_next(1)
+    assert send_parameters(exporter, 1, 2, 3) == [True, True, True]
+    assert len(api.spool) == 0
+    assert api.spool.pending is False
+    assert len(fake_datadog.series) == 3
+
+
+def test_datadog_spool_open_circuit(tmpdir, fake_datadog):
+    # ensure points rejected by an open circuit are spooled
+    breaker = CircuitBreaker("datadog", threshold=1, reset_timeout=60)
+    api, exporter = spooling_client(tmpdir, fake_datadog, breaker=breaker)
+    fake_datadog.fail_next(1)
+    send_parameters(exporter, 1, 2, 3)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    for bpm in range(5):
+        assert send_parameters(exporter, bpm, 80, 120, 20 + bpm) == [False] * 3
+    assert fake_datadog.requests == 1
+    assert len(api.spool) == 6 * 3
+
+
+def test_datadog_spool_rate_limited(tmpdir, fake_datadog):
+    # ensure points of submissions that time out waiting for quota are spooled
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        api_host=fake_datadog.url,
+        spool_path=str(tmpdir.join("spool.db")),
+    )
+    limiter = RateLimiter(rate=0.001, burst=1)
+    limited = RateLimitedExporter(api, limiter, timeout=0.01)
+    retry = RetryPolicy(retries=0, backoff=0)
+    exporter = SpoolingExporter(ResilientExporter(limited, retry), api)
+
+    assert send_parameters(exporter, 60, 80, 120) == [True] * 3
+    assert send_parameters(exporter, 61, 80, 120) == [False] * 3
+    assert len(api.spool) == 3
+    assert len(fake_datadog.series) == 3
+
+
+def test_datadog_spool_replay(tmpdir, fake_datadog):
+    # ensure the spool can be replayed explicitly
+    api, exporter = spooling_client(tmpdir, fake_datadog)
+    fake_datadog.fail_next(1)
+    send_parameters(exporter, 1, 2, 3)
+
+    assert api.replay() == 3
+    assert len(fake_datadog.series) == 3
+
+
+def test_datadog_spool_replay_limited(tmpdir, fake_datadog):
+    # ensure background replays go through the wrapped rate limiter
+    api = DatadogAPI(
+        "api_key",
+        "test_config",
+        api_host=fake_datadog.url,
+        spool_path=str(tmpdir.join("spool.db")),
+    )
+    limited = RateLimitedExporter(api, RateLimiter(rate=None, burst=1))
+    exporter = SpoolingExporter(limited, api)
+    fake_datadog.fail_next(1)
+    send_parameters(exporter, 1, 2, 3)
+
+    assert send_parameters(exporter, 4, 5, 6) == [True] * 3
+    with api._replaying:
+        pass
+    assert len(api.spool) == 0
+    assert limited.stats()["batches"] == 3
+
+
+def test_dispatcher_spool(tmpdir, config, fake_datadog):
+    # ensure the dispatcher spools Datadog points above the retries
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.spool_path = str(tmpdir.join("spool.db"))
+    config.export_retries = 1
+    config.retry_backoff = 0
+
+    dispatcher = get_dispatcher(config)
+    (exporter,) = dispatcher.exporters
+    assert isinstance(exporter, SpoolingExporter)
+
+    fake_datadog.fail_next(1)
+    series = dispatcher.build_parameters(60, 80, 120, timestamp=10)
+    assert dispatcher.dispatch(series) == {"datadog": [True, True, True]}
+    assert len(fake_datadog.series) == 3
+    assert len(exporter.client.spool) == 0
+
+
+def test_spool_command(tmpdir, config, fake_datadog, monkeypatch):
+    # ensure the replay command drains the spool
+    path = str(tmpdir.join("spool.db"))
+    Spool(path).append([{"metric": "a", "points": 1}])
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+
+    assert main(["--path", path]) == 0
+    assert len(Spool(path)) == 0
+    assert fake_datadog.series[0]["metric"] == "a"
+
+
+def test_spool_command_dry_run(tmpdir, config, fake_datadog):
+    # ensure the replay command sends nothing and keeps points in dry-run mode
+    path = str(tmpdir.join("spool.db"))
+    Spool(path).append([{"metric": "a", "points": 1}])
+    config.dd_api_key = "api_key"
+    config.dd_api_host = fake_datadog.url
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+
+    assert main(["--path", path]) == 0
+    assert len(Spool(path)) == 1
+    assert fake_datadog.requests == 0
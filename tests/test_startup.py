@@ -0,0 +1,36 @@
+import sys
+import subprocess
+
+from benchmarks.bench_startup import HEAVY_MODULES, first_call, import_time
+
+
+def test_import_is_lazy():
+    # ensure importing the Cloud Function doesn't load heavy dependencies
+    # nor the configuration
+    code = (
+        "import sys, hev, functions; "
+        "print([m for m in %r if m in sys.modules]); "
+        "print('conf' in vars(hev))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code % (HEAVY_MODULES + ["flask"])],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    assert result.stdout.decode().split() == ["[]", "False"]
+
+
+def test_first_call():
+    # ensure the startup benchmark serves the first request
+    result = first_call()
+    assert result["status"] == 201
+    assert result["heavy_modules"] == []
+    assert result["import"] > 0
+    assert result["first_call"] > 0
+
+
+def test_import_time():
+    # ensure the importtime report is parsed
+    report = import_time()
+    assert report["total"] > 0
+    assert len(report["top"]) == 10
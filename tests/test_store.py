@@ -0,0 +1,151 @@
+import json
+import time
+
+import pytest
+
+from flask import url_for
+
+from hev.exporters import Exporter
+from hev.store import Ring, Store, StoreExporter, as_records, main
+
+np = pytest.importorskip("numpy")
+
+
+def test_ring_append_range(tmpdir):
+    # ensure readings are returned by time range
+    ring = Ring(str(tmpdir.join("ring")), capacity=100)
+    ring.append([10, 20, 30], [60, 61, 62], [120, 121, 122], [80, 81, 82])
+    assert len(ring) == 3
+
+    rows = ring.range(15, 30)
+    assert rows.tolist() == [[20.0], [61.0], [121.0], [81.0]]
+    assert ring.range().shape == (4, 3)
+    assert ring.range(40, 50).shape == (4, 0)
+
+
+def test_ring_overwrites_oldest(tmpdir):
+    # ensure a full ring keeps the most recent readings
+    ring = Ring(str(tmpdir.join("ring")), capacity=10)
+    for start in range(0, 25, 5):
+        timestamps = list(range(start, start + 5))
+        ring.append(timestamps, timestamps, timestamps, timestamps)
+
+    assert len(ring) == 10
+    assert ring.range()[0].tolist() == list(range(15, 25))
+    assert ring.range(12, 18)[0].tolist() == [15, 16, 17]
+
+
+def test_ring_out_of_order(tmpdir):
+    # ensure late readings are merged in time order, also across the wrap
+    ring = Ring(str(tmpdir.join("ring")), capacity=8)
+    ring.append([1, 2, 3, 5, 6, 8], [0] * 6, [0] * 6, [0] * 6)
+    ring.append([7, 4, 9], [70, 40, 90], [0] * 3, [0] * 3)
+
+    rows = ring.range()
+    assert rows[0].tolist() == [2, 3, 4, 5, 6, 7, 8, 9]
+    assert rows[1].tolist() == [0, 0, 40, 0, 0, 70, 0, 90]
+
+
+def test_ring_persistence(tmpdir):
+    # ensure readings survive reopening and the capacity is preserved
+    path = str(tmpdir.join("ring"))
+    ring = Ring(path, capacity=10)
+    ring.append([1, 2], [60, 61], [120, 121], [80, 81])
+    ring.close()
+
+    ring = Ring(path, capacity=1000)
+    assert ring.capacity == 10
+    assert ring.range()[1].tolist() == [60, 61]
+
+    tmpdir.join("other").write(b"\0" * 128)
+    with pytest.raises(ValueError):
+        Ring(str(tmpdir.join("other")))
+
+
+def test_downsample(tmpdir):
+    # ensure windows report min, avg and max of each field
+    store = Store(str(tmpdir))
+    timestamps = np.arange(0, 7200, 60.0)
+    bpm = np.where(timestamps < 3600, 60.0, 80.0)
+    bpm[0] = 50.0
+    diastolic = np.full(len(timestamps), np.nan)
+    store.append("smith", timestamps, bpm, bpm + 60, diastolic)
+
+    records = as_records(store.downsample("smith", 0, 7200, 3600))
+    assert [r["timestamp"] for r in records] == [0, 3600]
+    assert [r["count"] for r in records] == [60, 60]
+    assert records[0]["bpm"] == {"min": 50.0, "avg": 59 + 50 / 60.0, "max": 60.0}
+    assert records[1]["systolic"] == {"min": 140.0, "avg": 140.0, "max": 140.0}
+    assert records[1]["diastolic"] == {"min": None, "avg": None, "max": None}
+
+    assert as_records(store.downsample("unknown", 0, 7200, 3600)) == []
+
+
+def test_downsample_year(tmpdir):
+    # ensure a year of readings is downsampled in milliseconds
+    store = Store(str(tmpdir))
+    timestamps = np.arange(0, 365 * 86400, 60.0)
+    values = np.full(len(timestamps), 60.0)
+    store.append(None, timestamps, values, values, values)
+
+    start = time.perf_counter()
+    windows = store.downsample(None, 0, 365 * 86400, 3600)
+    elapsed = time.perf_counter() - start
+    assert len(windows["timestamp"]) == 365 * 24
+    assert elapsed < 0.5
+
+
+def test_store_exporter(tmpdir):
+    # ensure readings are rebuilt from series of each tenant
+    store = Store(str(tmpdir))
+    exporter = StoreExporter(store)
+    series = Exporter.build_parameters(60, 80, 120, 1000)
+    tagged = [dict(s, tags=(s.get("tags") or []) + ["tenant:smith"]) for s in series]
+    other = {"metric": "hev.internal.latency", "points": [(1000, 5)]}
+    assert exporter.send_many(series + tagged + [other]) == [True] * 7
+
+    assert store.tenants() == ["default", "smith"]
+    assert store.range(None).tolist() == [[1000], [60], [120], [80]]
+    assert store.range("smith").tolist() == [[1000], [60], [120], [80]]
+
+
+def test_store_command(tmpdir, capsys):
+    # ensure the command prints downsampled windows as JSON lines
+    store = Store(str(tmpdir))
+    store.append("smith", [0, 60, 3600], [60, 62, 70], [120] * 3, [80] * 3)
+
+    argv = ["--path", str(tmpdir), "--tenant", "smith", "--start", "0"]
+    assert main(argv + ["--end", "7200"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)["bpm"]["avg"] for line in lines] == [61.0, 70.0]
+
+    assert main(["--path", str(tmpdir), "--tenants"]) == 0
+    assert capsys.readouterr().out == "smith\n"
+
+
+def test_webhook_readings(client, config, tmpdir):
+    # ensure webhook readings can be read back from the local store
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_tokens = "smith=good_token"
+    config.exporters = ["store"]
+    config.store_path = str(tmpdir)
+    headers = [("Authorization", "Bearer good_token")]
+
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+    resp = client.post(url_for("webhook"), headers=headers, json=payload)
+    assert resp.status_code == 201
+
+    resp = client.get(url_for("readings", interval=60), headers=headers)
+    assert resp.status_code == 200
+    (window,) = json.loads(resp.data)["windows"]
+    assert window["count"] == 1
+    assert window["bpm"] == {"min": 60, "avg": 60, "max": 60}
+
+    resp = client.get(url_for("readings", interval="hourly"), headers=headers)
+    assert resp.status_code == 400
+    for args in ({"interval": "nan"}, {"end": "nan"}, {"start": "-inf"}):
+        resp = client.get(url_for("readings", **args), headers=headers)
+        assert resp.status_code == 400
+    resp = client.get(url_for("readings"))
+    assert resp.status_code == 401
@@ -0,0 +1,255 @@
+import os
+import json
+import hashlib
+import pytest
+
+from flask import request, url_for
+
+from hev import tenants
+from hev.aggregation import AggregatingExporter
+from hev.auth import authenticate
+from hev.exceptions import ConfigException, NotAuthorized
+from hev.exporters import Exporter, MemoryExporter, get_dispatcher
+from hev.idempotency import request_key
+from hev.tenants import (
+    FileTokenRegistry,
+    Tenant,
+    TokenRegistry,
+    get_registry,
+    hash_token,
+)
+
+
+class FakeClock(object):
+    """Clock that moves only when asked"""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def write_tokens(path, tenants, mtime=None):
+    path.write(json.dumps({"tenants": tenants}))
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+
+
+def test_tenant_apply():
+    # ensure tenant tags and host are added to series
+    tenant = Tenant("smith", host="hev-smith", tags=["family:smith"])
+    series = tenant.apply(Exporter.build_parameters(60, 80, 120))
+    assert series[0]["tags"] == ["tenant:smith", "family:smith"]
+    assert series[1]["tags"] == ["min", "tenant:smith", "family:smith"]
+    assert {s["host"] for s in series} == {"hev-smith"}
+
+
+def test_anonymous_tenant():
+    # ensure the single token tenant doesn't change series
+    series = Exporter.build_parameters(60, 80, 120)
+    assert Tenant().apply(series) is series
+
+
+def test_registry_resolve():
+    # ensure tokens are resolved to their tenant
+    registry = TokenRegistry.from_env("smith=token-1, jones=token-2")
+    assert registry.resolve("token-1").name == "smith"
+    assert registry.resolve("token-2").name == "jones"
+    assert registry.resolve("token-3") is None
+    assert registry.resolve("") is None
+    assert len(registry) == 2
+
+
+def test_registry_stores_digests():
+    # ensure plain tokens are not kept in memory
+    registry = TokenRegistry.from_token("secret-token")
+    assert list(registry._index) == [hash_token("secret-token")]
+    assert registry.resolve("secret-token").name is None
+
+
+def test_registry_from_env_invalid():
+    # ensure malformed BEARER_TOKENS are reported
+    with pytest.raises(ConfigException):
+        TokenRegistry.from_env("smith")
+
+
+def test_registry_from_file(tmpdir):
+    # ensure tokens are loaded in plain or as SHA-256 digests
+    path = tmpdir.join("tokens.json")
+    write_tokens(
+        path,
+        [
+            {"name": "smith", "token": "token-1", "tags": ["family:smith"]},
+            {
+                "name": "jones",
+                "token_sha256": hashlib.sha256(b"token-2").hexdigest(),
+                "host": "hev-jones",
+            },
+        ],
+    )
+    registry = TokenRegistry.from_file(str(path))
+    assert registry.resolve("token-1").tags == ("tenant:smith", "family:smith")
+    assert registry.resolve("token-2").host == "hev-jones"
+
+
+def test_registry_from_file_invalid(tmpdir):
+    # ensure invalid files are reported as configuration errors
+    path = tmpdir.join("tokens.json")
+    path.write("not json")
+    with pytest.raises(ConfigException):
+        TokenRegistry.from_file(str(path))
+    with pytest.raises(ConfigException):
+        TokenRegistry.from_file(str(tmpdir.join("missing.json")))
+
+
+def test_file_registry_reload(tmpdir):
+    # ensure the file is reloaded when it changes, without a restart
+    path = tmpdir.join("tokens.json")
+    write_tokens(path, [{"name": "smith", "token": "token-1"}], mtime=1000)
+    clock = FakeClock()
+    registry = FileTokenRegistry(str(path), check_interval=5, clock=clock)
+    assert registry.resolve("token-1").name == "smith"
+
+    write_tokens(path, [{"name": "jones", "token": "token-2"}], mtime=2000)
+    assert registry.resolve("token-2") is None
+
+    clock.now = 5
+    assert registry.resolve("token-2").name == "jones"
+    assert registry.resolve("token-1") is None
+
+
+def test_file_registry_keeps_tokens(tmpdir):
+    # ensure tokens are kept when the new file is not valid
+    path = tmpdir.join("tokens.json")
+    write_tokens(path, [{"name": "smith", "token": "token-1"}], mtime=1000)
+    clock = FakeClock()
+    registry = FileTokenRegistry(str(path), check_interval=5, clock=clock)
+
+    path.write("{")
+    os.utime(str(path), (2000, 2000))
+    clock.now = 5
+    assert registry.resolve("token-1").name == "smith"
+
+
+def test_get_registry(config, tmpdir):
+    # ensure the tokens file takes precedence over tokens in the environment
+    assert get_registry(config) is None
+
+    config.bearer_token = "token"
+    assert get_registry(config).resolve("token").name is None
+    assert get_registry(config) is get_registry(config)
+
+    config.bearer_tokens = "smith=token-1"
+    assert get_registry(config).resolve("token") is None
+    assert get_registry(config).resolve("token-1").name == "smith"
+
+    path = tmpdir.join("tokens.json")
+    write_tokens(path, [{"name": "jones", "token": "token-2"}])
+    config.tokens_path = str(path)
+    assert get_registry(config).resolve("token-2").name == "jones"
+
+
+def test_get_registry_cached(config, monkeypatch):
+    # ensure cached registries are returned without taking the lock
+    config.bearer_token = "token"
+    registry = get_registry(config)
+
+    class CountingLock(object):
+        def __init__(self, lock):
+            self.lock = lock
+            self.count = 0
+
+        def __enter__(self):
+            self.count += 1
+            return self.lock.__enter__()
+
+        def __exit__(self, *exc_info):
+            return self.lock.__exit__(*exc_info)
+
+    lock = CountingLock(tenants._registry_lock)
+    monkeypatch.setattr(tenants, "_registry_lock", lock)
+    assert get_registry(config) is registry
+    assert lock.count == 0
+
+    config.bearer_token = "other"
+    assert get_registry(config) is not registry
+    assert lock.count == 1
+
+
+def test_authenticate(app):
+    # ensure requests are authenticated with the token registry
+    registry = TokenRegistry.from_env("smith=token-1")
+    with app.test_request_context(
+        environ_base={"HTTP_AUTHORIZATION": "Bearer token-1"}
+    ):
+        assert authenticate(request, registry).name == "smith"
+    with app.test_request_context(
+        environ_base={"HTTP_AUTHORIZATION": "Bearer token-2"}
+    ):
+        with pytest.raises(NotAuthorized):
+            authenticate(request, registry)
+    with app.test_request_context():
+        with pytest.raises(NotAuthorized):
+            authenticate(request, registry)
+
+
+def test_config_validate_tenants(config):
+    # ensure BEARER_TOKEN is not required when tenants are configured
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_tokens = "smith=token-1"
+    assert config.validate() is None
+
+
+def test_aggregation_keeps_host():
+    # ensure aggregated series keep the tenant host
+    memory = MemoryExporter()
+    aggregator = AggregatingExporter(memory)
+    tenant = Tenant("smith", host="hev-smith")
+    aggregator.send_many(tenant.apply(Exporter.build_parameters(60, 80, 120)))
+    aggregator.send_many(Exporter.build_parameters(60, 80, 120))
+    aggregator.close()
+    assert {s.get("host") for s in memory.series} == {"hev-smith", None}
+
+
+def test_request_key_namespace():
+    # ensure requests of different tenants never share a key
+    data = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+    assert request_key(data, "smith") != request_key(data, "jones")
+    assert request_key(data, "smith").startswith("smith:sha256:")
+
+
+def test_webhook_tenants(client, config):
+    # ensure metrics are tagged with the tenant that owns the token
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_tokens = "smith=token-1,jones=token-2"
+    config.exporters = ["memory"]
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    for token in ("token-1", "token-2", "token-3"):
+        client.post(
+            url_for("webhook"),
+            headers=[("Authorization", "Bearer " + token)],
+            json=payload,
+        )
+
+    memory = get_dispatcher(config).exporters[0].exporter
+    tenants = [s["tags"][-1] for s in memory.series]
+    assert tenants == ["tenant:smith"] * 3 + ["tenant:jones"] * 3
+
+
+def test_webhook_unknown_token(client, config):
+    # ensure unknown tokens are not authorized
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_tokens = "smith=token-1"
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer token-2")],
+        json=payload,
+    )
+    assert resp.status_code == 401
@@ -0,0 +1,187 @@
+import json
+import asyncio
+import logging
+import pytest
+
+from flask import url_for
+
+from functions.webhooks import report_latency
+from hev import worker
+from hev.exporters import Dispatcher, Exporter, get_dispatcher
+from hev.tracing import LATENCY_METRIC, span, trace
+
+
+class TracedExporter(Exporter):
+    """Exporter that records a span for each submission"""
+
+    name = "traced"
+
+    @span("traced.send_many")
+    def send_many(self, series):
+        return [True] * len(series)
+
+
+def traces(caplog):
+    """Return traces logged as JSON documents"""
+    return [
+        json.loads(record.getMessage().split(" ", 1)[1])
+        for record in caplog.records
+        if record.getMessage().startswith("Trace: ")
+    ]
+
+
+def test_span_without_trace():
+    # ensure spans are no-op outside of a trace
+    with span("stage") as s:
+        pass
+    assert s.stage == "stage"
+
+
+def test_trace_spans(caplog):
+    # ensure spans of a trace are logged as a JSON document
+    caplog.set_level(logging.INFO)
+
+    @span("decorated")
+    def decorated():
+        return 42
+
+    with trace("request") as t:
+        with span("first"):
+            pass
+        assert decorated() == 42
+
+    (logged,) = traces(caplog)
+    assert [s[0] for s in t.spans] == ["first", "decorated"]
+    assert logged["trace"] == "request"
+    assert [s["stage"] for s in logged["spans"]] == ["first", "decorated"]
+    assert logged["duration_ms"] >= sum(s["duration_ms"] for s in logged["spans"])
+
+
+def test_trace_coroutine_spans():
+    # ensure decorated coroutines are measured until they complete
+    @span("sleep")
+    async def sleep():
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def run():
+        with trace("request") as t:
+            assert await sleep() == 42
+        return t
+
+    t = asyncio.run(run())
+    ((stage, duration, _),) = t.spans
+    assert stage == "sleep"
+    assert duration >= 0.01
+
+
+def test_trace_errors(caplog):
+    # ensure exceptions are reported in spans and in the trace
+    caplog.set_level(logging.INFO)
+    with pytest.raises(ValueError):
+        with trace("request"):
+            with span("broken"):
+                raise ValueError("boom")
+
+    (logged,) = traces(caplog)
+    assert logged["error"] == "ValueError"
+    assert logged["spans"][0]["error"] == "ValueError"
+
+
+def test_trace_sampling(caplog):
+    # ensure requests are not traced when they're not sampled
+    caplog.set_level(logging.INFO)
+    with trace("request", sample_rate=0) as t:
+        with span("stage"):
+            pass
+    assert t is None
+    assert traces(caplog) == []
+
+
+def test_trace_sink():
+    # ensure spans are sent to the sink as latency series tagged by stage
+    received = []
+    with trace("request", sink=received.extend):
+        with span("stage"):
+            pass
+
+    assert [s["metric"] for s in received] == [LATENCY_METRIC] * 2
+    assert [s["tags"] for s in received] == [["stage:request"], ["stage:stage"]]
+    assert all(s["points"][0][1] >= 0 for s in received)
+
+
+def test_trace_dispatcher_threads():
+    # ensure exporters spans are recorded even if exporters run in other threads
+    dispatcher = Dispatcher([TracedExporter()])
+    with trace("request") as t:
+        dispatcher.dispatch(Exporter.build_parameters(60, 80, 120))
+    assert [s[0] for s in t.spans] == ["traced.send_many"]
+
+
+def test_webhook_tracing(client, config, caplog):
+    # ensure the Cloud Function logs time spent in each stage
+    caplog.set_level(logging.INFO)
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.dry_run = True
+    config.trace_sample_rate = 1.0
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+
+    assert resp.status_code == 201
+    (logged,) = traces(caplog)
+    assert logged["trace"] == "webhook"
+    assert [s["stage"] for s in logged["spans"]] == [
+        "auth",
+        "dialogflow.parse",
+        "dialogflow.validate",
+        "exporters.setup",
+        "datadog.throttle",
+        "datadog.send_many",
+        "exporters.dispatch",
+    ]
+
+
+def test_webhook_tracing_metrics(client, config):
+    # ensure latency self-metrics are queued for exporters
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.bearer_token = "good_token"
+    config.exporters = ["memory"]
+    config.trace_sample_rate = 1.0
+    config.trace_metrics = True
+    payload = {"queryResult": {"parameters": {"bpm": 60, "min": 80, "max": 120}}}
+
+    resp = client.post(
+        url_for("webhook"),
+        headers=[("Authorization", "Bearer good_token")],
+        json=payload,
+    )
+    worker.shutdown()
+
+    assert resp.status_code == 201
+    memory = get_dispatcher(config).exporters[0].exporter
+    stages = [s["tags"][0] for s in memory.series if s["metric"] == LATENCY_METRIC]
+    assert "stage:webhook" in stages
+    assert "stage:auth" in stages
+
+
+def test_report_latency_queue(config):
+    # ensure latency self-metrics never share the queue of readings
+    config.dd_api_key = "api_key"
+    config.function_name = "test_config"
+    config.exporters = ["memory"]
+    worker.shutdown()
+
+    report_latency(config, [{"metric": LATENCY_METRIC, "points": 5}])
+    assert worker._queue is None
+    worker.get_metrics_queue().flush(timeout=5)
+    memory = get_dispatcher(config).exporters[0].exporter
+    assert memory.series[-1]["metric"] == LATENCY_METRIC
+    worker.shutdown()
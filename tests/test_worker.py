@@ -0,0 +1,179 @@
+import threading
+
+from hev.constants import QUEUE_BLOCK, QUEUE_DROP_OLDEST, QUEUE_REJECT
+from hev.worker import ExportQueue, get_metrics_queue, get_queue, shutdown
+
+
+class FakeAPI(object):
+    """Fake DatadogAPI that records submitted series"""
+
+    def __init__(self, failures=0, gate=None):
+        self.calls = []
+        self.failures = failures
+        self.gate = gate
+
+    def send_many(self, series):
+        if self.gate is not None:
+            self.gate.wait()
+        self.calls.append(list(series))
+        if self.failures > 0:
+            self.failures -= 1
+            return [False] * len(series)
+        return [True] * len(series)
+
+
+def test_queue_flush():
+    # ensure queued series are submitted by the background worker
+    api = FakeAPI()
+    queue = ExportQueue()
+    assert queue.put(api, [{"metric": "a", "points": 1}]) is True
+    assert queue.flush(timeout=5) is True
+    queue.close()
+
+    assert api.calls == [[{"metric": "a", "points": 1}]]
+
+
+def test_queue_merge_batch():
+    # ensure items queued while the worker is busy are merged in one submission
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    queue = ExportQueue()
+    queue.put(api, [{"metric": "a", "points": 1}])
+    # wait until the worker is blocked on the first submission
+    while len(queue):
+        pass
+    queue.put(api, [{"metric": "b", "points": 2}])
+    queue.put(api, [{"metric": "c", "points": 3}])
+    gate.set()
+    queue.close()
+
+    assert len(api.calls) == 2
+    assert [s["metric"] for s in api.calls[1]] == ["b", "c"]
+
+
+def test_queue_retries():
+    # ensure failed series are retried with backoff
+    api = FakeAPI(failures=2)
+    queue = ExportQueue(retries=3, backoff=0.001)
+    queue.put(api, [{"metric": "a", "points": 1}])
+    queue.close()
+
+    assert len(api.calls) == 3
+
+
+def test_queue_retries_exhausted(caplog):
+    # ensure series are dropped and logged when all retries fail
+    api = FakeAPI(failures=10)
+    queue = ExportQueue(retries=2, backoff=0.001)
+    queue.put(api, [{"metric": "a", "points": 1}])
+    queue.close()
+
+    assert len(api.calls) == 3
+    assert "Export queue dropped 1 series" in caplog.text
+
+
+def test_queue_policy_reject():
+    # ensure a full queue rejects new items
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    queue = ExportQueue(maxsize=1, policy=QUEUE_REJECT)
+    queue.put(api, [{"metric": "a", "points": 1}])
+    while len(queue):
+        pass
+    assert queue.put(api, [{"metric": "b", "points": 2}]) is True
+    assert queue.put(api, [{"metric": "c", "points": 3}]) is False
+    gate.set()
+    queue.close()
+
+    assert [c[0]["metric"] for c in api.calls] == ["a", "b"]
+
+
+def test_queue_policy_drop_oldest():
+    # ensure a full queue drops the oldest item
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    queue = ExportQueue(maxsize=1, policy=QUEUE_DROP_OLDEST)
+    queue.put(api, [{"metric": "a", "points": 1}])
+    while len(queue):
+        pass
+    queue.put(api, [{"metric": "b", "points": 2}])
+    assert queue.put(api, [{"metric": "c", "points": 3}]) is True
+    gate.set()
+    queue.close()
+
+    assert queue.dropped == 1
+    assert [c[0]["metric"] for c in api.calls] == ["a", "c"]
+
+
+def test_queue_policy_block():
+    # ensure a full queue blocks the producer until there is room
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    queue = ExportQueue(maxsize=1, policy=QUEUE_BLOCK, block_timeout=0.01)
+    queue.put(api, [{"metric": "a", "points": 1}])
+    while len(queue):
+        pass
+    queue.put(api, [{"metric": "b", "points": 2}])
+    assert queue.put(api, [{"metric": "c", "points": 3}]) is False
+    gate.set()
+    queue.flush(timeout=5)
+    assert queue.put(api, [{"metric": "c", "points": 3}]) is True
+    queue.close()
+
+    assert [c[0]["metric"] for c in api.calls] == ["a", "b", "c"]
+
+
+def test_queue_closed():
+    # ensure a closed queue drains pending items and accepts no more
+    api = FakeAPI()
+    queue = ExportQueue()
+    queue.put(api, [{"metric": "a", "points": 1}])
+    queue.close()
+
+    assert len(api.calls) == 1
+    assert queue.put(api, [{"metric": "b", "points": 2}]) is False
+
+
+def test_get_queue_singleton():
+    # ensure the process-wide queue is created once and can be shut down
+    queue = get_queue()
+    assert get_queue() is queue
+    shutdown()
+    assert get_queue() is not queue
+    shutdown()
+
+
+def test_get_queue_reconfigured():
+    # ensure the queue is replaced when its size or policy change
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    queue = get_queue(10, QUEUE_DROP_OLDEST)
+    queue.put(api, [{"metric": "a", "points": 1}])
+
+    other = get_queue(10, QUEUE_REJECT)
+    assert other is not queue
+    assert get_queue(10, QUEUE_REJECT) is other
+    assert queue.put(api, [{"metric": "b", "points": 2}]) is False
+
+    # series queued before the change are still flushed
+    gate.set()
+    queue.close()
+    assert api.calls == [[{"metric": "a", "points": 1}]]
+    shutdown()
+
+
+def test_get_metrics_queue():
+    # ensure self-metrics have their own queue, that rejects series when full
+    queue = get_metrics_queue()
+    assert get_metrics_queue() is queue
+    assert queue is not get_queue()
+
+    gate = threading.Event()
+    api = FakeAPI(gate=gate)
+    while queue.put(api, [{"metric": "a", "points": 1}]):
+        pass
+    assert queue.dropped == 0
+    gate.set()
+    shutdown()
+    assert get_metrics_queue() is not queue
+    shutdown()
@@ -0,0 +1,18 @@
+from hev.adapters import WSGIApp
+
+from functions import ROUTES
+
+
+def create_wsgi_app():
+    """Create the WSGI application, that serves the Cloud Functions
+    without Flask. It can be served by any WSGI server, such as:
+
+        $ hev-server --app wsgi:create_wsgi_app
+
+    Returns:
+        A WSGI application that routes requests to the core handlers
+    """
+    return WSGIApp(ROUTES)
+
+
+app = create_wsgi_app()